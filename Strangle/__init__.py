@@ -19,6 +19,7 @@
 """An object-oriented library for comprehending DNS messages using BIND parsing"""
 
 import libbind
+import re
 import socket
 import struct
 
@@ -31,6 +32,80 @@ class DNSSectionError(StrangleError):
 class DNSRecordError(StrangleError):
     """Error accessing record in message"""
 
+class FilterError(StrangleError):
+    """Error compiling a filter expression"""
+
+# Section names and their libbind section numbers
+sectionNumbers = { 'question'   : libbind.ns_s_qd,
+		   'answer'     : libbind.ns_s_an,
+		   'authority'  : libbind.ns_s_ns,
+		   'additional' : libbind.ns_s_ar,
+		 }
+
+# Record type names, by libbind type number
+typeNames = { libbind.ns_t_a       : 'A',
+	      libbind.ns_t_ns      : 'NS',
+	      libbind.ns_t_cname   : 'CNAME',
+	      libbind.ns_t_soa     : 'SOA',
+	      libbind.ns_t_null    : 'NULL',
+	      libbind.ns_t_ptr     : 'PTR',
+	      libbind.ns_t_hinfo   : 'HINFO',
+	      libbind.ns_t_mx      : 'MX',
+	      libbind.ns_t_txt     : 'TXT',
+	      libbind.ns_t_sig     : 'SIG',
+	      libbind.ns_t_key     : 'KEY',
+	      libbind.ns_t_aaaa    : 'AAAA',
+	      libbind.ns_t_loc     : 'LOC',
+	      libbind.ns_t_srv     : 'SRV',
+	      libbind.ns_t_naptr   : 'NAPTR',
+	      libbind.ns_t_dname   : 'DNAME',
+	      libbind.ns_t_opt     : 'OPT',
+	      libbind.ns_t_ds      : 'DS',
+	      libbind.ns_t_rrsig   : 'RRSIG',
+	      libbind.ns_t_dnskey  : 'DNSKEY',
+	      libbind.ns_t_cds     : 'CDS',
+	      libbind.ns_t_cdnskey : 'CDNSKEY',
+	      libbind.ns_t_tsig    : 'TSIG',
+	      libbind.ns_t_ixfr    : 'IXFR',
+	      libbind.ns_t_axfr    : 'AXFR',
+	      libbind.ns_t_any     : 'ANY',
+	      libbind.ns_t_zxfr    : 'ZXFR',
+	    }
+
+# Record type numbers, by name
+typeNumbers = dict([(name, number) for number, name in typeNames.items()])
+
+# EDNS0 option codes which libbind.decode_edns() decodes
+EDNS_ECS     = 8
+EDNS_COOKIE  = 10
+EDNS_PADDING = 12
+
+# Record class names, by libbind class number.  Unknown classes are added as
+# they are seen, so that their names are shared too.
+classNames = { libbind.ns_c_in   : 'IN',
+	       libbind.ns_c_none : 'None',
+	     }
+
+# Response codes and opcodes, by name
+rcodeNumbers = { 'NOERROR'  : 0,
+		 'FORMERR'  : 1,
+		 'SERVFAIL' : 2,
+		 'NXDOMAIN' : 3,
+		 'NOTIMP'   : 4,
+		 'REFUSED'  : 5,
+		 'YXDOMAIN' : 6,
+		 'YXRRSET'  : 7,
+		 'NXRRSET'  : 8,
+		 'NOTAUTH'  : 9,
+		 'NOTZONE'  : 10,
+	       }
+opcodeNumbers = { 'QUERY'  : 0,
+		  'IQUERY' : 1,
+		  'STATUS' : 2,
+		  'NOTIFY' : 4,
+		  'UPDATE' : 5,
+		}
+
 class DNSMessage(object):
     """A DNS message.  This is an easy-to-understand object-oriented
     representation of standard DNS queries and responses, based on libbind.
@@ -39,36 +114,178 @@ class DNSMessage(object):
     * id - a number representing the unique query ID
     * flags - a DNSFlags object from the header flags
     * records - A dict; the keys are sections ("question", "authority", etc.) and the
-                values are lists of DNSRecord objects.
+		values are lists of DNSRecord objects.
     
+    * edns - an EDNS object from the OPT record, or None if there is none
+		(decoded on first access)
+
+    To stream through the records instead, iter_records() yields them one at
+    a time as libbind.ns_rr views, filtered by section and type in libbind.
+
     Also there is a "msg" member, which references the low-level libbind.ns_msg object,
-    if you need it.
+    if you need it.  The "parsed" member is the tuple from libbind.parse_message(),
+    or None for a lazy message which has not been parsed in full.
+
+    If the message is created with lazy=True, only the ID and flags are decoded
+    up front.  The sections, their records, and the record fields are decoded
+    the first time they are accessed, and then kept.
+
+    The message classes use __slots__ rather than an instance dict, to keep
+    large numbers of them small.
     """
 
-    def __init__(self, packetData):
-	"""Create a DNSMessage object from a string of the raw DNS message"""
+    __slots__ = ('packetData', 'lazy', 'parsed', 'msg', 'id', 'flags', 'sections', 'edns')
+
+    def __init__(self, packetData, lazy=False, parsed=None):
+	"""Create a DNSMessage object from a string of the raw DNS message
+
+	packetData may also be any object with the buffer interface, such as a
+	bytearray or a buffer into a memory-mapped capture; it is parsed in place.
+	If the message has already been parsed with libbind.parse_message() (or
+	parse_many()), pass the result as "parsed" to avoid parsing it again."""
 
 	# If packetData has a read() method, we use it as for a file.
 	if getattr(packetData, 'read', None) is not None:
 	    packetData = packetData.read()
 	
-	try:
-	    msg = libbind.ns_msg(packetData)
-	except TypeError:
-	    raise StrangleError, "Failed to parse the packet"
-	
-	self.msg = msg
-    
-	self.id       = libbind.ns_msg_id(msg)
-	self.flags    = DNSFlags(msg)
+	self.packetData = packetData
+	self.lazy       = lazy
 
-	self.sections = {}
+	if parsed is None and not lazy:
+	    # The whole message in a single call to libbind.
+	    try:
+		parsed = libbind.parse_message(packetData)
+	    except TypeError:
+		raise StrangleError, "Failed to parse the packet"
+
+	self.parsed = parsed
+
+	if parsed is None:
+	    # Just the header for now.  The sections are parsed from self.msg when needed.
+	    try:
+		msg = libbind.ns_msg(packetData)
+	    except TypeError:
+		raise StrangleError, "Failed to parse the packet"
+
+	    self.msg   = msg
+	    self.id    = msg.id
+	    self.flags = DNSFlags(msg)
+	else:
+	    self.id    = parsed[0]
+	    self.flags = DNSFlags(parsed[1])
+	    if not lazy:
+		self.sections = self.buildSections(parsed[2])
+
+    def __getattr__(self, attr):
+	"""Build the ns_msg and the sections on first access"""
+	if attr == 'msg':
+	    self.msg = libbind.ns_msg(self.packetData)
+	    return self.msg
+	elif attr == 'sections':
+	    if self.parsed is None:
+		self.sections = self.buildSections()
+	    else:
+		self.sections = self.buildSections(self.parsed[2])
+	    return self.sections
+	elif attr == 'edns':
+	    self.edns = self.buildEDNS()
+	    return self.edns
+
+	raise AttributeError, attr
+
+    def __reduce__(self):
+	"""Pickle as the packet and its parsed tuple; the libbind objects are not picklable"""
+	parsed = self.parsed
+	if parsed is None:
+	    try:
+		parsed = libbind.parse_message(self.packetData)
+	    except TypeError:
+		raise StrangleError, "Failed to parse the packet"
+	packetData = self.packetData
+	if type(packetData) is not str:
+	    # Buffers into a mapped file or bytearrays are pickled as their bytes
+	    packetData = str(bytearray(packetData))
+	return (DNSMessage, (packetData, self.lazy, parsed))
+
+    def buildSections(self, parsed=None):
+	"""Return a dict of DNSSection objects for the sections in the message
+
+	parsed is the sections tuple from libbind.parse_message().  Without it,
+	each section is parsed from the ns_msg."""
+	sections = {}
 	for sectionName in ('question', 'answer', 'authority', 'additional'):
+	    # Empty sections are left out of the dict
+	    if parsed is None:
+		if self.msg.count(sectionNumbers[sectionName]) == 0:
+		    continue
+		section = DNSSection(self.msg, section=sectionName, lazy=self.lazy,
+				     packetData=self.packetData)
+	    else:
+		records = parsed[sectionNumbers[sectionName]]
+		if not records:
+		    continue
+		section = DNSSection(None, section=sectionName, lazy=self.lazy,
+				     parsed=records, packetData=self.packetData)
+
+	    sections[sectionName] = section
+
+	return sections
+
+    def buildEDNS(self):
+	"""Return an EDNS object for the first OPT record in the additional section, or None"""
+	if self.parsed is not None:
+	    additional = self.parsed[2][libbind.ns_s_ar]
+	else:
+	    try:
+		additional = libbind.parse_section(self.msg, libbind.ns_s_ar)
+	    except TypeError:
+		raise DNSRecordError, 'The section "additional" has a record which cannot be parsed'
+
+	for record in additional:
+	    if record[1] == libbind.ns_t_opt:
+		return EDNS(record)
+
+	return None
+
+    def iter_records(self, section=None, types=None):
+	"""Yield the records of the message one at a time, without building sections
+
+	section is a section name, or None for all of them, and types a
+	sequence of record type names or numbers to yield, or None for all.
+	The records are libbind.ns_rr views into the packet, with the members
+	name, type, queryClass, ttl, rdlen, rdata and offset (type and
+	queryClass being numbers).  Records of other sections and types are
+	skipped in libbind, so no Python objects are made for them.
+
+	Raises DNSSectionError or DNSRecordError for a bad section or types
+	right away, and DNSRecordError during the iteration when a record cannot
+	be parsed."""
+	if section is None:
+	    sectionNumber = -1
+	else:
 	    try:
-		self.sections[sectionName] = DNSSection(msg, section=sectionName)
-	    except DNSSectionError:
-		# This is normal.  It means that the section does not exist in this message.
-		pass
+		sectionNumber = sectionNumbers[section]
+	    except KeyError:
+		raise DNSSectionError, 'No such section "%s"' % section
+
+	if types is not None:
+	    try:
+		types = [typeNumbers.get(recordType, recordType) for recordType in types]
+		records = self.msg.iter_records(sectionNumber, types)
+	    except (TypeError, ValueError):
+		raise DNSRecordError, "types must be record type names or numbers"
+	else:
+	    records = self.msg.iter_records(sectionNumber)
+
+	return self.yieldRecords(records)
+
+    def yieldRecords(self, records):
+	"""Yield the records of a libbind.ns_records iterator, for iter_records()"""
+	try:
+	    for record in records:
+		yield record
+	except TypeError:
+	    raise DNSRecordError, "A record cannot be parsed"
 
     def __str__(self):
 	info = []
@@ -100,41 +317,32 @@ class DNSFlags(object):
 	reponse            - Integer (server response code)
     """
 
+    __slots__ = ('type', 'opcode', 'authoritative', 'truncated',
+		 'recursionDesired', 'recursionAvailable', 'response')
+
     def __init__(self, msg):
-	"""Fills in all flag values to the object members"""
+	"""Fills in all flag values to the object members
+
+	msg is either an ns_msg object or a flags tuple from libbind.parse_message()"""
 
-	if type(msg) is not libbind.ns_msg:
+	if type(msg) is libbind.ns_msg:
+	    flags = libbind.parse_flags(msg)
+	elif type(msg) is tuple and len(msg) == libbind.ns_f_max:
+	    flags = msg
+	else:
 	    raise StrangleError, "DNSFlags initialized but without an ns_msg"
 
-	isResponse = libbind.ns_msg_getflag(msg, libbind.ns_f_qr)
-	if isResponse:
+	if flags[libbind.ns_f_qr]:
 	    self.type = 'answer'
 	else:
 	    self.type = 'question'
 	
-	self.opcode = libbind.ns_msg_getflag(msg, libbind.ns_f_opcode)
-
-	if libbind.ns_msg_getflag(msg, libbind.ns_f_aa):
-	    self.authoritative = True
-	else:
-	    self.authoritative = False
-	
-	if libbind.ns_msg_getflag(msg, libbind.ns_f_tc):
-	    self.truncated = True
-	else:
-	    self.truncated = False
-	
-	if libbind.ns_msg_getflag(msg, libbind.ns_f_rd):
-	    self.recursionDesired = True
-	else:
-	    self.recursionDesired = False
-	
-	if libbind.ns_msg_getflag(msg, libbind.ns_f_ra):
-	    self.recursionAvailable = True
-	else:
-	    self.recursionAvailable = False
-	
-	self.response = libbind.ns_msg_getflag(msg, libbind.ns_f_rcode)
+	self.opcode             = flags[libbind.ns_f_opcode]
+	self.authoritative      = bool(flags[libbind.ns_f_aa])
+	self.truncated          = bool(flags[libbind.ns_f_tc])
+	self.recursionDesired   = bool(flags[libbind.ns_f_rd])
+	self.recursionAvailable = bool(flags[libbind.ns_f_ra])
+	self.response           = flags[libbind.ns_f_rcode]
 
     def __str__(self):
 	return "\n".join((
@@ -148,24 +356,77 @@ class DNSFlags(object):
 	"  Response Code      : %d" % self.response,
 	))
 
+class EDNS(object):
+    """The EDNS0 fields of a message, from its OPT record
+
+    An EDNS object contains the following members:
+	payloadSize   - Integer (the largest UDP payload the sender takes)
+	extendedRcode - Integer (the upper 8 bits of the response code)
+	version       - Integer
+	dnssecOK      - Boolean (the DO bit)
+	flags         - Integer (all 16 flag bits)
+	options       - List of (code, value) tuples, as from libbind.decode_edns()
+	clientSubnet  - (family, sourcePrefix, scopePrefix, address) or None
+	cookie        - (clientCookie, serverCookie) or None
+	padding       - Integer (bytes of padding) or None
+    """
+
+    __slots__ = ('payloadSize', 'extendedRcode', 'version', 'dnssecOK', 'flags', 'options',
+		 'clientSubnet', 'cookie', 'padding')
+
+    def __init__(self, record):
+	"""Decode the OPT record tuple from libbind.parse_record()"""
+	try:
+	    edns = libbind.decode_edns(record[2], record[3], record[4])
+	except ValueError:
+	    raise DNSRecordError, 'The OPT record options cannot be parsed'
+
+	(self.payloadSize, self.extendedRcode, self.version, dnssecOK,
+	 self.flags, self.options) = edns
+	self.dnssecOK = bool(dnssecOK)
+
+	self.clientSubnet = self.cookie = self.padding = None
+	for code, value in self.options:
+	    if code == EDNS_ECS and type(value) is tuple:
+		self.clientSubnet = value
+	    elif code == EDNS_COOKIE and type(value) is tuple:
+		self.cookie = value
+	    elif code == EDNS_PADDING:
+		self.padding = value
+
+    def rcode(self, flags):
+	"""Return the full 12-bit response code, given the message's DNSFlags"""
+	return (self.extendedRcode << 4) | flags.response
+
+    def __str__(self):
+	return "\n".join((
+	"EDNS:",
+	"  Payload Size       : %d" % self.payloadSize,
+	"  Version            : %d" % self.version,
+	"  DNSSEC OK          : %s" % str(self.dnssecOK),
+	"  Options            : %s" % ", ".join([str(code) for code, value in self.options]),
+	))
+
 class DNSSection(object):
     """A section of a DNS message.  Typically these are 'question', 'answer',
        'authority', or 'additional'.
 
        Members:
-           name     - name of the section
+	   name     - name of the section
+	   records  - list of DNSRecord objects (built on first access if lazy)
+	   parsed   - tuple of record tuples, as from libbind.parse_section()
     """
 
+    __slots__ = ('name', 'msg', 'packetData', 'parsed', 'lazy', 'records')
+
     def __init__(self, msg, *args, **kwargs):
-	"""Initialize a message section"""
+	"""Initialize a message section
 
-	self.mapping = { 'question'   : libbind.ns_s_qd,
-			 'answer'     : libbind.ns_s_an,
-			 'authority'  : libbind.ns_s_ns,
-			 'additional' : libbind.ns_s_ar,
-		       }
+	The records come from the ns_msg, unless the record tuples are given
+	in the "parsed" keyword argument (in which case msg may be None)."""
 
-	if type(msg) is not libbind.ns_msg:
+	parsed = kwargs.get('parsed')
+	if parsed is None and type(msg) is not libbind.ns_msg:
 	    raise DNSSectionError, "DNSSection initialized but without an ns_msg"
 	
 	try:
@@ -176,19 +437,43 @@ class DNSSection(object):
 	    except IndexError:
 		raise DNSSectionError, "DNSSection requires a section name argument"
 	
-	if sectionName not in self.mapping.keys():
+	if sectionName not in sectionNumbers:
 	    raise DNSSectionError, "DNSSection requires a valid section name"
 
-	section = self.mapping[sectionName]
-	totalRecords = libbind.ns_msg_count(msg, section)
-	if totalRecords < 1:
+	if parsed is None:
+	    try:
+		parsed = libbind.parse_section(msg, sectionNumbers[sectionName])
+	    except TypeError:
+		raise DNSRecordError, 'The section "%s" has a record which cannot be parsed' % sectionName
+
+	if len(parsed) < 1:
 	    raise DNSSectionError, "No such section in this message"
 	
-	self.name = sectionName
+	self.name       = sectionName
+	self.msg        = msg
+	self.packetData = kwargs.get('packetData')
+	self.parsed     = parsed
+	self.lazy       = kwargs.get('lazy', False)
 
-	self.records = []
-	for recordNum in range(0, totalRecords):
-	    self.addRecord(DNSRecord(msg, sectionName, recordNum))
+	if not self.lazy:
+	    self.records = self.buildRecords()
+
+    def __getattr__(self, attr):
+	"""Build the record list on first access (lazy mode)"""
+	if attr != 'records':
+	    raise AttributeError, attr
+
+	self.records = self.buildRecords()
+	return self.records
+
+    def buildRecords(self):
+	"""Return a list of DNSRecord objects for every record in the section"""
+	records = []
+	for recordNum in range(0, len(self.parsed)):
+	    records.append(DNSRecord(self.msg, self.name, recordNum, lazy=self.lazy,
+				     parsed=self.parsed[recordNum], packetData=self.packetData))
+
+	return records
 
     def numRecords(self):
 	"""Return the number of records in this section"""
@@ -227,88 +512,440 @@ class DNSRecord(object):
 	queryClass - Network class ('IN', 'Unknown')
 	ttl        - Time to live for the data in the record
 	data       - The value of the record or None if not applicable
+	rdata      - The raw record data, or None for a question
+	value      - The record data decoded by libbind.decode_rdata(): a string
+		     for addresses and names, a tuple of fields for the other
+		     types it knows, or None
+
+    For A, NS, CNAME, SOA, PTR and MX records, data is a string as it always
+    was.  For the other types which libbind.decode_rdata() knows, data is the
+    same as value, and for the rest (or malformed data) it is the raw rdata.
 
     Also there is an "rr" member, which references the low-level libbind.ns_rr object,
-    if you need it.
+    if you need it.  The "parsed" member is the record tuple from libbind.parse_record().
+
+    If lazy is True, each of the members above is decoded the first time it is
+    accessed instead of in the constructor.
     """
 
-    def __init__(self, msg, sectionName, recordNum):
-	"""Fills in all record values to the object members"""
+    __slots__ = ('sectionName', 'recordNum', 'packetData', 'msg', 'rr', 'parsed',
+		 'name', 'ttl', 'queryClass', 'type', 'data', 'rdata', 'value')
+
+    def __init__(self, msg, sectionName, recordNum, **kwargs):
+	"""Fills in all record values to the object members
+
+	The record comes from the ns_msg, unless its record tuple is given in the
+	"parsed" keyword argument (in which case msg may be None)."""
 
-	if type(msg) is not libbind.ns_msg:
+	parsed = kwargs.get('parsed')
+	if parsed is None and type(msg) is not libbind.ns_msg:
 	    raise DNSRecordError, "DNSRecord initialized but without an ns_msg"
 	
-	self.mapping = { 'question'   : libbind.ns_s_qd,
-			 'answer'     : libbind.ns_s_an,
-			 'authority'  : libbind.ns_s_ns,
-			 'additional' : libbind.ns_s_ar,
-		       }
-
-	if sectionName not in self.mapping.keys():
+	if sectionName not in sectionNumbers:
 	    raise DNSRecordError, "DNSRecord requires a valid section name"
 
-	section = self.mapping[sectionName]
+	self.sectionName = sectionName
+	self.recordNum   = recordNum
+	self.packetData  = kwargs.get('packetData')
+	if msg is not None:
+	    self.msg = msg
+
+	if parsed is None:
+	    section = sectionNumbers[sectionName]
+	    try:
+		self.rr = libbind.ns_rr(msg, section, recordNum)
+	    except TypeError:
+		raise DNSRecordError, 'The section "%s" does not have this record, %d' % (sectionName, recordNum)
+
+	    try:
+		parsed = libbind.parse_record(msg, self.rr)
+	    except TypeError:
+		raise DNSRecordError, 'The record data cannot be parsed'
+
+	self.parsed = parsed
+
+	if not kwargs.get('lazy', False):
+	    for field in self.fields:
+		setattr(self, field, self.decoders[field](self))
+
+    def __getattr__(self, attr):
+	"""Decode a record field, or build the ns_msg or ns_rr, on first access"""
+	if attr == 'msg' and self.packetData is not None:
+	    self.msg = libbind.ns_msg(self.packetData)
+	    return self.msg
+	elif attr == 'rr':
+	    self.rr = libbind.ns_rr(self.msg, sectionNumbers[self.sectionName], self.recordNum)
+	    return self.rr
+
 	try:
-	    self.rr = libbind.ns_rr(msg, section, recordNum)
-	except TypeError:
-	    raise DNSRecordError, 'The section "%"s does not have this record, %d' % (sectionName, recordNum)
-	
-	self.name       = libbind.ns_rr_name(self.rr)
-	self.ttl        = libbind.ns_rr_ttl(self.rr)
-
-	self.queryClass = libbind.ns_rr_class(self.rr)
-	if self.queryClass == libbind.ns_c_in:
-	    self.queryClass = 'IN'
-	elif self.queryClass == libbind.ns_c_none:
-	    self.queryClass = 'None'
-	else:
-	    self.queryClass = 'Unknown (%d)' % self.queryClass
-	
-	self.type = libbind.ns_rr_type(self.rr)
-	typeDict = { libbind.ns_t_a     : 'A',
-		     libbind.ns_t_ns    : 'NS',
-		     libbind.ns_t_cname : 'CNAME',
-		     libbind.ns_t_soa   : 'SOA',
-		     libbind.ns_t_null  : 'NULL',
-		     libbind.ns_t_ptr   : 'PTR',
-		     libbind.ns_t_hinfo : 'HINFO',
-		     libbind.ns_t_mx    : 'MX',
-		     libbind.ns_t_txt   : 'TXT',
-		     libbind.ns_t_sig   : 'SIG',
-		     libbind.ns_t_key   : 'KEY',
-		     libbind.ns_t_aaaa  : 'AAAA',
-		     libbind.ns_t_loc   : 'LOC',
-		     libbind.ns_t_srv   : 'SRV',
-		     libbind.ns_t_tsig  : 'TSIG',
-		     libbind.ns_t_ixfr  : 'IXFR',
-		     libbind.ns_t_axfr  : 'AXFR',
-		     libbind.ns_t_any   : 'ANY',
-		     libbind.ns_t_zxfr  : 'ZXFR',
-		   }
+	    decoder = self.decoders[attr]
+	except KeyError:
+	    raise AttributeError, attr
+
+	value = decoder(self)
+	setattr(self, attr, value)
+	return value
+
+    def decodeName(self):
+	return self.parsed[0]
+
+    def decodeTTL(self):
+	return self.parsed[3]
+
+    def decodeClass(self):
+	queryClass = self.parsed[2]
 	try:
-	    self.type = typeDict[self.type]
+	    return classNames[queryClass]
 	except KeyError:
-	    self.type = 'Unknown'
-	
-	rdata = libbind.ns_rr_rdata(self.rr)
+	    # One shared string per unknown class, like the known ones
+	    return classNames.setdefault(queryClass, 'Unknown (%d)' % queryClass)
+
+    def decodeType(self):
+	try:
+	    return typeNames[self.parsed[1]]
+	except KeyError:
+	    return 'Unknown'
+
+    def decodeData(self):
+	rdata, dataName = self.parsed[4:6]
 	if rdata is None:
 	    # Query records look like this
-	    self.data = ""
-	else:
-	    if self.type == 'A':
-		if len(rdata) == 4:
-		    self.data = socket.inet_ntoa(rdata)
-		else:
-		    self.data = ''
-	    elif self.type in ('NS', 'CNAME', 'SOA', 'PTR'):
-		self.data = libbind.ns_name_uncompress(msg, self.rr)
-	    elif self.type == 'MX':
-		preference = struct.unpack('!H', rdata[0:2])[0]
-		self.data = "%d %s" % (preference, libbind.ns_name_uncompress(msg, self.rr))
+	    return ""
+
+	if self.type == 'A':
+	    if len(rdata) == 4:
+		return socket.inet_ntoa(rdata)
 	    else:
-		self.data = rdata
+		return ''
+	elif self.type in ('NS', 'CNAME', 'SOA', 'PTR'):
+	    return dataName or ''
+	elif self.type == 'MX':
+	    if dataName is None:
+		return ''
+	    preference = struct.unpack('!H', rdata[0:2])[0]
+	    return "%d %s" % (preference, dataName)
+
+	value = self.value
+	if value is None:
+	    return rdata
+	return value
+
+    def decodeRdata(self):
+	return self.parsed[4]
+
+    def decodeValue(self):
+	rdata = self.parsed[4]
+	if rdata is None:
+	    return None
+
+	try:
+	    return libbind.decode_rdata(self.parsed[1], rdata, self.packetData)
+	except ValueError:
+	    return None
+
+    # The decoded members, in the order they are filled in when not lazy.
+    fields   = ('name', 'ttl', 'queryClass', 'type', 'data')
+    decoders = { 'name'       : decodeName,
+		 'ttl'        : decodeTTL,
+		 'queryClass' : decodeClass,
+		 'type'       : decodeType,
+		 'data'       : decodeData,
+		 'rdata'      : decodeRdata,
+		 'value'      : decodeValue,
+	       }
 
     def __str__(self):
 	return "%-23s %-7d %-7s %-7s %s" % (self.name, self.ttl, self.queryClass, self.type, self.data)
 
+class Filter(object):
+    """A packet filter, run in libbind on the raw header and first question
+
+    The expression compares fields with values, and combines the comparisons
+    with "and", "or", "not" and parentheses:
+
+	Filter("rcode=3 and qtype=ANY")
+	Filter("qtype in {ANY, TXT} or (qr = 0 and opcode != QUERY)")
+	Filter("rcode == NXDOMAIN and not qname ends with .example")
+
+    The fields are id; the header flags qr, opcode, aa, tc, rd, ra, z, ad, cd
+    and rcode; the section counts qdcount, ancount, nscount and arcount;
+    length (of the packet); and qtype, qclass and qname from the question.
+    The number fields take =, ==, !=, <, <=, >, >= and "in {...}", and
+    qtype, qclass, rcode and opcode take names as well as numbers.  qname
+    takes =, ==, !=, "in {...}" and "ends with", and ignores case.
+
+    A comparison on the question is false for a message without one, and a
+    packet whose header or question cannot be decoded never matches.
+
+    parse_many(), parallel.parse(), columnar.RecordBatch, aio.Listener and
+    pcap.messages() take a Filter as their filter argument, so that only the
+    packets which match are parsed.  Raises FilterError for a bad expression.
+    """
+
+    __slots__ = ('expression', 'program', 'compiled')
+
+    # Operators and brackets, or words (fields, keywords and values)
+    tokenPattern = re.compile(r'\s*(?:(==|!=|<=|>=|=|<|>|[(){},])|([^\s=!<>(){},]+))')
+
+    fields = ('id', 'qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'z', 'ad', 'cd', 'rcode',
+	      'qdcount', 'ancount', 'nscount', 'arcount', 'length', 'qtype', 'qclass', 'qname')
+
+    comparisons = { '='  : '=',
+		    '==' : '=',
+		    '!=' : '!=',
+		    '<'  : '<',
+		    '<=' : '<=',
+		    '>'  : '>',
+		    '>=' : '>=',
+		  }
+
+    # Value names, by field
+    valueNames = { 'qtype'  : typeNumbers,
+		   'qclass' : dict([(name.upper(), number) for number, name in classNames.items()]),
+		   'rcode'  : rcodeNumbers,
+		   'opcode' : opcodeNumbers,
+		 }
+
+    def __init__(self, expression):
+	self.expression = expression
+
+	tokens  = self.tokenize(expression)
+	program = []
+	position = self.parseOr(tokens, 0, program)
+	if position != len(tokens):
+	    raise FilterError, 'Unexpected "%s" in the filter' % tokens[position]
+
+	self.program = tuple(program)
+	try:
+	    self.compiled = libbind.ns_filter(self.program)
+	except ValueError, e:
+	    raise FilterError, str(e)
+
+    def __reduce__(self):
+	"""Pickle as the expression; the libbind filter is not picklable"""
+	return (Filter, (self.expression,))
+
+    def __repr__(self):
+	return 'Filter(%r)' % self.expression
+
+    def match(self, packetData):
+	"""Return whether a raw DNS message (a string or buffer) matches"""
+	return self.compiled.match(packetData)
+
+    def select(self, packets):
+	"""Return the indexes of the raw DNS messages which match"""
+	return self.compiled.select(packets)
+
+    def tokenize(self, expression):
+	"""Return the list of tokens in an expression, keywords in lower case"""
+	tokens   = []
+	position = 0
+	while True:
+	    match = self.tokenPattern.match(expression, position)
+	    if match is None or match.end() == position:
+		break
+	    token = match.group(1) or match.group(2)
+	    if token.lower() in ('and', 'or', 'not', 'in', 'ends', 'with') or token.lower() in self.fields:
+		token = token.lower()
+	    tokens.append(token)
+	    position = match.end()
+
+	if expression[position:].strip():
+	    raise FilterError, 'Cannot parse the filter at "%s"' % expression[position:].strip()
+	return tokens
+
+    def token(self, tokens, position):
+	"""Return the token at position, or None past the end"""
+	if position < len(tokens):
+	    return tokens[position]
+	return None
+
+    def expect(self, tokens, position, expected):
+	"""Raise FilterError unless the token at position is the expected one"""
+	if self.token(tokens, position) != expected:
+	    raise FilterError, 'Expected "%s" in the filter' % expected
+
+    def parseOr(self, tokens, position, program):
+	"""Parse "a or b or ..." into the postfix program; return the position after it"""
+	position = self.parseAnd(tokens, position, program)
+	while self.token(tokens, position) == 'or':
+	    position = self.parseAnd(tokens, position + 1, program)
+	    program.append(('or',))
+	return position
+
+    def parseAnd(self, tokens, position, program):
+	"""Parse "a and b and ..." """
+	position = self.parseNot(tokens, position, program)
+	while self.token(tokens, position) == 'and':
+	    position = self.parseNot(tokens, position + 1, program)
+	    program.append(('and',))
+	return position
+
+    def parseNot(self, tokens, position, program):
+	"""Parse "not a", "(...)" or a comparison"""
+	token = self.token(tokens, position)
+	if token == 'not':
+	    position = self.parseNot(tokens, position + 1, program)
+	    program.append(('not',))
+	    return position
+	elif token == '(':
+	    position = self.parseOr(tokens, position + 1, program)
+	    self.expect(tokens, position, ')')
+	    return position + 1
+
+	return self.parseComparison(tokens, position, program)
+
+    def parseComparison(self, tokens, position, program):
+	"""Parse "field op value", "field in {...}" or "qname ends with name" """
+	field = self.token(tokens, position)
+	if field is None:
+	    raise FilterError, "The filter ends where a field was expected"
+	elif field not in self.fields:
+	    raise FilterError, 'Expected a field in the filter, not "%s"' % field
+
+	operator = self.token(tokens, position + 1)
+	position += 2
+	if operator in self.comparisons:
+	    program.append((self.comparisons[operator], field, self.value(field, tokens, position)))
+	    return position + 1
+	elif operator == 'ends' and field == 'qname':
+	    self.expect(tokens, position, 'with')
+	    program.append(('endswith', field, self.value(field, tokens, position + 1)))
+	    return position + 2
+	elif operator != 'in':
+	    raise FilterError, 'Expected a comparison after "%s" in the filter' % field
+
+	self.expect(tokens, position, '{')
+	values = []
+	while True:
+	    values.append(self.value(field, tokens, position + 1))
+	    position += 2
+	    if self.token(tokens, position) == '}':
+		break
+	    self.expect(tokens, position, ',')
+
+	if field != 'qname':
+	    program.append(('in', field, tuple(values)))
+	else:
+	    # libbind compares names one at a time
+	    program.append(('=', field, values[0]))
+	    for value in values[1:]:
+		program.append(('=', field, value))
+		program.append(('or',))
+	return position + 1
+
+    def value(self, field, tokens, position):
+	"""Return the value at position for a field, as a number or a lower case name"""
+	token = self.token(tokens, position)
+	if token is None or self.tokenPattern.match(token).group(1) is not None:
+	    raise FilterError, 'Expected a value for "%s" in the filter' % field
+
+	if field == 'qname':
+	    name = token.lower()
+	    if len(name) > 1 and name.endswith('.') and not name.endswith('\\.'):
+		name = name[:-1]
+	    return name
+
+	if token.isdigit():
+	    return int(token)
+	try:
+	    return self.valueNames.get(field, {})[token.upper()]
+	except KeyError:
+	    raise FilterError, 'Unknown value "%s" for "%s" in the filter' % (token, field)
+
+def enableStats(enabled=True):
+    """Turn the libbind parse counters and timers on or off; returns whether they were on"""
+    return libbind.set_stats(enabled)
+
+def stats(reset=False):
+    """Return a snapshot of the parse counters and timers
+
+    The dict is that of libbind.stats(), with the sections keyed by section
+    name and the record types by type name (or number, for unknown types).
+    They only count while enableStats() has them on.  If reset is true, the
+    counters are zeroed after the snapshot."""
+    snapshot = libbind.stats(reset)
+    snapshot['sections'] = dict([(name, snapshot['sections'][number])
+				 for name, number in sectionNumbers.items()])
+    snapshot['types'] = dict([(typeNames.get(number, number), count)
+			      for number, count in snapshot['types'].items()])
+    return snapshot
+
+def parse_question(packetData):
+    """Decode just the header and first question of a raw DNS message
+
+    Returns (id, flags, qname, qtype, qclass), with flags as the tuple that
+    DNSFlags takes and qtype and qclass as numbers (see typeNames and
+    classNames).  The question fields are None if there is no question.
+    For the common single-question query this is several times faster than
+    a DNSMessage, as no other section is parsed."""
+    try:
+	return libbind.parse_question(packetData)
+    except TypeError:
+	raise StrangleError, "Failed to parse the packet"
+
+def parse_many(packets, on_error='none', lazy=False, filter=None):
+    """Parse a batch of raw DNS messages with a single call into libbind
+
+    Returns a tuple of (messages, errors).  errors is a list of (index, reason)
+    for every packet which could not be parsed.  What goes in the messages list
+    for those packets depends on on_error:
+	'none'   - None, so that messages lines up with packets (the default)
+	'skip'   - nothing; only the good messages are returned
+	'raise'  - nothing; StrangleError is raised for the first bad packet
+	callable - whatever on_error(index, packetData, reason) returns
+
+    If filter (a Filter) is given, only the packets which match it are
+    parsed, and messages lines up with those.  The indexes in errors and
+    those passed to on_error are still into packets.
+    """
+    checkOnError(on_error)
+    if type(packets) not in (list, tuple):
+	packets = list(packets)
+
+    indexes = selectPackets(packets, filter)
+    if indexes is not None:
+	packets = [packets[index] for index in indexes]
+
+    results, errors = libbind.parse_many(packets)
+    if indexes is not None:
+	errors = [(indexes[index], reason) for index, reason in errors]
+    return buildMessages(packets, results, errors, on_error, lazy, indexes), errors
+
+def selectPackets(packets, filter):
+    """Return the indexes of the packets which match filter, or None if it is None"""
+    if filter is None:
+	return None
+    return filter.select(packets)
+
+def checkOnError(on_error):
+    """Raise ValueError unless on_error is a value parse_many() understands"""
+    if not callable(on_error) and on_error not in ('none', 'skip', 'raise'):
+	raise ValueError, "on_error must be 'none', 'skip', 'raise' or a callable"
+
+def buildMessages(packets, results, errors, on_error='none', lazy=False, indexes=None):
+    """Build the DNSMessage list for parse_many() from the results of libbind.parse_many()
+
+    indexes, if given, is the index reported in errors for each packet.
+    on_error should have been checked with checkOnError() before parsing."""
+    messages = []
+    reasons  = dict(errors)
+    for index in xrange(len(packets)):
+	parsed = results[index]
+	if indexes is None:
+	    original = index
+	else:
+	    original = indexes[index]
+
+	if parsed is not None:
+	    messages.append(DNSMessage(packets[index], lazy=lazy, parsed=parsed))
+	elif on_error == 'raise':
+	    raise StrangleError, "Failed to parse packet %d: %s" % (original, reasons[original])
+	elif on_error == 'none':
+	    messages.append(None)
+	elif callable(on_error):
+	    messages.append(on_error(original, packets[index], reasons[original]))
+
+    return messages
+
 # vim: sts=4 sw=4 noet
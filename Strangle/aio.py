@@ -0,0 +1,309 @@
+# aio.py - Receive and parse DNS messages on non-blocking sockets
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Receive DNS messages over UDP and TCP with asyncore, and parse them
+
+A Listener owns a set of asyncore dispatchers (one per listening socket and
+TCP connection) in a private socket map.  Received payloads go into a bounded
+queue, and come out as (DNSMessage, Peer) pairs, either from the messages()
+generator, from get() in another thread, or through a callback passed to the
+Listener and run by serve().
+
+Backpressure: while the queue (plus any packets still being parsed) holds
+maxsize items, the sockets are not read at all.  UDP datagrams then wait in
+the kernel's receive buffer, and TCP clients are slowed down by flow control.
+
+Parsing can be offloaded by passing a multiprocessing.Pool or ThreadPool as
+"pool".  libbind.parse_message() releases the GIL, so a ThreadPool is enough
+to parse on several processors.
+
+    listener = aio.Listener()
+    listener.listenUDP(('127.0.0.1', 5353))
+    for msg, peer in listener.messages():
+	peer.send(answerFor(msg))
+"""
+
+import Queue
+import asyncore
+import errno
+import socket
+import struct
+import threading
+
+import Strangle
+from Strangle import libbind
+
+class Peer(object):
+    """The sender of a DNS message, which a reply can be sent back to
+
+    Replies should be sent from the thread which runs the Listener.
+    """
+    def __init__(self, dispatcher, address, protocol):
+	self.dispatcher = dispatcher
+	self.address    = address
+	self.protocol   = protocol
+
+    def send(self, data):
+	"""Send a raw DNS message back to the peer"""
+	if self.protocol == 'udp':
+	    self.dispatcher.socket.sendto(data, self.address)
+	else:
+	    self.dispatcher.send(struct.pack('!H', len(data)) + data)
+
+    def __repr__(self):
+	return "<Peer %s %s>" % (self.protocol, self.address)
+
+class UDPListener(asyncore.dispatcher):
+    """Receive DNS messages on a UDP socket"""
+    def __init__(self, listener, address):
+	asyncore.dispatcher.__init__(self, map=listener.map)
+	self.listener = listener
+	self.create_socket(addressFamily(address), socket.SOCK_DGRAM)
+	self.bind(address)
+	self.address = self.socket.getsockname()
+
+    def readable(self):
+	return not self.listener.full()
+
+    def writable(self):
+	return False
+
+    def handle_connect(self):
+	pass
+
+    def handle_read(self):
+	try:
+	    data, address = self.socket.recvfrom(65535)
+	except socket.error, why:
+	    if why.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN, errno.ECONNREFUSED):
+		return
+	    raise
+
+	self.listener.deliver(data, Peer(self, address, 'udp'))
+
+class TCPListener(asyncore.dispatcher):
+    """Accept TCP connections which carry DNS messages"""
+    def __init__(self, listener, address, backlog=16):
+	asyncore.dispatcher.__init__(self, map=listener.map)
+	self.listener = listener
+	self.create_socket(addressFamily(address), socket.SOCK_STREAM)
+	self.set_reuse_addr()
+	self.bind(address)
+	self.listen(backlog)
+	self.address = self.socket.getsockname()
+
+    def handle_accept(self):
+	pair = self.accept()
+	if pair is not None:
+	    sock, address = pair
+	    TCPConnection(self.listener, sock, address)
+
+class TCPConnection(asyncore.dispatcher_with_send):
+    """A TCP connection carrying DNS messages, each one after a two-byte length"""
+    def __init__(self, listener, sock, address):
+	asyncore.dispatcher_with_send.__init__(self, sock, map=listener.map)
+	self.listener = listener
+	self.peer     = Peer(self, address, 'tcp')
+	self.data     = ''
+
+    def readable(self):
+	return not self.listener.full()
+
+    def handle_read(self):
+	self.data += self.recv(65535)
+
+	while len(self.data) >= 2:
+	    length = struct.unpack('!H', self.data[:2])[0]
+	    if len(self.data) < 2 + length:
+		break
+	    self.listener.deliver(self.data[2:2 + length], self.peer)
+	    self.data = self.data[2 + length:]
+
+    def handle_close(self):
+	self.close()
+
+def addressFamily(address):
+    """Return the socket family for a (host, port) address"""
+    if ':' in address[0]:
+	return socket.AF_INET6
+    return socket.AF_INET
+
+def parsePayload(payload):
+    """Parse a payload in a pool worker, returning its parse_many() result or None
+
+    Nothing is raised, so that the listener always hears back about a packet
+    it has handed to the pool."""
+    try:
+	results, errors = libbind.parse_many([payload])
+	return results[0]
+    except Exception:
+	return None
+
+class Listener(object):
+    """Receive DNS messages on any number of UDP and TCP sockets
+
+    callback, if given, is called as callback(msg, peer) for every message
+    by serve().  maxsize bounds the number of messages waiting to be
+    consumed.  lazy is passed on to DNSMessage, and pool is an optional
+    multiprocessing pool to parse the packets in.  If filter (a
+    Strangle.Filter) is given, packets which do not match it are dropped as
+    they arrive, before they are queued or parsed, and counted in "filtered".
+
+    Packets which libbind cannot parse are dropped and counted in "invalid";
+    "received" counts every packet.
+    """
+    def __init__(self, callback=None, maxsize=1024, lazy=False, pool=None, timeout=0.1,
+		 filter=None):
+	if maxsize < 1:
+	    raise ValueError, "maxsize must be at least 1"
+
+	self.callback = callback
+	self.maxsize  = maxsize
+	self.lazy     = lazy
+	self.pool     = pool
+	self.timeout  = timeout
+	self.filter   = filter
+
+	self.map      = {}
+	self.queue    = Queue.Queue()
+	self.lock     = threading.Lock()
+	self.inFlight = 0
+
+	self.received = 0
+	self.invalid  = 0
+	self.filtered = 0
+
+    def listenUDP(self, address):
+	"""Receive DNS messages on a UDP address; returns the dispatcher"""
+	return UDPListener(self, address)
+
+    def listenTCP(self, address):
+	"""Accept DNS connections on a TCP address; returns the dispatcher"""
+	return TCPListener(self, address)
+
+    def full(self):
+	"""Return whether the sockets should not be read for now"""
+	return self.queue.qsize() + self.inFlight >= self.maxsize
+
+    def deliver(self, payload, peer):
+	"""Queue a received payload, parsing it in the pool if there is one"""
+	self.received += 1
+
+	if self.filter is not None and not self.filter.match(payload):
+	    self.filtered += 1
+	    return
+
+	if self.pool is None:
+	    # Parsed by the consumer, in buildMessage()
+	    self.queue.put((payload, None, peer))
+	    return
+
+	def parsed(result):
+	    self.queue.put((payload, result, peer))
+	    self.finished()
+
+	self.lock.acquire()
+	self.inFlight += 1
+	self.lock.release()
+	try:
+	    self.pool.apply_async(parsePayload, (payload,), callback=parsed)
+	except:
+	    # The pool is closed or broken; the packet is lost, but not its slot.
+	    self.invalid += 1
+	    self.finished()
+	    raise
+
+    def finished(self):
+	"""Note that the pool is done with a packet"""
+	self.lock.acquire()
+	self.inFlight -= 1
+	self.lock.release()
+
+    def buildMessage(self, (payload, parsed, peer)):
+	"""Return a DNSMessage for a queued item, or None if it is not valid"""
+	if self.pool is not None and parsed is None:
+	    self.invalid += 1
+	    return None
+
+	try:
+	    return Strangle.DNSMessage(payload, lazy=self.lazy, parsed=parsed)
+	except Strangle.StrangleError:
+	    self.invalid += 1
+	    return None
+
+    def poll(self, timeout=None):
+	"""Wait for socket activity once, and return the messages now available
+
+	The result is a list of (msg, peer) tuples.
+	"""
+	if timeout is None:
+	    timeout = self.timeout
+
+	if self.queue.empty():
+	    asyncore.loop(timeout, False, self.map, 1)
+
+	messages = []
+	while True:
+	    try:
+		item = self.queue.get_nowait()
+	    except Queue.Empty:
+		break
+
+	    msg = self.buildMessage(item)
+	    if msg is not None:
+		messages.append((msg, item[2]))
+
+	return messages
+
+    def messages(self):
+	"""Generate (msg, peer) tuples as they arrive, until the listener is closed"""
+	while self.map:
+	    for message in self.poll():
+		yield message
+
+    def get(self, block=True, timeout=None):
+	"""Return the next (msg, peer) tuple, for a consumer in another thread
+
+	The listener itself must then be run by serve() in its own thread.
+	Raises Queue.Empty like Queue.get().
+	"""
+	while True:
+	    item = self.queue.get(block, timeout)
+	    msg = self.buildMessage(item)
+	    if msg is not None:
+		return msg, item[2]
+
+    def serve(self):
+	"""Run the listener until it is closed, passing messages to the callback
+
+	Without a callback, the messages are left for get() to consume.
+	"""
+	while self.map:
+	    if self.callback is None:
+		asyncore.loop(self.timeout, False, self.map, 1)
+		continue
+
+	    for msg, peer in self.poll():
+		self.callback(msg, peer)
+
+    def close(self):
+	"""Close every socket of the listener"""
+	for dispatcher in self.map.values():
+	    dispatcher.close()
+
+# vim: sts=4 sw=4 noet
@@ -0,0 +1,157 @@
+# build.py - Encode DNS messages in wire format
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Encode DNS messages in wire format
+
+The encoding is done by libbind.build_message(), which compresses names with
+the libbind pointer table.  message() encodes a DNSMessage, or any object
+with the same members, and query() a question without building one:
+
+    packet = build.query('www.example.com', 'AAAA', id=4242)
+
+Both can write into a preallocated buffer instead of returning a string, so
+that nothing but the message's own fields is allocated per packet:
+
+    buffer = bytearray(512)
+    length = build.query('www.example.com', id=4242, buffer=buffer)
+    sock.send(buffer[:length])
+"""
+
+import Strangle
+from Strangle import libbind
+
+# Record type and class numbers, by name
+typeNumbers = Strangle.typeNumbers
+classNumbers = dict([(name, number) for number, name in Strangle.classNames.items()])
+
+# Types whose decoded value libbind.build_message() can encode
+encodedTypes = (libbind.ns_t_a, libbind.ns_t_aaaa, libbind.ns_t_ns, libbind.ns_t_cname,
+		libbind.ns_t_ptr, libbind.ns_t_dname, libbind.ns_t_mx, libbind.ns_t_soa,
+		libbind.ns_t_txt, libbind.ns_t_srv, libbind.ns_t_naptr, libbind.ns_t_opt,
+		libbind.ns_t_ds, libbind.ns_t_cds, libbind.ns_t_dnskey, libbind.ns_t_cdnskey,
+		libbind.ns_t_rrsig)
+
+def typeNumber(record):
+    """Return the type number of a DNSRecord-like object"""
+    try:
+	return typeNumbers[record.type]
+    except KeyError:
+	pass
+
+    # 'Unknown' records only have the number in their parsed tuple
+    parsed = getattr(record, 'parsed', None)
+    if parsed is not None:
+	return parsed[1]
+    raise Strangle.StrangleError, 'Unknown record type "%s"' % record.type
+
+def classNumber(name):
+    """Return the number of a class name, including 'Unknown (23)' names"""
+    try:
+	return classNumbers[name]
+    except KeyError:
+	pass
+
+    if name.startswith('Unknown (') and name.endswith(')'):
+	return int(name[9:-1])
+    raise Strangle.StrangleError, 'Unknown record class "%s"' % name
+
+# Header flags which DNSFlags does not have, kept from the parsed message
+unmodelledFlags = (libbind.ns_f_z, libbind.ns_f_ad, libbind.ns_f_cd)
+
+def flagsTuple(flags, original=None):
+    """Return the libbind.parse_flags() tuple for a DNSFlags-like object
+
+    original, if given, is the flags tuple of the parsed message, for the
+    bits (Z, AD and CD) which DNSFlags does not have."""
+    values = [0] * libbind.ns_f_max
+    if original is not None:
+	for flag in unmodelledFlags:
+	    values[flag] = original[flag]
+    values[libbind.ns_f_qr]     = int(flags.type == 'answer')
+    values[libbind.ns_f_opcode] = flags.opcode
+    values[libbind.ns_f_aa]     = int(flags.authoritative)
+    values[libbind.ns_f_tc]     = int(flags.truncated)
+    values[libbind.ns_f_rd]     = int(flags.recursionDesired)
+    values[libbind.ns_f_ra]     = int(flags.recursionAvailable)
+    values[libbind.ns_f_rcode]  = flags.response
+    return tuple(values)
+
+def recordTuple(record, question):
+    """Return the libbind.build_message() tuple for a DNSRecord-like object
+
+    The decoded value is encoded if the record has one of a type which can
+    be, so that names in it are compressed again; otherwise the raw rdata
+    is copied."""
+    recordType = typeNumber(record)
+    queryClass = classNumber(record.queryClass)
+    if question:
+	return (record.name, recordType, queryClass)
+
+    value = getattr(record, 'value', None)
+    if value is not None and recordType in encodedTypes:
+	return (record.name, recordType, queryClass, record.ttl, None, value)
+
+    rdata = getattr(record, 'rdata', None)
+    if rdata is None:
+	raise Strangle.StrangleError, 'The record for "%s" has no data to encode' % record.name
+    return (record.name, recordType, queryClass, record.ttl, rdata)
+
+def message(msg, buffer=None, offset=0):
+    """Encode a DNSMessage-like object
+
+    msg needs the members id, flags (a DNSFlags-like object) and sections (a
+    dict from section names to objects with a list of records).  Returns the
+    message as a string, or its length if it is written into buffer."""
+    original = None
+    if type(msg) is Strangle.DNSMessage:
+	if msg.parsed is not None:
+	    original = msg.parsed[1]
+	else:
+	    original = libbind.parse_flags(msg.msg)
+    flags = flagsTuple(msg.flags, original)
+
+    sections = []
+    for sectionName in ('question', 'answer', 'authority', 'additional'):
+	section = msg.sections.get(sectionName)
+	if section is None:
+	    sections.append(())
+	    continue
+
+	question = sectionName == 'question'
+	sections.append([recordTuple(record, question) for record in section.records])
+
+    return libbind.build_message(msg.id, flags, sections, buffer, offset)
+
+def query(name, queryType='A', queryClass='IN', id=0, recursionDesired=True,
+	  buffer=None, offset=0):
+    """Encode a query with a single question
+
+    queryType and queryClass may be names or numbers.  Returns the message as a
+    string, or its length if it is written into buffer."""
+    if type(queryType) is str:
+	queryType = typeNumbers[queryType]
+    if type(queryClass) is str:
+	queryClass = classNumber(queryClass)
+
+    if recursionDesired:
+	flags = 0x0100
+    else:
+	flags = 0
+    return libbind.build_message(id, flags, (((name, queryType, queryClass),),), buffer, offset)
+
+# vim: sts=4 sw=4 noet
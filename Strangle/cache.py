@@ -0,0 +1,166 @@
+# cache.py - Reuse the parse of DNS messages which are seen again
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Cache parsed DNS messages by their bytes
+
+A resolver hands out the same response many times, usually with nothing but
+the ID changed.  A MessageCache keeps the tuples from libbind.parse_message()
+for recently seen payloads, and builds DNSMessage objects from them without
+parsing again:
+
+    cache = MessageCache(maxSize=10000)
+    for payload in payloads:
+	msg = cache.parse(payload)
+
+By default the ID is not part of the key, and a hit for a payload with a
+different ID just has the ID in the cached tuple replaced.  Entries expire
+after the smallest TTL of their records, so a cached answer is never used
+for longer than a resolver would keep it.
+"""
+
+import struct
+import time
+from collections import OrderedDict
+
+import Strangle
+from Strangle import libbind
+
+class MessageCache(object):
+    """An LRU cache of parsed DNS messages, keyed by their bytes
+
+    maxSize  - the most messages kept; the least recently used go first
+    maxAge   - the most seconds a message is kept, or None for no limit
+    emptyAge - seconds to keep a message with no TTLs (such as a query or a
+	       response with no records), or None to use maxAge
+    ignoreId - whether messages which differ only in their ID share an entry
+    lazy     - passed on to DNSMessage
+    clock    - a function returning the time in seconds, for testing
+
+    The counters hits, misses, expired (misses because the entry was too
+    old) and evictions (entries dropped for space) are kept as members.
+    """
+
+    def __init__(self, maxSize=10000, maxAge=None, emptyAge=None, ignoreId=True,
+		 lazy=False, clock=time.time):
+	if maxSize < 1:
+	    raise ValueError, "maxSize must be at least 1"
+
+	self.maxSize  = maxSize
+	self.maxAge   = maxAge
+	self.emptyAge = emptyAge
+	self.ignoreId = ignoreId
+	self.lazy     = lazy
+	self.clock    = clock
+	self.entries  = OrderedDict()
+
+	self.hits      = 0
+	self.misses    = 0
+	self.expired   = 0
+	self.evictions = 0
+
+    def __len__(self):
+	return len(self.entries)
+
+    def parse(self, packetData):
+	"""Return a DNSMessage for packetData, parsing it only if it is not cached
+
+	Raises StrangleError like DNSMessage if the packet cannot be parsed.
+	"""
+	if type(packetData) is not str:
+	    packetData = str(packetData)
+
+	parsed = self.lookup(packetData)
+	return Strangle.DNSMessage(packetData, lazy=self.lazy, parsed=parsed)
+
+    def lookup(self, packetData):
+	"""Return the libbind.parse_message() tuple for a packet string, from the cache if possible"""
+	if self.ignoreId:
+	    key = packetData[2:]
+	else:
+	    key = packetData
+
+	entry = self.entries.pop(key, None)
+	if entry is not None:
+	    parsed, expires = entry
+	    if expires is not None and expires <= self.clock():
+		self.expired += 1
+		entry = None
+
+	if entry is None:
+	    self.misses += 1
+	    try:
+		parsed = libbind.parse_message(packetData)
+	    except TypeError:
+		raise Strangle.StrangleError, "Failed to parse the packet"
+
+	    expires = self.expiry(parsed)
+	    if expires is None or expires > self.clock():
+		self.store(key, (parsed, expires))
+	    return parsed
+
+	self.hits += 1
+	self.entries[key] = entry
+
+	if self.ignoreId and len(packetData) >= 2:
+	    # Patch the ID rather than parse again.
+	    messageId = struct.unpack('!H', packetData[:2])[0]
+	    if messageId != parsed[0]:
+		parsed = (messageId,) + parsed[1:]
+
+	return parsed
+
+    def store(self, key, entry):
+	"""Add an entry, evicting the least recently used ones to make room"""
+	self.entries[key] = entry
+	while len(self.entries) > self.maxSize:
+	    self.entries.popitem(last=False)
+	    self.evictions += 1
+
+    def expiry(self, parsed):
+	"""Return when a parsed message should leave the cache, or None for never"""
+	# OPT pseudo-records use the TTL field for EDNS flags, so it is not a TTL.
+	ttls = [record[3] for records in parsed[2][libbind.ns_s_an:]
+		for record in records if record[1] != libbind.ns_t_opt]
+
+	if ttls:
+	    age = min(ttls)
+	    if self.maxAge is not None:
+		age = min(age, self.maxAge)
+	elif self.emptyAge is not None:
+	    age = self.emptyAge
+	else:
+	    age = self.maxAge
+
+	if age is None:
+	    return None
+	return self.clock() + age
+
+    def stats(self):
+	"""Return a dict of the counters and the current size"""
+	return { 'hits'      : self.hits,
+		 'misses'    : self.misses,
+		 'expired'   : self.expired,
+		 'evictions' : self.evictions,
+		 'size'      : len(self.entries),
+	       }
+
+    def clear(self):
+	"""Empty the cache; the counters are kept"""
+	self.entries.clear()
+
+# vim: sts=4 sw=4 noet
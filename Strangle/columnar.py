@@ -0,0 +1,254 @@
+# columnar.py - Store the records of many DNS messages column by column
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Store the records of many DNS messages in typed arrays
+
+A RecordBatch holds one array.array per record field instead of a DNSRecord
+object per record, so millions of records take a few bytes each and can be
+filtered and aggregated column by column (with numpy, if it is installed).
+
+    batch = columnar.RecordBatch(packets)
+    mx = [i for i in xrange(len(batch)) if batch.type[i] == libbind.ns_t_mx]
+
+Owner names and names in the record data are dictionary encoded: the name and
+dataName columns hold indexes into batch.names (dataName is -1 when there is
+none).  The rdata itself stays in the packets, at rdataOffset.
+
+When only the headers matter (rcode distribution, TC rate, opcode mix), a
+HeaderBatch decodes just the 12-byte headers, without parsing any records:
+
+    headers = columnar.HeaderBatch(capture, offsets)
+    print headers.histogram('rcode')
+"""
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import Strangle
+from Strangle import libbind
+
+class RecordBatch(object):
+    """The records of a batch of DNS messages, stored column by column
+
+    Columns, with one item per record:
+	message     - index of the message in the batch
+	section     - libbind section number (ns_s_qd, ns_s_an, ...)
+	type        - record type number
+	queryClass  - record class number
+	ttl         - time to live
+	rdataOffset - offset of the rdata in the packet, or -1 for questions
+	rdataLength - length of the rdata
+	name        - owner name code, an index into names
+	dataName    - code of the name in the rdata, or -1
+
+    Per message, ids holds the message ID and packets the raw message.
+    Packets which cannot be parsed get no records, and are listed in errors
+    as (index, reason) like for Strangle.parse_many().
+
+    If filter (a Strangle.Filter) is given, only the packets which match it
+    are parsed and added to the batch, by the constructor and by extend().
+    """
+
+    # (column, array typecode), in the order libbind.parse_columns() returns them
+    columns = (('message'    , 'i'),
+	       ('section'    , 'B'),
+	       ('type'       , 'H'),
+	       ('queryClass' , 'H'),
+	       ('ttl'        , 'I'),
+	       ('rdataOffset', 'i'),
+	       ('rdataLength', 'H'),
+	       ('name'       , 'i'),
+	       ('dataName'   , 'i'),
+	      )
+
+    def __init__(self, packets=(), filter=None):
+	self.filter  = filter
+	self.packets = []
+	self.ids     = array.array('H')
+	self.errors  = []
+	self.names   = []
+	self.codes   = {}
+	for column, typecode in self.columns:
+	    setattr(self, column, array.array(typecode))
+
+	self.extend(packets)
+
+    def extend(self, packets):
+	"""Parse more packets and append their records to the batch"""
+	if type(packets) not in (list, tuple):
+	    packets = list(packets)
+
+	indexes = Strangle.selectPackets(packets, self.filter)
+	if indexes is not None:
+	    packets = [packets[index] for index in indexes]
+
+	base = len(self.packets)
+	ids, columns, errors = libbind.parse_columns(packets, self.names, self.codes, base)
+
+	self.packets.extend(packets)
+	self.ids.fromstring(ids)
+	self.errors.extend([(base + index, reason) for index, reason in errors])
+	for (column, typecode), data in zip(self.columns, columns):
+	    getattr(self, column).fromstring(data)
+
+    def __len__(self):
+	"""Return the number of records"""
+	return len(self.message)
+
+    def nameCode(self, name):
+	"""Return the code of a name, or -1 if no record has it"""
+	return self.codes.get(name, -1)
+
+    def rdata(self, row):
+	"""Return the rdata of a record, or None for a question"""
+	offset = self.rdataOffset[row]
+	if offset == -1:
+	    return None
+	packet = self.packets[self.message[row]]
+	return str(buffer(packet, offset, self.rdataLength[row]))
+
+    def record(self, row):
+	"""Return a record as the (name, type, class, ttl, rdata, dataName) tuple of libbind.parse_record()"""
+	dataName = self.dataName[row]
+	if dataName != -1:
+	    dataName = self.names[dataName]
+	else:
+	    dataName = None
+
+	return (self.names[self.name[row]], self.type[row], self.queryClass[row],
+		self.ttl[row], self.rdata(row), dataName)
+
+    def rows(self, column, value):
+	"""Return the indexes of the records whose column equals value"""
+	data = getattr(self, column)
+	return [row for row in xrange(len(data)) if data[row] == value]
+
+    def numpyColumns(self):
+	"""Return a dict of numpy arrays sharing memory with the columns
+
+	The arrays are only valid until the batch is extended again.
+	"""
+	return numpyColumns(self, self.columns + (('ids', 'H'),))
+
+class HeaderBatch(object):
+    """The headers of a batch of DNS messages, stored column by column
+
+    Columns, with one item per message:
+	id                              - message ID
+	qr, opcode, aa, tc, rd, ra, z,
+	ad, cd, rcode                   - header flags, as from ns_msg_getflag()
+	qdcount, ancount, nscount,
+	arcount                         - number of records in each section
+
+    Messages too short to have a header are zero in every column, and listed
+    in errors as (index, reason).
+    """
+
+    # (column, array typecode), in the order libbind.parse_headers() returns them
+    columns = (('id'     , 'H'),
+	       ('qr'     , 'B'),
+	       ('opcode' , 'B'),
+	       ('aa'     , 'B'),
+	       ('tc'     , 'B'),
+	       ('rd'     , 'B'),
+	       ('ra'     , 'B'),
+	       ('z'      , 'B'),
+	       ('ad'     , 'B'),
+	       ('cd'     , 'B'),
+	       ('rcode'  , 'B'),
+	       ('qdcount', 'H'),
+	       ('ancount', 'H'),
+	       ('nscount', 'H'),
+	       ('arcount', 'H'),
+	      )
+
+    def __init__(self, data='', offsets=(), lengths=None):
+	"""Decode the headers of the messages at offsets in the buffer data
+
+	offsets (and lengths) are best given as array.array('i'); other
+	sequences of ints are converted.  lengths, if given, is the length of
+	each message, so that short messages are caught."""
+	self.errors = []
+	for column, typecode in self.columns:
+	    setattr(self, column, array.array(typecode))
+
+	self.extend(data, offsets, lengths)
+
+    def fromPackets(cls, packets):
+	"""Return a HeaderBatch for a sequence of separate packets"""
+	packets = [str(packet) for packet in packets]
+	offsets = array.array('i')
+	lengths = array.array('i', map(len, packets))
+	position = 0
+	for length in lengths:
+	    offsets.append(position)
+	    position += length
+
+	return cls(''.join(packets), offsets, lengths)
+    fromPackets = classmethod(fromPackets)
+
+    def extend(self, data, offsets, lengths=None):
+	"""Decode more headers and append them to the batch"""
+	offsets = intArray(offsets)
+	if lengths is not None:
+	    lengths = intArray(lengths)
+
+	base = len(self)
+	columns, errors = libbind.parse_headers(data, offsets, lengths)
+
+	self.errors.extend([(base + index, reason) for index, reason in errors])
+	for (column, typecode), values in zip(self.columns, columns):
+	    getattr(self, column).fromstring(values)
+
+    def __len__(self):
+	"""Return the number of messages"""
+	return len(self.id)
+
+    def histogram(self, column):
+	"""Return a dict from each value in a column to the number of messages with it"""
+	counts = {}
+	for value in getattr(self, column):
+	    counts[value] = counts.get(value, 0) + 1
+	return counts
+
+    def numpyColumns(self):
+	"""Return a dict of numpy arrays sharing memory with the columns"""
+	return numpyColumns(self, self.columns)
+
+def intArray(values):
+    """Return values as an array.array('i'), without copying if it is one"""
+    if type(values) is array.array and values.typecode == 'i':
+	return values
+    return array.array('i', values)
+
+def numpyColumns(batch, columns):
+    """Return a dict of numpy arrays sharing memory with columns of a batch"""
+    if numpy is None:
+	raise Strangle.StrangleError, "numpy is not installed"
+
+    result = {}
+    for column, typecode in columns:
+	data = getattr(batch, column)
+	result[column] = numpy.frombuffer(data, dtype=numpy.dtype(typecode))
+    return result
+
+# vim: sts=4 sw=4 noet
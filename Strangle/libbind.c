@@ -22,49 +22,156 @@
 #include <sys/types.h>
 #include <netinet/in.h>
 #include <netdb.h>
+#include <arpa/inet.h>
 #include <arpa/nameser.h>
 #include <resolv.h>
 
+#include <stdlib.h>
+#include <string.h>
 #include <strings.h>
+#include <time.h>
 
 static char libbind_doc[] = 
 "This module is a thin wrapper around the libbind parsing routines.";
 
+/* Why a packet could not be parsed */
+static const char libbind_err_packet[] = "BIND cannot parse this packet";
+static const char libbind_err_record[] = "BIND says there is no such record in this message";
+static const char libbind_err_name[]   = "BIND cannot decompress this name";
+
+/*
+ * Instrumentation.  It is off unless set_stats() turns it on, and then the
+ * parse functions count the packets and records they see and time their
+ * stages.  The counters are only touched with the GIL held.
+ */
+enum { LIBBIND_FAIL_INITPARSE, LIBBIND_FAIL_PARSERR, LIBBIND_FAIL_NAME, LIBBIND_FAIL_OTHER, LIBBIND_FAIL_MAX };
+enum { LIBBIND_STAGE_NATIVE, LIBBIND_STAGE_OBJECTS, LIBBIND_STAGE_MAX };
+
+static int libbind_stats_enabled = 0;
+
+static struct {
+    unsigned PY_LONG_LONG packets;
+    unsigned PY_LONG_LONG failures[LIBBIND_FAIL_MAX];
+    unsigned PY_LONG_LONG sections[ns_s_max];
+    unsigned PY_LONG_LONG nanoseconds[LIBBIND_STAGE_MAX];
+    unsigned PY_LONG_LONG types[65536];
+} libbind_stats;
+
+/* A monotonic clock in nanoseconds */
+static PY_LONG_LONG
+libbind_now(void)
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (PY_LONG_LONG)now.tv_sec * 1000000000LL + now.tv_nsec;
+}
+
+/* Count a failure by the error message it got */
+static void
+libbind_stats_failure(const char *error)
+{
+    if( error == libbind_err_packet )
+	libbind_stats.failures[LIBBIND_FAIL_INITPARSE]++;
+    else if( error == libbind_err_record )
+	libbind_stats.failures[LIBBIND_FAIL_PARSERR]++;
+    else if( error == libbind_err_name )
+	libbind_stats.failures[LIBBIND_FAIL_NAME]++;
+    else
+	libbind_stats.failures[LIBBIND_FAIL_OTHER]++;
+}
+
+static void
+libbind_stats_record(int section, int type)
+{
+    libbind_stats.sections[section]++;
+    libbind_stats.types[type & 0xffff]++;
+}
+
 static char libbind_ns_msg_doc[] =
 "This is a Python type that wraps the libbind ns_msg structure.  It is useful\n\
-with the other libbind functions";
+with the other libbind functions.\n\
+\n\
+The ns_msg holds on to the packet it was made from, so the packet need not be\n\
+kept alive separately.  Calling __init__() again with a new packet reuses the\n\
+object and releases the old packet, as long as no ns_rr still points into it.";
 
 typedef struct {
     PyObject_HEAD
-    ns_msg packet;
+    ns_msg    packet;
+    Py_buffer view;		/* The packet data, which ns_msg points into */
+    int       hasView;
+    int       records;		/* The number of ns_rr objects which point into view */
 } libbind_ns_msg;
 
 /* __init__() */
 static int
 libbind_ns_msg_init(libbind_ns_msg *self, PyObject *args)
 {
-    char *packetData;
-    int  packetLength, result;
+    Py_buffer view;
+    ns_msg packet;
+    int result;
+
+    /* Anything with the buffer interface will do (str, bytearray, mmap, etc.).
+     * Holding the view keeps a reference to the object which owns the bytes,
+     * and stops a bytearray from being resized under us.
+     */
+    if( !PyArg_ParseTuple(args, "s*", &view) )
+	return -1;
 
-    if( !PyArg_ParseTuple(args, "s#", &packetData, &packetLength) )
+    if( self->records > 0 ) {
+	PyBuffer_Release(&view);
+	PyErr_SetString(PyExc_BufferError, "ns_rr objects still point into the old packet");
 	return -1;
+    }
 
-    result = ns_initparse(packetData, packetLength, &(self->packet));
+    /* ns_initparse() fills in the handle before it finds a bad packet, so
+     * parse into a local one and leave the old packet alone on failure. */
+    result = ns_initparse((const u_char *)view.buf, (int)view.len, &packet);
     if( result != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "BIND cannot parse this packet");
+	PyBuffer_Release(&view);
+	if( libbind_stats_enabled )
+	    libbind_stats_failure(libbind_err_packet);
+	PyErr_SetString(PyExc_TypeError, libbind_err_packet);
 	return -1;
     }
 
+    if( libbind_stats_enabled )
+	libbind_stats.packets++;
+
+    if( self->hasView )
+	PyBuffer_Release(&self->view);
+    self->packet  = packet;
+    self->view    = view;
+    self->hasView = 1;
+
+    return 0;
+}
+
+static int
+libbind_ns_msg_traverse(libbind_ns_msg *self, visitproc visit, void *arg)
+{
+    if( self->hasView )
+	Py_VISIT(self->view.obj);
     return 0;
 }
 
+static void
+libbind_ns_msg_dealloc(libbind_ns_msg *self)
+{
+    PyObject_GC_UnTrack(self);
+    if( self->hasView )
+	PyBuffer_Release(&self->view);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
 static PyTypeObject libbind_ns_msgType = {
     PyObject_HEAD_INIT(NULL)
     0,						/* ob_size */
     "Strangle.libbind.ns_msg",			/* tp_name */
     sizeof(libbind_ns_msg),			/* tp_basicsize */
     0,						/* tp_itemsize */
-    0,						/* tp_dealloc */
+    (destructor)libbind_ns_msg_dealloc,		/* tp_dealloc */
     0,						/* tp_print */
     0,						/* tp_getattr */
     0,						/* tp_setattr */
@@ -79,9 +186,9 @@ static PyTypeObject libbind_ns_msgType = {
     0,						/* tp_getattro */
     0,						/* tp_setattro */
     0,						/* tp_as_buffer */
-    Py_TPFLAGS_DEFAULT,				/* tp_flags */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,	/* tp_flags */
     libbind_ns_msg_doc,				/* tp_doc */
-    0,						/* tp_traverse       */
+    (traverseproc)libbind_ns_msg_traverse,	/* tp_traverse       */
     0,						/* tp_clear          */
     0,						/* tp_richcompare    */
     0,						/* tp_weaklistoffset */
@@ -98,15 +205,42 @@ static PyTypeObject libbind_ns_msgType = {
     (initproc)libbind_ns_msg_init,		/* tp_init           */
 };
 
+/* Return an argument as an ns_msg, or NULL with a TypeError set.  Neither
+ * type can be subclassed, so the check is by identity rather than by name.
+ */
+static libbind_ns_msg *
+libbind_as_ns_msg(PyObject *arg)
+{
+    if( Py_TYPE(arg) != &libbind_ns_msgType ) {
+	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
+	return NULL;
+    }
+    return (libbind_ns_msg *)arg;
+}
+
 static char libbind_ns_rr_doc[] =
 "This is a Python type that wraps the libbind ns_rr structure.  It is useful\n\
-with the other libbind functions";
+with the other libbind functions.  It keeps its ns_msg alive.";
 
 typedef struct {
     PyObject_HEAD
-    ns_rr record;
+    ns_rr           record;
+    libbind_ns_msg *message;	/* The ns_msg whose packet the record points into */
 } libbind_ns_rr;
 
+/* Let go of the parent ns_msg, so that it may be reused or freed. */
+static void
+libbind_ns_rr_release(libbind_ns_rr *self)
+{
+    libbind_ns_msg *message = self->message;
+
+    if( message != NULL ) {
+	self->message = NULL;
+	message->records--;
+	Py_DECREF(message);
+    }
+}
+
 /* __init__() */
 static int
 libbind_ns_rr_init(libbind_ns_rr *self, PyObject *args)
@@ -114,37 +248,63 @@ libbind_ns_rr_init(libbind_ns_rr *self, PyObject *args)
     PyObject       *firstArg;
     libbind_ns_msg *message;
     int section, rrnum, result;
-    PyTypeObject *messageType;
-    char         *messageTypeStr;
 
     if( !PyArg_ParseTuple(args, "Oii", &firstArg, &section, &rrnum) )
 	return -1;
 
-    messageType    = (PyTypeObject *)(firstArg->ob_type);
-    messageTypeStr = messageType->tp_name;
-    if( strcmp(messageTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
+    message = libbind_as_ns_msg(firstArg);
+    if( message == NULL )
 	return -1;
-    }
-
-    message = (libbind_ns_msg *)firstArg;
 
     result = ns_parserr(&(message->packet), section, rrnum, &(self->record));
     if( result != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "BIND says there is no such record in this message");
+	if( libbind_stats_enabled )
+	    libbind_stats_failure(libbind_err_record);
+	PyErr_SetString(PyExc_TypeError, libbind_err_record);
 	return -1;
     }
 
+    if( libbind_stats_enabled )
+	libbind_stats_record(section, ns_rr_type(self->record));
+
+    /* Take the new reference before dropping the old, in case they are the same. */
+    Py_INCREF(message);
+    message->records++;
+    libbind_ns_rr_release(self);
+    self->message = message;
+
+    return 0;
+}
+
+static int
+libbind_ns_rr_traverse(libbind_ns_rr *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->message);
+    return 0;
+}
+
+static int
+libbind_ns_rr_clear(libbind_ns_rr *self)
+{
+    libbind_ns_rr_release(self);
     return 0;
 }
 
+static void
+libbind_ns_rr_dealloc(libbind_ns_rr *self)
+{
+    PyObject_GC_UnTrack(self);
+    libbind_ns_rr_release(self);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
 static PyTypeObject libbind_ns_rrType = {
     PyObject_HEAD_INIT(NULL)
     0,						/* ob_size */
     "Strangle.libbind.ns_rr",			/* tp_name */
     sizeof(libbind_ns_rr),			/* tp_basicsize */
     0,						/* tp_itemsize */
-    0,						/* tp_dealloc */
+    (destructor)libbind_ns_rr_dealloc,		/* tp_dealloc */
     0,						/* tp_print */
     0,						/* tp_getattr */
     0,						/* tp_setattr */
@@ -159,10 +319,10 @@ static PyTypeObject libbind_ns_rrType = {
     0,						/* tp_getattro */
     0,						/* tp_setattro */
     0,						/* tp_as_buffer */
-    Py_TPFLAGS_DEFAULT,				/* tp_flags */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,	/* tp_flags */
     libbind_ns_rr_doc,				/* tp_doc */
-    0,						/* tp_traverse       */
-    0,						/* tp_clear          */
+    (traverseproc)libbind_ns_rr_traverse,	/* tp_traverse       */
+    (inquiry)libbind_ns_rr_clear,		/* tp_clear          */
     0,						/* tp_richcompare    */
     0,						/* tp_weaklistoffset */
     0,						/* tp_iter           */
@@ -178,373 +338,3929 @@ static PyTypeObject libbind_ns_rrType = {
     (initproc)libbind_ns_rr_init,		/* tp_init           */
 };
 
-static char libbind_ns_msg_id_doc[] =
-"Returns the DNS message unique ID";
+/* Return an argument as an ns_rr, or NULL with a TypeError set. */
+static libbind_ns_rr *
+libbind_as_ns_rr(PyObject *arg)
+{
+    if( Py_TYPE(arg) != &libbind_ns_rrType ) {
+	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+	return NULL;
+    }
+    return (libbind_ns_rr *)arg;
+}
 
-static PyObject *
-libbind_ns_msg_id(PyObject *self, PyObject *args)
+/* Return an int argument in [0, limit), or -1 with an exception set. */
+static int
+libbind_index_arg(PyObject *arg, int limit, const char *error)
 {
-    u_int16_t id;
-    PyObject *message;
-    PyTypeObject *messageType;
-    char         *messageTypeStr;
+    long value;
 
-    if( !PyArg_ParseTuple(args, "O", &message) )
-	return NULL;
+    value = PyInt_AsLong(arg);
+    if( value == -1 && PyErr_Occurred() )
+	return -1;
 
-    messageType    = (PyTypeObject *)(message->ob_type);
-    messageTypeStr = messageType->tp_name;
-    if( strcmp(messageTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
-	return NULL;
+    if( value < 0 || value >= limit ) {
+	PyErr_SetString(PyExc_ValueError, error);
+	return -1;
     }
+    return (int)value;
+}
+
+/*
+ * The ns_msg getters and methods.  The module functions named after the
+ * libbind macros (ns_msg_id(msg) and so on) are wrappers around them.
+ */
+static char libbind_ns_msg_id_doc[] =
+"Returns the DNS message unique ID";
 
-    id = ns_msg_id( ((libbind_ns_msg *)message)->packet );
-    return PyInt_FromLong((long)id);
+static PyObject *
+libbind_msg_id(libbind_ns_msg *self, void *closure)
+{
+    return PyInt_FromLong((long)ns_msg_id(self->packet));
 }
 
 static char libbind_ns_msg_getflag_doc[] =
 "Returns the requested flag field from an ns_msg object";
 
 static PyObject *
-libbind_ns_msg_getflag(PyObject *self, PyObject *args)
+libbind_msg_getflag(libbind_ns_msg *self, PyObject *arg)
 {
-    PyObject *message;
     int flag;
-    u_int16_t flagVal;
-
-    PyTypeObject *messageType;
-    char         *messageTypeStr;
-
-    if( !PyArg_ParseTuple(args, "Oi", &message, &flag) )
-	return NULL;
 
-    messageType    = (PyTypeObject *)(message->ob_type);
-    messageTypeStr = messageType->tp_name;
-    if( strcmp(messageTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
+    /* libbind's flag table has 16 entries, the ones past ns_f_rcode being zero. */
+    flag = libbind_index_arg(arg, 16, "No such flag");
+    if( flag == -1 )
 	return NULL;
-    }
 
-    flagVal = ns_msg_getflag(((libbind_ns_msg *)message)->packet, flag);
-    return Py_BuildValue("i", (int)flagVal);
+    return PyInt_FromLong((long)ns_msg_getflag(self->packet, flag));
 }
 
 static char libbind_ns_msg_count_doc[] =
 "Returns the number of entries in a given section of an ns_msg object";
 
 static PyObject *
-libbind_ns_msg_count(PyObject *self, PyObject *args)
+libbind_msg_count(libbind_ns_msg *self, PyObject *arg)
 {
-    PyObject *message;
     int section;
-    u_int16_t count;
-
-    PyTypeObject *messageType;
-    char         *messageTypeStr;
 
-    if( !PyArg_ParseTuple(args, "Oi", &message, &section) )
+    section = libbind_index_arg(arg, ns_s_max, "No such section");
+    if( section == -1 )
 	return NULL;
 
-    messageType    = (PyTypeObject *)(message->ob_type);
-    messageTypeStr = messageType->tp_name;
-    if( strcmp(messageTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
-	return NULL;
+    return PyInt_FromLong((long)ns_msg_count(self->packet, section));
+}
+
+/*
+ * An iterator over the records of an ns_msg, optionally of one section and
+ * some record types.  The records are read with ns_parserr() one at a time,
+ * and only those which pass the filter become ns_rr objects.
+ */
+static char libbind_ns_records_doc[] =
+"An iterator over the records of an ns_msg, yielding ns_rr objects.  Get one\n\
+with ns_msg.iter_records().";
+
+typedef struct {
+    PyObject_HEAD
+    libbind_ns_msg *message;	/* NULL once the iterator is exhausted */
+    int             section;	/* The section being read */
+    int             last;	/* The section after the last one to read */
+    int             rrnum;	/* The next record in the section */
+    u_int16_t      *types;	/* The types to yield, or NULL for all of them */
+    Py_ssize_t      typeCount;
+} libbind_ns_records;
+
+/* Let go of the ns_msg, so that it may be reused or freed. */
+static void
+libbind_ns_records_release(libbind_ns_records *self)
+{
+    libbind_ns_msg *message = self->message;
+
+    if( message != NULL ) {
+	self->message = NULL;
+	message->records--;
+	Py_DECREF(message);
     }
+}
+
+static int
+libbind_ns_records_traverse(libbind_ns_records *self, visitproc visit, void *arg)
+{
+    Py_VISIT(self->message);
+    return 0;
+}
 
-    count = ns_msg_count(((libbind_ns_msg *)message)->packet, section);
-    return Py_BuildValue("i", (int)count);
+static int
+libbind_ns_records_clear(libbind_ns_records *self)
+{
+    libbind_ns_records_release(self);
+    return 0;
 }
 
-static char libbind_ns_rr_name_doc[] =
-"Returns the name (i.e. usually host name) in an ns_rr record";
+static void
+libbind_ns_records_dealloc(libbind_ns_records *self)
+{
+    PyObject_GC_UnTrack(self);
+    libbind_ns_records_release(self);
+    PyMem_Free(self->types);
+    self->ob_type->tp_free((PyObject *)self);
+}
 
-static PyObject *
-libbind_ns_rr_name(PyObject *self, PyObject *args)
+/* Return whether records of a type are yielded. */
+static int
+libbind_ns_records_wanted(libbind_ns_records *self, u_int16_t type)
 {
-    PyObject *rr;
-    char *name;
+    Py_ssize_t index;
 
-    PyTypeObject *argType;
-    char         *argTypeStr;
+    if( self->types == NULL )
+	return 1;
 
-    if( !PyArg_ParseTuple(args, "O", &rr) )
-	return NULL;
+    for( index = 0; index < self->typeCount; index++ )
+	if( self->types[index] == type )
+	    return 1;
+    return 0;
+}
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+/* next() */
+static PyObject *
+libbind_ns_records_next(libbind_ns_records *self)
+{
+    libbind_ns_msg *message = self->message;
+    libbind_ns_rr  *rr;
+    ns_rr record;
+
+    if( message == NULL )
 	return NULL;
+
+    while( self->section < self->last ) {
+	if( self->rrnum >= ns_msg_count(message->packet, self->section) ) {
+	    self->section++;
+	    self->rrnum = 0;
+	    continue;
+	}
+
+	/* ns_parserr() carries on from the previous record, so this is not quadratic. */
+	if( ns_parserr(&message->packet, self->section, self->rrnum, &record) != 0 ) {
+	    libbind_ns_records_release(self);
+	    if( libbind_stats_enabled )
+		libbind_stats_failure(libbind_err_record);
+	    PyErr_SetString(PyExc_TypeError, libbind_err_record);
+	    return NULL;
+	}
+	self->rrnum++;
+
+	if( libbind_stats_enabled )
+	    libbind_stats_record(self->section, ns_rr_type(record));
+
+	if( !libbind_ns_records_wanted(self, ns_rr_type(record)) )
+	    continue;
+
+	rr = (libbind_ns_rr *)libbind_ns_rrType.tp_alloc(&libbind_ns_rrType, 0);
+	if( rr == NULL )
+	    return NULL;
+
+	rr->record  = record;
+	rr->message = message;
+	Py_INCREF(message);
+	message->records++;
+	return (PyObject *)rr;
     }
 
-    name = ns_rr_name(((libbind_ns_rr *)rr)->record);
-    return PyString_FromString(name);
+    libbind_ns_records_release(self);
+    return NULL;
 }
 
-static char libbind_ns_rr_type_doc[] =
-"Returns the type of an ns_rr record";
+static PyTypeObject libbind_ns_recordsType = {
+    PyObject_HEAD_INIT(NULL)
+    0,						/* ob_size */
+    "Strangle.libbind.ns_records",		/* tp_name */
+    sizeof(libbind_ns_records),			/* tp_basicsize */
+    0,						/* tp_itemsize */
+    (destructor)libbind_ns_records_dealloc,	/* tp_dealloc */
+    0,						/* tp_print */
+    0,						/* tp_getattr */
+    0,						/* tp_setattr */
+    0,						/* tp_compare */
+    0,						/* tp_repr */
+    0,						/* tp_as_number */
+    0,						/* tp_as_sequence */
+    0,						/* tp_as_mapping */
+    0,						/* tp_hash */
+    0,						/* tp_call */
+    0,						/* tp_str */
+    0,						/* tp_getattro */
+    0,						/* tp_setattro */
+    0,						/* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_GC,	/* tp_flags */
+    libbind_ns_records_doc,			/* tp_doc */
+    (traverseproc)libbind_ns_records_traverse,	/* tp_traverse       */
+    (inquiry)libbind_ns_records_clear,		/* tp_clear          */
+    0,						/* tp_richcompare    */
+    0,						/* tp_weaklistoffset */
+    PyObject_SelfIter,				/* tp_iter           */
+    (iternextfunc)libbind_ns_records_next,	/* tp_iternext       */
+};
 
+/* Return a new ns_records iterator, or NULL with an exception set.
+ * section is -1 for every section, and types None for every type.
+ */
 static PyObject *
-libbind_ns_rr_type(PyObject *self, PyObject *args)
+libbind_ns_records_new(libbind_ns_msg *message, int section, PyObject *types)
 {
-    PyObject *rr;
-    u_int16_t type;
+    libbind_ns_records *iterator;
+    PyObject *sequence;
+    Py_ssize_t index;
+    long type;
 
-    PyTypeObject *argType;
-    char         *argTypeStr;
-
-    if( !PyArg_ParseTuple(args, "O", &rr) )
+    if( section < -1 || section >= ns_s_max ) {
+	PyErr_SetString(PyExc_ValueError, "No such section");
 	return NULL;
+    }
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    iterator = PyObject_GC_New(libbind_ns_records, &libbind_ns_recordsType);
+    if( iterator == NULL )
 	return NULL;
+
+    iterator->message   = NULL;
+    iterator->section   = section == -1 ? 0 : section;
+    iterator->last      = section == -1 ? ns_s_max : section + 1;
+    iterator->rrnum     = 0;
+    iterator->types     = NULL;
+    iterator->typeCount = 0;
+
+    if( types != Py_None ) {
+	sequence = PySequence_Fast(types, "types must be a sequence of record type numbers");
+	if( sequence == NULL ) {
+	    Py_DECREF(iterator);
+	    return NULL;
+	}
+
+	/* One more than needed, so that an empty filter is not a NULL one. */
+	iterator->typeCount = PySequence_Fast_GET_SIZE(sequence);
+	iterator->types     = PyMem_New(u_int16_t, iterator->typeCount + 1);
+	if( iterator->types == NULL ) {
+	    Py_DECREF(sequence);
+	    Py_DECREF(iterator);
+	    return PyErr_NoMemory();
+	}
+
+	for( index = 0; index < iterator->typeCount; index++ ) {
+	    type = PyInt_AsLong(PySequence_Fast_GET_ITEM(sequence, index));
+	    if( type == -1 && PyErr_Occurred() ) {
+		Py_DECREF(sequence);
+		Py_DECREF(iterator);
+		return NULL;
+	    }
+	    if( type < 0 || type > 0xffff ) {
+		PyErr_SetString(PyExc_ValueError, "Record types are 16-bit numbers");
+		Py_DECREF(sequence);
+		Py_DECREF(iterator);
+		return NULL;
+	    }
+	    iterator->types[index] = (u_int16_t)type;
+	}
+	Py_DECREF(sequence);
     }
 
-    type = ns_rr_type(((libbind_ns_rr *)rr)->record);
-    return PyInt_FromLong((long)type);
+    /* Like an ns_rr, the iterator stops the ns_msg from being reused. */
+    Py_INCREF(message);
+    message->records++;
+    iterator->message = message;
+
+    PyObject_GC_Track(iterator);
+    return (PyObject *)iterator;
 }
 
-static char libbind_ns_rr_class_doc[] =
-"Returns the network class of an ns_rr record (usually ns_c_in for Internet)";
+static char libbind_ns_msg_iter_records_doc[] =
+"Returns an iterator over the records of an ns_msg, as ns_rr objects.\n\
+    \n\
+    iter_records(section=-1, types=None) reads every section, or only section\n\
+    if it is not -1.  If types is a sequence of record type numbers, only the\n\
+    records of those types are yielded, and the others are skipped without\n\
+    making Python objects for them.";
 
 static PyObject *
-libbind_ns_rr_class(PyObject *self, PyObject *args)
+libbind_msg_iter_records(libbind_ns_msg *self, PyObject *args, PyObject *kwargs)
 {
-    PyObject *rr;
-    u_int16_t class;
-
-    PyTypeObject *argType;
-    char         *argTypeStr;
-
-    if( !PyArg_ParseTuple(args, "O", &rr) )
-	return NULL;
+    static char *keywords[] = { "section", "types", NULL };
+    PyObject *types = Py_None;
+    int section = -1;
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    if( !PyArg_ParseTupleAndKeywords(args, kwargs, "|iO", keywords, &section, &types) )
 	return NULL;
-    }
 
-    class = ns_rr_class(((libbind_ns_rr *)rr)->record);
-    return PyInt_FromLong((long)class);
+    return libbind_ns_records_new(self, section, types);
 }
 
-static char libbind_ns_rr_ttl_doc[] =
-"Returns the time to live of an ns_rr record";
+static PyGetSetDef libbind_ns_msg_getset[] = {
+    {"id", (getter)libbind_msg_id, NULL, libbind_ns_msg_id_doc},
+    {NULL}
+};
+
+static PyMethodDef libbind_ns_msg_methods[] = {
+    {"getflag", (PyCFunction)libbind_msg_getflag, METH_O, libbind_ns_msg_getflag_doc},
+    {"count"  , (PyCFunction)libbind_msg_count  , METH_O, libbind_ns_msg_count_doc},
+    {"iter_records", (PyCFunction)libbind_msg_iter_records, METH_VARARGS | METH_KEYWORDS,
+     libbind_ns_msg_iter_records_doc},
+    {NULL, NULL}
+};
 
 static PyObject *
-libbind_ns_rr_ttl(PyObject *self, PyObject *args)
+libbind_ns_msg_id(PyObject *self, PyObject *message)
 {
-    PyObject *rr;
-    u_int32_t ttl;
+    if( libbind_as_ns_msg(message) == NULL )
+	return NULL;
+
+    return libbind_msg_id((libbind_ns_msg *)message, NULL);
+}
 
-    PyTypeObject *argType;
-    char         *argTypeStr;
+static PyObject *
+libbind_ns_msg_getflag(PyObject *self, PyObject *args)
+{
+    PyObject *message, *flag;
 
-    if( !PyArg_ParseTuple(args, "O", &rr) )
+    if( !PyArg_ParseTuple(args, "OO", &message, &flag) )
 	return NULL;
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    if( libbind_as_ns_msg(message) == NULL )
 	return NULL;
-    }
 
-    ttl = ns_rr_ttl(((libbind_ns_rr *)rr)->record);
-    return PyInt_FromLong((long)ttl);
+    return libbind_msg_getflag((libbind_ns_msg *)message, flag);
 }
 
-static char libbind_ns_rr_rdlen_doc[] =
-"Returns the length of the record data in an ns_rr object";
-
 static PyObject *
-libbind_ns_rr_rdlen(PyObject *self, PyObject *args)
+libbind_ns_msg_count(PyObject *self, PyObject *args)
 {
-    PyObject *rr;
-    u_int16_t length;
+    PyObject *message, *section;
 
-    PyTypeObject *argType;
-    char         *argTypeStr;
-
-    if( !PyArg_ParseTuple(args, "O", &rr) )
+    if( !PyArg_ParseTuple(args, "OO", &message, &section) )
 	return NULL;
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    if( libbind_as_ns_msg(message) == NULL )
 	return NULL;
-    }
 
-    length = ns_rr_rdlen(((libbind_ns_rr *)rr)->record);
-    return PyInt_FromLong((long)length);
+    return libbind_msg_count((libbind_ns_msg *)message, section);
 }
 
-static char libbind_ns_rr_rdata_doc[] =
-"Returns a string representing the data in an ns_rr object";
-
 static PyObject *
-libbind_ns_rr_rdata(PyObject *self, PyObject *args)
+libbind_iter_records(PyObject *self, PyObject *args, PyObject *kwargs)
 {
-    PyObject *rr;
-    const u_char *rdata;
-    u_int16_t length;
-
-    PyTypeObject *argType;
-    char         *argTypeStr;
+    static char *keywords[] = { "msg", "section", "types", NULL };
+    PyObject *message, *types = Py_None;
+    int section = -1;
 
-    if( !PyArg_ParseTuple(args, "O", &rr) )
+    if( !PyArg_ParseTupleAndKeywords(args, kwargs, "O|iO", keywords, &message, &section, &types) )
 	return NULL;
 
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    if( libbind_as_ns_msg(message) == NULL )
 	return NULL;
-    }
 
-    length = ns_rr_rdlen(((libbind_ns_rr *)rr)->record);
-    rdata  = ns_rr_rdata(((libbind_ns_rr *)rr)->record);
-
-    /* If the result is NULL it means there is no data in the record, so return None.
-     * This seems to be happening implicitly from Py_BuildValue but we do it
-     * anyway for clarity.
-     */
-    if( rdata == (const u_char *)NULL ) {
-	Py_INCREF(Py_None);
-	return Py_None;
-    }
-
-    return Py_BuildValue("s#", rdata, length);
+    return libbind_ns_records_new((libbind_ns_msg *)message, section, types);
 }
 
-static char libbind_ns_name_uncompress_doc[] =
-"Returns a string of the uncompressed hostname from an ns_msg object.\n\
-    \n\
-    Only pass this function an ns_msg object and the ns_rr record which\n\
-    has the data you want decompressed.";
+/*
+ * Optional interning of names.  The same few thousand names make up most of
+ * the records in a capture, so with interning on, every name handed to
+ * Python is looked up in a bounded table and the first string made for it is
+ * shared.  The table approximates LRU with two generations: names go into the
+ * young dict, and when that is half the size limit it becomes the old dict
+ * and the previous old dict is dropped.  A name found in the old dict is
+ * moved back into the young one.
+ */
+static PyObject   *libbind_intern_young = NULL;
+static PyObject   *libbind_intern_old   = NULL;
+static Py_ssize_t  libbind_intern_size  = 0;
 
+/* Return a new reference to a string for name, shared if interning is on. */
 static PyObject *
-libbind_ns_name_uncompress(PyObject *self, PyObject *args)
+libbind_intern_length(const char *name, Py_ssize_t length)
 {
-    libbind_ns_msg *message;
-    libbind_ns_rr  *rr;
-    const u_char *msgStart, *msgEnd, *compressedName;
-    char fullName[MAXDNAME + 1];
-    int  length;
+    PyObject *string, *shared, *young;
 
-    PyTypeObject *argType;
-    char         *argTypeStr;
+    string = PyString_FromStringAndSize(name, length);
+    if( string == NULL || libbind_intern_size == 0 )
+	return string;
 
-    if( !PyArg_ParseTuple(args, "OO", (PyObject *)&message, (PyObject *)&rr) )
-	return NULL;
+    shared = PyDict_GetItem(libbind_intern_young, string);
+    if( shared != NULL ) {
+	Py_INCREF(shared);
+	Py_DECREF(string);
+	return shared;
+    }
 
-    /* First argument must be an ns_msg. */
-    argType    = (PyTypeObject *)(message->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
-	return NULL;
+    shared = PyDict_GetItem(libbind_intern_old, string);
+    if( shared != NULL ) {
+	Py_INCREF(shared);
+	Py_DECREF(string);
+	string = shared;
     }
 
-    /* Second argument must be an ns_rr. */
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    if( PyDict_Size(libbind_intern_young) * 2 >= libbind_intern_size ) {
+	young = PyDict_New();
+	if( young == NULL ) {
+	    Py_DECREF(string);
+	    return NULL;
+	}
+	Py_DECREF(libbind_intern_old);
+	libbind_intern_old   = libbind_intern_young;
+	libbind_intern_young = young;
+    }
+
+    if( PyDict_SetItem(libbind_intern_young, string, string) == -1 ) {
+	Py_DECREF(string);
 	return NULL;
     }
+    return string;
+}
 
-    /* It would be nice to validate whether the ns_rr came from the ns_msg. */
+static PyObject *
+libbind_intern(const char *name)
+{
+    return libbind_intern_length(name, strlen(name));
+}
 
-    msgStart       = ns_msg_base(message->packet);
-    msgEnd         = ns_msg_end(message->packet);
-    compressedName = ns_rr_rdata(rr->record);
+static char libbind_set_stats_doc[] =
+"Turns the parse counters and timers on or off.\n\
+    \n\
+    set_stats(enabled) returns whether they were on.  While they are off (the\n\
+    default) the parse functions only test a flag.";
 
-    /* If the data is an MX record, then we need to skip two bytes to get to the hostname. */
-    if( ns_rr_type(rr->record) == ns_t_mx )
-	compressedName += 2;
+static PyObject *
+libbind_set_stats(PyObject *self, PyObject *args)
+{
+    int enabled, previous;
 
-    bzero((void *)fullName, (size_t)(MAXDNAME + 1));
-    length = ns_name_uncompress(msgStart, msgEnd, compressedName, fullName, MAXDNAME);
-    if( length == -1 ) {
-	PyErr_SetString(PyExc_TypeError, "BIND cannot decompress this name");
+    if( !PyArg_ParseTuple(args, "i", &enabled) )
 	return NULL;
-    }
 
-    return PyString_FromString(fullName);
+    previous = libbind_stats_enabled;
+    libbind_stats_enabled = enabled != 0;
+    return PyBool_FromLong(previous);
 }
 
-static char libbind_ns_data_offset_doc[] =
-"Returns the offset in the raw message that contains the record data";
+static char libbind_stats_doc[] =
+"Returns a snapshot of the parse counters and timers as a dict.\n\
+    \n\
+    stats(reset=False) returns:\n\
+	enabled     - whether set_stats() has them on\n\
+	packets     - messages parsed (parse_message, parse_many, parse_columns\n\
+		      and ns_msg)\n\
+	failures    - dict of failures by cause: 'initparse' (the header or\n\
+		      section counts), 'parserr' (a record), 'name' (a name in\n\
+		      record data), 'other' (not a buffer, out of memory)\n\
+	sections    - tuple of records parsed per ns_s_* section\n\
+	types       - dict from record type number to records parsed\n\
+	nanoseconds - dict of time spent by stage: 'native' (libbind, without\n\
+		      the GIL) and 'objects' (building the Python results)\n\
+    If reset is true, the counters are zeroed after the snapshot.";
 
 static PyObject *
-libbind_ns_data_offset(PyObject *self, PyObject *args)
+libbind_stats_py(PyObject *self, PyObject *args)
 {
-    libbind_ns_msg *message;
-    libbind_ns_rr  *rr;
-    const u_char *msgStart, *dataLocation;
-    long offset;
-
-    PyTypeObject *argType;
-    char         *argTypeStr;
+    PyObject *types, *count, *typeNumber, *result;
+    int reset, type;
 
-    if( !PyArg_ParseTuple(args, "OO", (PyObject *)&message, (PyObject *)&rr) )
+    reset = 0;
+    if( !PyArg_ParseTuple(args, "|i", &reset) )
 	return NULL;
 
-    /* First argument must be an ns_msg. */
-    argType    = (PyTypeObject *)(message->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_msg") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_msg object");
+    types = PyDict_New();
+    if( types == NULL )
 	return NULL;
+
+    for( type = 0; type < 65536; type++ ) {
+	if( libbind_stats.types[type] == 0 )
+	    continue;
+
+	typeNumber = PyInt_FromLong(type);
+	count      = PyLong_FromUnsignedLongLong(libbind_stats.types[type]);
+	if( typeNumber == NULL || count == NULL || PyDict_SetItem(types, typeNumber, count) == -1 ) {
+	    Py_XDECREF(typeNumber);
+	    Py_XDECREF(count);
+	    Py_DECREF(types);
+	    return NULL;
+	}
+	Py_DECREF(typeNumber);
+	Py_DECREF(count);
     }
 
-    /* Second argument must be an ns_rr. */
-    argType    = (PyTypeObject *)(rr->ob_type);
-    argTypeStr = argType->tp_name;
-    if( strcmp(argTypeStr, "Strangle.libbind.ns_rr") != 0 ) {
-	PyErr_SetString(PyExc_TypeError, "Argument must be a ns_rr object");
+    result = Py_BuildValue("{s:N,s:K,s:{s:K,s:K,s:K,s:K},s:(KKKK),s:N,s:{s:K,s:K}}",
+			   "enabled", PyBool_FromLong(libbind_stats_enabled),
+			   "packets", libbind_stats.packets,
+			   "failures",
+			       "initparse", libbind_stats.failures[LIBBIND_FAIL_INITPARSE],
+			       "parserr", libbind_stats.failures[LIBBIND_FAIL_PARSERR],
+			       "name", libbind_stats.failures[LIBBIND_FAIL_NAME],
+			       "other", libbind_stats.failures[LIBBIND_FAIL_OTHER],
+			   "sections",
+			       libbind_stats.sections[ns_s_qd], libbind_stats.sections[ns_s_an],
+			       libbind_stats.sections[ns_s_ns], libbind_stats.sections[ns_s_ar],
+			   "types", types,
+			   "nanoseconds",
+			       "native", libbind_stats.nanoseconds[LIBBIND_STAGE_NATIVE],
+			       "objects", libbind_stats.nanoseconds[LIBBIND_STAGE_OBJECTS]);
+
+    if( result != NULL && reset )
+	memset(&libbind_stats, 0, sizeof(libbind_stats));
+    return result;
+}
+
+static char libbind_set_intern_size_doc[] =
+"Sets how many distinct names are interned, and returns the previous limit.\n\
+    \n\
+    With a limit above zero, parse_message() and the other functions which\n\
+    return names share one string object per distinct name, for up to about\n\
+    that many recently seen names.  0 (the default) turns interning off and\n\
+    empties the table.";
+
+static PyObject *
+libbind_set_intern_size(PyObject *self, PyObject *args)
+{
+    Py_ssize_t size, previous;
+    PyObject *young, *old;
+
+    if( !PyArg_ParseTuple(args, "n", &size) )
+	return NULL;
+
+    if( size < 0 ) {
+	PyErr_SetString(PyExc_ValueError, "The intern size cannot be negative");
+	return NULL;
+    }
+
+    young = PyDict_New();
+    old   = PyDict_New();
+    if( young == NULL || old == NULL ) {
+	Py_XDECREF(young);
+	Py_XDECREF(old);
+	return NULL;
+    }
+
+    Py_XDECREF(libbind_intern_young);
+    Py_XDECREF(libbind_intern_old);
+    libbind_intern_young = young;
+    libbind_intern_old   = old;
+
+    previous            = libbind_intern_size;
+    libbind_intern_size = size;
+    return PyInt_FromSsize_t(previous);
+}
+
+/*
+ * The ns_rr getters and methods, and the module functions wrapping them.
+ * The record keeps its ns_msg, so the getters need no other argument.
+ */
+static char libbind_ns_rr_name_doc[] =
+"Returns the name (i.e. usually host name) in an ns_rr record";
+
+static PyObject *
+libbind_rr_name(libbind_ns_rr *self, void *closure)
+{
+    return libbind_intern(ns_rr_name(self->record));
+}
+
+static char libbind_ns_rr_type_doc[] =
+"Returns the type of an ns_rr record";
+
+static PyObject *
+libbind_rr_type(libbind_ns_rr *self, void *closure)
+{
+    return PyInt_FromLong((long)ns_rr_type(self->record));
+}
+
+static char libbind_ns_rr_class_doc[] =
+"Returns the network class of an ns_rr record (usually ns_c_in for Internet)";
+
+static PyObject *
+libbind_rr_class(libbind_ns_rr *self, void *closure)
+{
+    return PyInt_FromLong((long)ns_rr_class(self->record));
+}
+
+static char libbind_ns_rr_ttl_doc[] =
+"Returns the time to live of an ns_rr record";
+
+static PyObject *
+libbind_rr_ttl(libbind_ns_rr *self, void *closure)
+{
+    return PyInt_FromLong((long)ns_rr_ttl(self->record));
+}
+
+static char libbind_ns_rr_rdlen_doc[] =
+"Returns the length of the record data in an ns_rr object";
+
+static PyObject *
+libbind_rr_rdlen(libbind_ns_rr *self, void *closure)
+{
+    return PyInt_FromLong((long)ns_rr_rdlen(self->record));
+}
+
+static char libbind_ns_rr_rdata_doc[] =
+"Returns a string representing the data in an ns_rr object";
+
+static PyObject *
+libbind_rr_rdata(libbind_ns_rr *self, void *closure)
+{
+    const u_char *rdata;
+
+    /* A NULL rdata means there is no data in the record (e.g. for a query). */
+    rdata = ns_rr_rdata(self->record);
+    if( rdata == (const u_char *)NULL ) {
+	Py_INCREF(Py_None);
+	return Py_None;
+    }
+
+    return PyString_FromStringAndSize((const char *)rdata, ns_rr_rdlen(self->record));
+}
+
+/* Return the decompressed name at the start of the rdata (after the
+ * preference of an MX record), or NULL with an exception set.
+ */
+static PyObject *
+libbind_uncompress_rdata(ns_msg *packet, ns_rr *record)
+{
+    const u_char *compressedName;
+    char fullName[MAXDNAME + 1];
+    int  length;
+
+    /* A question has no rdata at all. */
+    compressedName = ns_rr_rdata(*record);
+    if( compressedName == (const u_char *)NULL ) {
+	PyErr_SetString(PyExc_TypeError, libbind_err_name);
+	return NULL;
+    }
+
+    if( ns_rr_type(*record) == ns_t_mx )
+	compressedName += 2;
+
+    bzero((void *)fullName, (size_t)(MAXDNAME + 1));
+    length = ns_name_uncompress(ns_msg_base(*packet), ns_msg_end(*packet), compressedName,
+				fullName, MAXDNAME);
+    if( length == -1 ) {
+	if( libbind_stats_enabled )
+	    libbind_stats_failure(libbind_err_name);
+	PyErr_SetString(PyExc_TypeError, libbind_err_name);
+	return NULL;
+    }
+
+    return libbind_intern(fullName);
+}
+
+/* Return the offset of the rdata in the packet, or None if there is none. */
+static PyObject *
+libbind_rdata_offset(ns_msg *packet, ns_rr *record)
+{
+    const u_char *dataLocation;
+
+    dataLocation = ns_rr_rdata(*record);
+    if( dataLocation == (const u_char *)NULL ) {
+	Py_INCREF(Py_None);
+	return Py_None;
+    }
+
+    return PyInt_FromLong((long)(dataLocation - ns_msg_base(*packet)));
+}
+
+static char libbind_ns_rr_offset_doc[] =
+"Returns the offset of the record data in the packet, or None if there is none";
+
+static PyObject *
+libbind_rr_offset(libbind_ns_rr *self, void *closure)
+{
+    if( self->message == NULL ) {
+	Py_INCREF(Py_None);
+	return Py_None;
+    }
+
+    return libbind_rdata_offset(&self->message->packet, &self->record);
+}
+
+static char libbind_ns_rr_uncompress_doc[] =
+"Returns the uncompressed name at the start of the record data (after the\n\
+    preference of an MX record)";
+
+static PyObject *
+libbind_rr_uncompress(libbind_ns_rr *self)
+{
+    if( self->message == NULL ) {
+	PyErr_SetString(PyExc_TypeError, libbind_err_record);
+	return NULL;
+    }
+
+    return libbind_uncompress_rdata(&self->message->packet, &self->record);
+}
+
+static PyGetSetDef libbind_ns_rr_getset[] = {
+    {"name"      , (getter)libbind_rr_name  , NULL, libbind_ns_rr_name_doc},
+    {"type"      , (getter)libbind_rr_type  , NULL, libbind_ns_rr_type_doc},
+    {"queryClass", (getter)libbind_rr_class , NULL, libbind_ns_rr_class_doc},
+    {"ttl"       , (getter)libbind_rr_ttl   , NULL, libbind_ns_rr_ttl_doc},
+    {"rdlen"     , (getter)libbind_rr_rdlen , NULL, libbind_ns_rr_rdlen_doc},
+    {"rdata"     , (getter)libbind_rr_rdata , NULL, libbind_ns_rr_rdata_doc},
+    {"offset"    , (getter)libbind_rr_offset, NULL, libbind_ns_rr_offset_doc},
+    {NULL}
+};
+
+static PyMethodDef libbind_ns_rr_methods[] = {
+    {"uncompress", (PyCFunction)libbind_rr_uncompress, METH_NOARGS, libbind_ns_rr_uncompress_doc},
+    {NULL, NULL}
+};
+
+static PyObject *
+libbind_ns_rr_name(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_name((libbind_ns_rr *)rr, NULL);
+}
+
+static PyObject *
+libbind_ns_rr_type(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_type((libbind_ns_rr *)rr, NULL);
+}
+
+static PyObject *
+libbind_ns_rr_class(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_class((libbind_ns_rr *)rr, NULL);
+}
+
+static PyObject *
+libbind_ns_rr_ttl(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_ttl((libbind_ns_rr *)rr, NULL);
+}
+
+static PyObject *
+libbind_ns_rr_rdlen(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_rdlen((libbind_ns_rr *)rr, NULL);
+}
+
+static PyObject *
+libbind_ns_rr_rdata(PyObject *self, PyObject *rr)
+{
+    if( libbind_as_ns_rr(rr) == NULL )
+	return NULL;
+
+    return libbind_rr_rdata((libbind_ns_rr *)rr, NULL);
+}
+
+/* Parse an (ns_msg, ns_rr) argument tuple. */
+static int
+libbind_msg_rr_args(PyObject *args, libbind_ns_msg **message, libbind_ns_rr **rr)
+{
+    PyObject *first, *second;
+
+    if( !PyArg_ParseTuple(args, "OO", &first, &second) )
+	return 0;
+
+    *message = libbind_as_ns_msg(first);
+    if( *message == NULL )
+	return 0;
+
+    *rr = libbind_as_ns_rr(second);
+    return *rr != NULL;
+}
+
+static char libbind_ns_name_uncompress_doc[] =
+"Returns a string of the uncompressed hostname from an ns_msg object.\n\
+    \n\
+    Only pass this function an ns_msg object and the ns_rr record which\n\
+    has the data you want decompressed.";
+
+static PyObject *
+libbind_ns_name_uncompress(PyObject *self, PyObject *args)
+{
+    libbind_ns_msg *message;
+    libbind_ns_rr  *rr;
+
+    if( !libbind_msg_rr_args(args, &message, &rr) )
+	return NULL;
+
+    /* It would be nice to validate whether the ns_rr came from the ns_msg. */
+    return libbind_uncompress_rdata(&message->packet, &rr->record);
+}
+
+static char libbind_ns_data_offset_doc[] =
+"Returns the offset in the raw message that contains the record data";
+
+static PyObject *
+libbind_ns_data_offset(PyObject *self, PyObject *args)
+{
+    libbind_ns_msg *message;
+    libbind_ns_rr  *rr;
+
+    if( !libbind_msg_rr_args(args, &message, &rr) )
+	return NULL;
+
+    return libbind_rdata_offset(&message->packet, &rr->record);
+}
+
+/* The bulk parsing functions below walk the message in C and hand back plain
+ * Python tuples, so that the Strangle objects can be built without calling
+ * across the Python/C boundary for every field of every record.
+ *
+ * A flags tuple is indexed by the ns_f_* values (qr, opcode, aa, tc, rd, ra,
+ * z, ad, cd, rcode).  A record tuple is:
+ *
+ *     (name, type, class, ttl, rdata, dataName)
+ *
+ * where rdata is None for question records, and dataName is the uncompressed
+ * host name in the record data for NS, CNAME, SOA, PTR and MX records (None
+ * for everything else).
+ *
+ * Parsing happens in two passes.  libbind_parse_native() does all the libbind
+ * work into plain C structures and never touches a Python object, so it can
+ * run with the GIL released.  libbind_build_message() then turns the result
+ * into Python tuples.
+ */
+
+/* Responses point most of their names at a few suffixes (the zone name, the
+ * query name), so every name decompressed in a message is remembered by the
+ * offset of each of its labels.  A compression pointer to one of those offsets
+ * is then resolved by copying the text instead of walking the labels again.
+ * The cache is direct-mapped on the offset; a collision just forgets a name.
+ * It only lives for one parse call: the caller keeps it on its stack and
+ * clears it for each packet with libbind_parsed_cache().
+ */
+#define LIBBIND_NAMECACHE 64
+
+typedef struct {
+    int offset;		/* 1 + offset of the name in the packet; 0 if the entry is empty */
+    int text;		/* offset of the name's text in the names buffer */
+    int length;		/* bytes the name takes uncompressed, not counting the root label */
+} libbind_name_entry;
+
+/* A record found by the native pass.  Names are offsets into the names buffer
+ * of the libbind_parsed it belongs to; rdata is an offset into the packet.
+ */
+typedef struct {
+    int       name;
+    int       dataName;		/* -1 if there is no name in the data */
+    int       rdata;		/* -1 for question records */
+    u_int16_t rdlen;
+    u_int16_t type;
+    u_int16_t class;
+    u_int32_t ttl;
+} libbind_parsed_rr;
+
+typedef struct {
+    const u_char      *packetData;
+    int               packetLength;
+    Py_buffer         view;		/* Pins the packet data, if hasView */
+    int               hasView;
+
+    u_int16_t         id;
+    u_int16_t         flags[ns_f_max];
+    int               counts[ns_s_max];
+    int               total;
+    libbind_parsed_rr *records;		/* every section, in order */
+
+    char              *names;
+    size_t            namesLength;
+    size_t            namesSize;
+
+    libbind_name_entry *nameCache;	/* LIBBIND_NAMECACHE entries, owned by the caller */
+
+    const char        *error;		/* why the packet cannot be parsed, or NULL */
+} libbind_parsed;
+
+static const char libbind_nomem[] = "Out of memory";
+
+static void
+libbind_parsed_init(libbind_parsed *parsed, const u_char *packetData, int packetLength)
+{
+    bzero((void *)parsed, sizeof(libbind_parsed));
+    parsed->packetData   = packetData;
+    parsed->packetLength = packetLength;
+}
+
+/* Give a libbind_parsed an empty name cache, before its packet is parsed */
+static void
+libbind_parsed_cache(libbind_parsed *parsed, libbind_name_entry *nameCache)
+{
+    bzero((void *)nameCache, LIBBIND_NAMECACHE * sizeof(libbind_name_entry));
+    parsed->nameCache = nameCache;
+}
+
+static void
+libbind_parsed_free(libbind_parsed *parsed)
+{
+    if( parsed->hasView )
+	PyBuffer_Release(&parsed->view);
+    free(parsed->records);
+    free(parsed->names);
+    parsed->hasView = 0;
+    parsed->records = NULL;
+    parsed->names   = NULL;
+}
+
+/* Append a name to the names buffer, returning its offset or -1 if out of memory. */
+static int
+libbind_parsed_addname(libbind_parsed *parsed, const char *name)
+{
+    size_t length, newSize;
+    char *names;
+    int offset;
+
+    length = strlen(name) + 1;
+    if( parsed->namesLength + length > parsed->namesSize ) {
+	newSize = parsed->namesSize ? parsed->namesSize * 2 : 256;
+	while( newSize < parsed->namesLength + length )
+	    newSize *= 2;
+
+	names = realloc(parsed->names, newSize);
+	if( names == NULL ) {
+	    parsed->error = libbind_nomem;
+	    return -1;
+	}
+	parsed->names     = names;
+	parsed->namesSize = newSize;
+    }
+
+    offset = (int)parsed->namesLength;
+    memcpy(parsed->names + offset, name, length);
+    parsed->namesLength += length;
+    return offset;
+}
+
+/* Characters which ns_name_ntop() escapes with a backslash */
+static int
+libbind_special(int ch)
+{
+    switch( ch ) {
+	case '"': case '.': case ';': case '\\':
+	case '(': case ')': case '@': case '$':
+	    return 1;
+	default:
+	    return 0;
+    }
+}
+
+/* Append the presentation form of a label to text, escaped as ns_name_ntop() does.
+ * Returns the new text length.
+ */
+static int
+libbind_label_text(char *text, int textLength, const u_char *label, int n)
+{
+    int i;
+
+    for( i = 0; i < n; i++ ) {
+	if( libbind_special(label[i]) ) {
+	    text[textLength++] = '\\';
+	    text[textLength++] = label[i];
+	}
+	else if( label[i] > 0x20 && label[i] < 0x7f )
+	    text[textLength++] = label[i];
+	else {
+	    text[textLength++] = '\\';
+	    text[textLength++] = '0' + label[i] / 100;
+	    text[textLength++] = '0' + (label[i] % 100) / 10;
+	    text[textLength++] = '0' + label[i] % 10;
+	}
+    }
+
+    return textLength;
+}
+
+#define LIBBIND_MAXHOPS 64
+
+/* How ns_parserr() spells a root owner name; libbind versions differ.  This
+ * is filled in when the module is initialised.
+ */
+static char libbind_root_owner[2] = ".";
+
+static void
+libbind_init_root_owner(void)
+{
+    static const u_char packet[] = { 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0,
+				     0, 0, ns_t_a, 0, ns_c_in };
+    ns_msg handle;
+    ns_rr  rr;
+
+    if( ns_initparse(packet, sizeof(packet), &handle) == 0 &&
+	ns_parserr(&handle, ns_s_qd, 0, &rr) == 0 && strlen(ns_rr_name(rr)) < 2 )
+	strcpy(libbind_root_owner, ns_rr_name(rr));
+}
+
+/* Decompress the name at offset in the packet into the names buffer, and
+ * return its offset there, or -1 with parsed->error set.  If end is not NULL
+ * it is set to the offset just past the name.  owner selects ns_parserr()'s
+ * spelling of the root name.
+ *
+ * The text is the same as ns_name_uncompress() gives.  Anything unusual
+ * (extended label types, long pointer chains, names which are too long or
+ * run off the end) is handed to libbind, so that it decides what is an error.
+ */
+static int
+libbind_parse_name(libbind_parsed *parsed, int offset, int owner, int *end)
+{
+    const u_char *packet = parsed->packetData;
+    char text[MAXDNAME + 1];
+    int labelOffsets[NS_MAXCDNAME / 2], labelTexts[NS_MAXCDNAME / 2], labelBytes[NS_MAXCDNAME / 2];
+    int labels, textLength, bytes, position, next, hops, n, i, name, suffixLength;
+    libbind_name_entry *suffix, *entry;
+
+    labels     = 0;
+    textLength = 0;
+    bytes      = 0;
+    hops       = 0;
+    next       = -1;
+    suffix     = NULL;
+    position   = offset;
+
+    for( ;; ) {
+	if( position < 0 || position >= parsed->packetLength )
+	    goto fallback;
+
+	n = packet[position];
+	if( (n & NS_CMPRSFLGS) == NS_CMPRSFLGS ) {
+	    if( position + 1 >= parsed->packetLength || ++hops > LIBBIND_MAXHOPS )
+		goto fallback;
+	    if( next == -1 )
+		next = position + 2;
+
+	    position = ((n & ~NS_CMPRSFLGS) << 8) | packet[position + 1];
+	    entry    = &parsed->nameCache[position % LIBBIND_NAMECACHE];
+	    if( entry->offset == position + 1 ) {
+		suffix = entry;
+		break;
+	    }
+	    continue;
+	}
+
+	if( (n & NS_CMPRSFLGS) != 0 )
+	    goto fallback;
+
+	if( n == 0 ) {
+	    if( next == -1 )
+		next = position + 1;
+	    break;
+	}
+
+	if( position + 1 + n >= parsed->packetLength || bytes + n + 1 >= NS_MAXCDNAME )
+	    goto fallback;
+
+	if( textLength > 0 )
+	    text[textLength++] = '.';
+	labelOffsets[labels] = position;
+	labelTexts[labels]   = textLength;
+	labelBytes[labels]   = bytes;
+	labels++;
+
+	textLength = libbind_label_text(text, textLength, packet + position + 1, n);
+
+	bytes    += n + 1;
+	position += n + 1;
+    }
+
+    suffixLength = 0;
+    if( suffix != NULL ) {
+	suffixLength = suffix->length;
+	if( bytes + suffixLength >= NS_MAXCDNAME )
+	    goto fallback;
+
+	if( textLength > 0 )
+	    text[textLength++] = '.';
+	strcpy(text + textLength, parsed->names + suffix->text);
+    }
+    else if( textLength == 0 )
+	strcpy(text, owner ? libbind_root_owner : ".");
+    else
+	text[textLength] = '\0';
+
+    name = libbind_parsed_addname(parsed, text);
+    if( name == -1 )
+	return -1;
+
+    /* Every label of the name starts a suffix which later names may point to. */
+    for( i = 0; i < labels; i++ ) {
+	entry = &parsed->nameCache[labelOffsets[i] % LIBBIND_NAMECACHE];
+	entry->offset = labelOffsets[i] + 1;
+	entry->text   = name + labelTexts[i];
+	entry->length = bytes + suffixLength - labelBytes[i];
+    }
+
+    if( end != NULL )
+	*end = next;
+    return name;
+
+fallback:
+    n = ns_name_uncompress(packet, packet + parsed->packetLength, packet + offset, text, MAXDNAME);
+    if( owner && n != -1 && strcmp(text, ".") == 0 )
+	strcpy(text, libbind_root_owner);
+
+    if( n == -1 ) {
+	if( owner )
+	    parsed->error = libbind_err_record;
+	else
+	    parsed->error = libbind_err_name;
+	return -1;
+    }
+
+    if( end != NULL )
+	*end = offset + n;
+    return libbind_parsed_addname(parsed, text);
+}
+
+/* Decompress the name in the rdata of record, if it has one.  Returns 0, or -1
+ * with parsed->error set.
+ */
+static int
+libbind_parse_dataname(libbind_parsed *parsed, libbind_parsed_rr *record)
+{
+    int nameOffset;
+
+    record->dataName = -1;
+
+    switch( record->type ) {
+	case ns_t_ns:
+	case ns_t_cname:
+	case ns_t_soa:
+	case ns_t_ptr:
+	    nameOffset = 0;
+	    break;
+	case ns_t_mx:
+	    /* Skip the two byte preference to get to the hostname. */
+	    nameOffset = 2;
+	    break;
+	default:
+	    return 0;
+    }
+
+    if( record->rdata == -1 || record->rdlen <= nameOffset )
+	return 0;
+
+    record->dataName = libbind_parse_name(parsed, record->rdata + nameOffset, 0, NULL);
+    return (record->dataName == -1) ? -1 : 0;
+}
+
+/* Fill in a libbind_parsed_rr from an ns_rr.  Returns 0, or -1 with parsed->error set. */
+static int
+libbind_parse_rr(libbind_parsed *parsed, ns_msg *handle, ns_rr *rr, libbind_parsed_rr *record)
+{
+    const u_char *rdata;
+
+    record->type  = ns_rr_type(*rr);
+    record->class = ns_rr_class(*rr);
+    record->ttl   = ns_rr_ttl(*rr);
+    record->rdlen = ns_rr_rdlen(*rr);
+
+    record->name = libbind_parsed_addname(parsed, ns_rr_name(*rr));
+    if( record->name == -1 )
+	return -1;
+
+    rdata = ns_rr_rdata(*rr);
+    record->rdata = (rdata == (const u_char *)NULL) ? -1 : (int)(rdata - ns_msg_base(*handle));
+
+    return libbind_parse_dataname(parsed, record);
+}
+
+/* Parse the record at offset into a libbind_parsed_rr, the way ns_parserr()
+ * would, but with the owner name from the name cache.  Returns the offset of
+ * the next record, or -1 with parsed->error set.
+ */
+static int
+libbind_parse_wire_rr(libbind_parsed *parsed, int section, int offset, libbind_parsed_rr *record)
+{
+    const u_char *cp;
+
+    record->name = libbind_parse_name(parsed, offset, 1, &offset);
+    if( record->name == -1 )
+	return -1;
+
+    if( offset + NS_QFIXEDSZ > parsed->packetLength )
+	goto truncated;
+
+    cp = parsed->packetData + offset;
+    NS_GET16(record->type, cp);
+    NS_GET16(record->class, cp);
+    offset += NS_QFIXEDSZ;
+
+    if( section == ns_s_qd ) {
+	record->ttl   = 0;
+	record->rdlen = 0;
+	record->rdata = -1;
+    }
+    else {
+	if( offset + NS_INT32SZ + NS_INT16SZ > parsed->packetLength )
+	    goto truncated;
+
+	NS_GET32(record->ttl, cp);
+	NS_GET16(record->rdlen, cp);
+	offset += NS_INT32SZ + NS_INT16SZ;
+
+	if( offset + record->rdlen > parsed->packetLength )
+	    goto truncated;
+	record->rdata = offset;
+	offset += record->rdlen;
+    }
+
+    if( libbind_parse_dataname(parsed, record) == -1 )
+	return -1;
+    return offset;
+
+truncated:
+    parsed->error = libbind_err_record;
+    return -1;
+}
+
+/* Parse the records of sections first to last - 1 into parsed->records. */
+static int
+libbind_parse_sections(libbind_parsed *parsed, ns_msg *handle, int first, int last)
+{
+    int section, rrnum, total, offset;
+
+    total = 0;
+    for( section = first; section < last; section++ ) {
+	parsed->counts[section] = ns_msg_count(*handle, section);
+	total += parsed->counts[section];
+    }
+
+    if( total > 0 ) {
+	parsed->records = malloc(total * sizeof(libbind_parsed_rr));
+	if( parsed->records == NULL ) {
+	    parsed->error = libbind_nomem;
+	    return -1;
+	}
+    }
+
+    /* ns_initparse() has already found where each section starts. */
+    for( section = first; section < last; section++ ) {
+	if( parsed->counts[section] == 0 )
+	    continue;
+
+	offset = (int)(handle->_sections[section] - ns_msg_base(*handle));
+	for( rrnum = 0; rrnum < parsed->counts[section]; rrnum++ ) {
+	    offset = libbind_parse_wire_rr(parsed, section, offset, &parsed->records[parsed->total]);
+	    if( offset == -1 )
+		return -1;
+	    parsed->total++;
+	}
+    }
+
+    return 0;
+}
+
+/* The native pass over a whole message.  This must not use the Python API. */
+static int
+libbind_parse_native(libbind_parsed *parsed)
+{
+    ns_msg handle;
+    int flag;
+
+    if( ns_initparse(parsed->packetData, parsed->packetLength, &handle) != 0 ) {
+	parsed->error = libbind_err_packet;
+	return -1;
+    }
+
+    parsed->id = ns_msg_id(handle);
+    for( flag = 0; flag < ns_f_max; flag++ )
+	parsed->flags[flag] = ns_msg_getflag(handle, flag);
+
+    return libbind_parse_sections(parsed, &handle, 0, ns_s_max);
+}
+
+/* Count a native pass in the stats; the GIL must be held. */
+static void
+libbind_stats_parsed(libbind_parsed *parsed)
+{
+    int section, index, first;
+
+    if( parsed->error != NULL ) {
+	libbind_stats_failure(parsed->error);
+	return;
+    }
+
+    libbind_stats.packets++;
+    first = 0;
+    for( section = 0; section < ns_s_max; section++ ) {
+	for( index = first; index < first + parsed->counts[section]; index++ )
+	    libbind_stats_record(section, parsed->records[index].type);
+	first += parsed->counts[section];
+    }
+}
+
+/* Raise the Python exception for a failed native pass. */
+static PyObject *
+libbind_parsed_error(libbind_parsed *parsed)
+{
+    if( parsed->error == libbind_nomem )
+	return PyErr_NoMemory();
+
+    PyErr_SetString(PyExc_TypeError, parsed->error);
+    return NULL;
+}
+
+/* Where each ns_flag is in the 16 header flag bits, as ns_msg_getflag() has it */
+static const u_int16_t libbind_flag_masks[ns_f_max]  = { 0x8000, 0x7800, 0x0400, 0x0200, 0x0100,
+							 0x0080, 0x0040, 0x0020, 0x0010, 0x000f };
+static const int       libbind_flag_shifts[ns_f_max] = { 15, 11, 10, 9, 8, 7, 6, 5, 4, 0 };
+
+static PyObject *
+libbind_build_flags(u_int16_t *flagVals)
+{
+    PyObject *flags;
+    int flag;
+
+    flags = PyTuple_New(ns_f_max);
+    if( flags == NULL )
+	return NULL;
+
+    for( flag = 0; flag < ns_f_max; flag++ )
+	PyTuple_SET_ITEM(flags, flag, PyInt_FromLong((long)flagVals[flag]));
+
+    return flags;
+}
+
+static PyObject *
+libbind_build_record(libbind_parsed *parsed, libbind_parsed_rr *record)
+{
+    PyObject *rdataObj, *dataNameObj, *nameObj;
+
+    if( record->rdata == -1 ) {
+	/* Query records look like this */
+	Py_INCREF(Py_None);
+	rdataObj = Py_None;
+    }
+    else {
+	rdataObj = PyString_FromStringAndSize((const char *)parsed->packetData + record->rdata,
+					      record->rdlen);
+	if( rdataObj == NULL )
+	    return NULL;
+    }
+
+    if( record->dataName == -1 ) {
+	Py_INCREF(Py_None);
+	dataNameObj = Py_None;
+    }
+    else {
+	dataNameObj = libbind_intern(parsed->names + record->dataName);
+	if( dataNameObj == NULL ) {
+	    Py_DECREF(rdataObj);
+	    return NULL;
+	}
+    }
+
+    nameObj = libbind_intern(parsed->names + record->name);
+    if( nameObj == NULL ) {
+	Py_DECREF(rdataObj);
+	Py_DECREF(dataNameObj);
+	return NULL;
+    }
+
+    return Py_BuildValue("NiilNN", nameObj, (int)record->type,
+			 (int)record->class, (long)record->ttl, rdataObj, dataNameObj);
+}
+
+/* Build a tuple of count record tuples, starting with parsed->records[first]. */
+static PyObject *
+libbind_build_records(libbind_parsed *parsed, int first, int count)
+{
+    PyObject *records, *record;
+    int rrnum;
+
+    records = PyTuple_New(count);
+    if( records == NULL )
+	return NULL;
+
+    for( rrnum = 0; rrnum < count; rrnum++ ) {
+	record = libbind_build_record(parsed, &parsed->records[first + rrnum]);
+	if( record == NULL ) {
+	    Py_DECREF(records);
+	    return NULL;
+	}
+	PyTuple_SET_ITEM(records, rrnum, record);
+    }
+
+    return records;
+}
+
+/* Build the (id, flags, sections) tuple from a successful native pass. */
+static PyObject *
+libbind_build_message(libbind_parsed *parsed)
+{
+    PyObject *flags, *sections, *records;
+    int section, first;
+
+    flags = libbind_build_flags(parsed->flags);
+    if( flags == NULL )
+	return NULL;
+
+    sections = PyTuple_New(ns_s_max);
+    if( sections == NULL ) {
+	Py_DECREF(flags);
+	return NULL;
+    }
+
+    first = 0;
+    for( section = 0; section < ns_s_max; section++ ) {
+	records = libbind_build_records(parsed, first, parsed->counts[section]);
+	if( records == NULL ) {
+	    Py_DECREF(flags);
+	    Py_DECREF(sections);
+	    return NULL;
+	}
+	PyTuple_SET_ITEM(sections, section, records);
+	first += parsed->counts[section];
+    }
+
+    return Py_BuildValue("iNN", (int)parsed->id, flags, sections);
+}
+
+/* Point a libbind_parsed at the bytes of a packet in a way that stays valid
+ * while the GIL is released.  Any object with the buffer interface is used in
+ * place: the buffer view holds a reference to it, and for objects such as
+ * bytearray it also stops them from being resized.  (An mmap must not be
+ * closed while it is being parsed.)  Returns -1 with a Python exception set
+ * if the packet is not usable.  The caller must call libbind_parsed_free().
+ */
+static int
+libbind_pin_packet(libbind_parsed *parsed, PyObject *packet)
+{
+    Py_buffer view;
+
+    if( !PyArg_Parse(packet, "s*", &view) )
+	return -1;
+
+    libbind_parsed_init(parsed, (const u_char *)view.buf, (int)view.len);
+    parsed->view    = view;
+    parsed->hasView = 1;
+    return 0;
+}
+
+static char libbind_parse_message_doc[] =
+"Parses a whole raw DNS message in one call.\n\
+    \n\
+    Returns a tuple of (id, flags, sections).  flags is a tuple indexed by the\n\
+    ns_f_* values and sections is a tuple indexed by the ns_s_* values, each\n\
+    item being a tuple of (name, type, class, ttl, rdata, dataName) records.\n\
+    The message may be any object with the buffer interface, such as a\n\
+    bytearray or a buffer into an mmap; it is parsed in place, not copied.\n\
+    The GIL is released while libbind parses the message.";
+
+static PyObject *
+libbind_parse_message(PyObject *self, PyObject *args)
+{
+    PyObject *packet, *result;
+    libbind_parsed parsed;
+    libbind_name_entry nameCache[LIBBIND_NAMECACHE];
+    PY_LONG_LONG start;
+    int status, stats;
+
+    if( !PyArg_ParseTuple(args, "O", &packet) )
+	return NULL;
+
+    if( libbind_pin_packet(&parsed, packet) == -1 )
+	return NULL;
+    libbind_parsed_cache(&parsed, nameCache);
+
+    stats = libbind_stats_enabled;
+    start = stats ? libbind_now() : 0;
+
+    Py_BEGIN_ALLOW_THREADS
+    status = libbind_parse_native(&parsed);
+    Py_END_ALLOW_THREADS
+
+    if( stats ) {
+	libbind_stats.nanoseconds[LIBBIND_STAGE_NATIVE] += libbind_now() - start;
+	libbind_stats_parsed(&parsed);
+	start = libbind_now();
+    }
+
+    if( status == -1 )
+	result = libbind_parsed_error(&parsed);
+    else
+	result = libbind_build_message(&parsed);
+
+    if( stats )
+	libbind_stats.nanoseconds[LIBBIND_STAGE_OBJECTS] += libbind_now() - start;
+
+    libbind_parsed_free(&parsed);
+    return result;
+}
+
+static char libbind_parse_many_doc[] =
+"Parses every raw DNS message from an iterable in one call.\n\
+    \n\
+    Returns a tuple of (results, errors).  results has one item per packet:\n\
+    the tuple parse_message() would return, or None if the packet could not\n\
+    be parsed.  errors is a list of (index, reason) for those packets.  The GIL\n\
+    is released while libbind parses the whole batch.";
+
+/* Pin and parse every packet of a sequence, with the GIL released for the
+ * native passes.  Returns an array of total libbind_parsed, which the caller
+ * must free with libbind_parsed_free_all(), or NULL with an exception set.
+ * Packets which cannot be parsed have their error set; running out of memory
+ * raises MemoryError instead.
+ */
+static libbind_parsed *
+libbind_parse_all(PyObject *sequence, Py_ssize_t total)
+{
+    libbind_parsed *parsed;
+    libbind_name_entry nameCache[LIBBIND_NAMECACHE];
+    Py_ssize_t index;
+    PY_LONG_LONG start;
+    int stats;
+
+    parsed = calloc(total ? total : 1, sizeof(libbind_parsed));
+    if( parsed == NULL ) {
+	PyErr_NoMemory();
+	return NULL;
+    }
+
+    /* Pin every packet first; the ones which are not even buffers fail right away. */
+    for( index = 0; index < total; index++ ) {
+	if( libbind_pin_packet(&parsed[index], PySequence_Fast_GET_ITEM(sequence, index)) == 0 )
+	    continue;
+
+	if( !PyErr_ExceptionMatches(PyExc_TypeError) )
+	    goto fail;
+
+	PyErr_Clear();
+	parsed[index].error = "Packet must be a string or a buffer";
+    }
+
+    stats = libbind_stats_enabled;
+    start = stats ? libbind_now() : 0;
+
+    /* One name cache serves the whole batch, cleared for each packet. */
+    Py_BEGIN_ALLOW_THREADS
+    for( index = 0; index < total; index++ ) {
+	if( parsed[index].error != NULL )
+	    continue;
+
+	libbind_parsed_cache(&parsed[index], nameCache);
+	libbind_parse_native(&parsed[index]);
+	parsed[index].nameCache = NULL;
+    }
+    Py_END_ALLOW_THREADS
+
+    if( stats ) {
+	libbind_stats.nanoseconds[LIBBIND_STAGE_NATIVE] += libbind_now() - start;
+	for( index = 0; index < total; index++ )
+	    libbind_stats_parsed(&parsed[index]);
+    }
+
+    for( index = 0; index < total; index++ ) {
+	if( parsed[index].error == libbind_nomem ) {
+	    PyErr_NoMemory();
+	    goto fail;
+	}
+    }
+
+    return parsed;
+
+fail:
+    for( index = 0; index < total; index++ )
+	libbind_parsed_free(&parsed[index]);
+    free(parsed);
+    return NULL;
+}
+
+static void
+libbind_parsed_free_all(libbind_parsed *parsed, Py_ssize_t total)
+{
+    Py_ssize_t index;
+
+    for( index = 0; index < total; index++ )
+	libbind_parsed_free(&parsed[index]);
+    free(parsed);
+}
+
+/* Append (index, reason) to an errors list.  Returns -1 on failure. */
+static int
+libbind_add_error(PyObject *errors, Py_ssize_t index, const char *reason)
+{
+    PyObject *error;
+    int result;
+
+    /* The reason is kept as a plain string so the errors stay small and picklable. */
+    error = Py_BuildValue("(ns)", index, reason);
+    if( error == NULL )
+	return -1;
+
+    result = PyList_Append(errors, error);
+    Py_DECREF(error);
+    return result;
+}
+
+static PyObject *
+libbind_parse_many(PyObject *self, PyObject *args)
+{
+    PyObject *packets, *sequence, *results, *errors, *result;
+    libbind_parsed *parsed;
+    Py_ssize_t total, index;
+    PY_LONG_LONG start;
+
+    if( !PyArg_ParseTuple(args, "O", &packets) )
+	return NULL;
+
+    sequence = PySequence_Fast(packets, "parse_many() needs an iterable of packets");
+    if( sequence == NULL )
+	return NULL;
+
+    total   = PySequence_Fast_GET_SIZE(sequence);
+    parsed  = NULL;
+    results = PyList_New(total);
+    errors  = PyList_New(0);
+    if( results == NULL || errors == NULL )
+	goto fail;
+
+    parsed = libbind_parse_all(sequence, total);
+    if( parsed == NULL )
+	goto fail;
+
+    start = libbind_stats_enabled ? libbind_now() : 0;
+    for( index = 0; index < total; index++ ) {
+	if( parsed[index].error != NULL ) {
+	    if( libbind_add_error(errors, index, parsed[index].error) == -1 )
+		goto fail;
+
+	    Py_INCREF(Py_None);
+	    result = Py_None;
+	}
+	else {
+	    result = libbind_build_message(&parsed[index]);
+	    if( result == NULL )
+		goto fail;
+	}
+
+	PyList_SET_ITEM(results, index, result);
+	libbind_parsed_free(&parsed[index]);
+    }
+
+    if( libbind_stats_enabled )
+	libbind_stats.nanoseconds[LIBBIND_STAGE_OBJECTS] += libbind_now() - start;
+
+    libbind_parsed_free_all(parsed, total);
+    Py_DECREF(sequence);
+    return Py_BuildValue("NN", results, errors);
+
+fail:
+    if( parsed != NULL )
+	libbind_parsed_free_all(parsed, total);
+    Py_DECREF(sequence);
+    Py_XDECREF(results);
+    Py_XDECREF(errors);
+    return NULL;
+}
+
+static char libbind_parse_columns_doc[] =
+"Parses raw DNS messages into columns of record fields.\n\
+    \n\
+    parse_columns(packets, names, codes, base=0) returns (ids, columns, errors).\n\
+    ids is a string of native unsigned shorts, the ID of each packet (0 for\n\
+    the bad ones).  columns is a tuple of strings of native C values with one\n\
+    item per record of every good packet, in order:\n\
+	message (int, base + packet index), section (unsigned char),\n\
+	type (unsigned short), class (unsigned short), ttl (unsigned int),\n\
+	rdataOffset (int, -1 for questions), rdataLength (unsigned short),\n\
+	name (int), dataName (int, -1 if none).\n\
+    These are the array module typecodes 'i', 'B', 'H', 'H', 'I', 'i', 'H',\n\
+    'i' and 'i'.  Names are dictionary encoded: a name's code is its index in\n\
+    the list names, and codes is a dict from name to code.  New names are\n\
+    added to both.  errors is a list of (index, reason) as for parse_many().";
+
+/* Return the dictionary code of a name, adding it to names and codes if new. */
+static int
+libbind_name_code(PyObject *names, PyObject *codes, const char *name)
+{
+    PyObject *nameObj, *codeObj;
+    long code;
+
+    nameObj = PyString_FromString(name);
+    if( nameObj == NULL )
+	return -1;
+
+    codeObj = PyDict_GetItem(codes, nameObj);
+    if( codeObj != NULL ) {
+	Py_DECREF(nameObj);
+	return (int)PyInt_AsLong(codeObj);
+    }
+
+    code    = (long)PyList_GET_SIZE(names);
+    codeObj = PyInt_FromLong(code);
+    if( codeObj == NULL || PyDict_SetItem(codes, nameObj, codeObj) == -1 ||
+	PyList_Append(names, nameObj) == -1 ) {
+	Py_XDECREF(codeObj);
+	Py_DECREF(nameObj);
+	return -1;
+    }
+
+    Py_DECREF(codeObj);
+    Py_DECREF(nameObj);
+    return (int)code;
+}
+
+#define LIBBIND_COLUMNS 9
+
+static PyObject *
+libbind_parse_columns(PyObject *self, PyObject *args)
+{
+    PyObject *packets, *names, *codes, *sequence, *ids, *columns, *errors;
+    libbind_parsed *parsed;
+    libbind_parsed_rr *record;
+    Py_ssize_t total, index, records, row;
+    int base, rrnum, section, sectionEnd, column, lastName, lastCode, code;
+    const char *name;
+    PY_LONG_LONG start;
+    static const size_t sizes[LIBBIND_COLUMNS] = {
+	sizeof(int), sizeof(unsigned char), sizeof(unsigned short), sizeof(unsigned short),
+	sizeof(unsigned int), sizeof(int), sizeof(unsigned short), sizeof(int), sizeof(int)
+    };
+    char *data[LIBBIND_COLUMNS];
+
+    base = 0;
+    if( !PyArg_ParseTuple(args, "OO!O!|i", &packets, &PyList_Type, &names,
+			  &PyDict_Type, &codes, &base) )
+	return NULL;
+
+    sequence = PySequence_Fast(packets, "parse_columns() needs an iterable of packets");
+    if( sequence == NULL )
+	return NULL;
+
+    total   = PySequence_Fast_GET_SIZE(sequence);
+    columns = NULL;
+    errors  = NULL;
+    ids     = PyString_FromStringAndSize(NULL, total * sizeof(unsigned short));
+    if( ids == NULL )
+	goto fail;
+
+    parsed = libbind_parse_all(sequence, total);
+    if( parsed == NULL )
+	goto fail;
+
+    errors = PyList_New(0);
+    if( errors == NULL )
+	goto failParsed;
+
+    start   = libbind_stats_enabled ? libbind_now() : 0;
+    records = 0;
+    for( index = 0; index < total; index++ ) {
+	((unsigned short *)PyString_AS_STRING(ids))[index] = parsed[index].id;
+	if( parsed[index].error == NULL )
+	    records += parsed[index].total;
+	else if( libbind_add_error(errors, index, parsed[index].error) == -1 )
+	    goto failParsed;
+    }
+
+    columns = PyTuple_New(LIBBIND_COLUMNS);
+    if( columns == NULL )
+	goto failParsed;
+    for( column = 0; column < LIBBIND_COLUMNS; column++ ) {
+	PyObject *columnObj = PyString_FromStringAndSize(NULL, records * sizes[column]);
+	if( columnObj == NULL )
+	    goto failParsed;
+	PyTuple_SET_ITEM(columns, column, columnObj);
+	data[column] = PyString_AS_STRING(columnObj);
+    }
+
+    row = 0;
+    for( index = 0; index < total; index++ ) {
+	if( parsed[index].error != NULL )
+	    continue;
+
+	/* Records of one message often share an owner name, so remember the last. */
+	lastName = -1;
+	lastCode = -1;
+	section  = 0;
+	sectionEnd = parsed[index].counts[0];
+	for( rrnum = 0; rrnum < parsed[index].total; rrnum++, row++ ) {
+	    while( rrnum >= sectionEnd )
+		sectionEnd += parsed[index].counts[++section];
+
+	    record = &parsed[index].records[rrnum];
+	    name   = parsed[index].names + record->name;
+	    if( lastName == -1 || strcmp(name, parsed[index].names + lastName) != 0 ) {
+		lastCode = libbind_name_code(names, codes, name);
+		if( lastCode == -1 )
+		    goto failParsed;
+		lastName = record->name;
+	    }
+
+	    code = -1;
+	    if( record->dataName != -1 ) {
+		code = libbind_name_code(names, codes, parsed[index].names + record->dataName);
+		if( code == -1 )
+		    goto failParsed;
+	    }
+
+	    ((int *)data[0])[row]            = base + (int)index;
+	    ((unsigned char *)data[1])[row]  = (unsigned char)section;
+	    ((unsigned short *)data[2])[row] = record->type;
+	    ((unsigned short *)data[3])[row] = record->class;
+	    ((unsigned int *)data[4])[row]   = record->ttl;
+	    ((int *)data[5])[row]            = record->rdata;
+	    ((unsigned short *)data[6])[row] = record->rdlen;
+	    ((int *)data[7])[row]            = lastCode;
+	    ((int *)data[8])[row]            = code;
+	}
+    }
+
+    if( libbind_stats_enabled )
+	libbind_stats.nanoseconds[LIBBIND_STAGE_OBJECTS] += libbind_now() - start;
+
+    libbind_parsed_free_all(parsed, total);
+    Py_DECREF(sequence);
+    return Py_BuildValue("NNN", ids, columns, errors);
+
+failParsed:
+    libbind_parsed_free_all(parsed, total);
+fail:
+    Py_DECREF(sequence);
+    Py_XDECREF(ids);
+    Py_XDECREF(columns);
+    Py_XDECREF(errors);
+    return NULL;
+}
+
+static char libbind_parse_headers_doc[] =
+"Decodes just the 12-byte headers of many DNS messages in one buffer.\n\
+    \n\
+    parse_headers(data, offsets, lengths=None) returns (columns, errors).\n\
+    offsets (and lengths, if given) are buffers of native ints, such as\n\
+    array.array('i'), giving where each message starts in data (and how long\n\
+    it is).  columns is a tuple of strings of native values with one item per\n\
+    message: the id (unsigned short), then the flags indexed by the ns_f_*\n\
+    values (unsigned char each), then the count of each ns_s_* section\n\
+    (unsigned short each).  Messages too short for a header are zero in every\n\
+    column and listed in errors as (index, reason).  No records are parsed.";
+
+#define LIBBIND_HEADER_COLUMNS (1 + ns_f_max + ns_s_max)
+
+static PyObject *
+libbind_parse_headers(PyObject *self, PyObject *args)
+{
+    Py_buffer data, offsetsView, lengthsView;
+    PyObject *lengths, *columns, *errors, *column;
+    const int *offsets, *lengthVals;
+    const u_char *header;
+    Py_ssize_t total, index;
+    char *values[LIBBIND_HEADER_COLUMNS];
+    int i, flag, section, *bad, badCount;
+    u_int16_t flagBits;
+
+    lengths = Py_None;
+    if( !PyArg_ParseTuple(args, "s*s*|O", &data, &offsetsView, &lengths) )
+	return NULL;
+
+    columns = NULL;
+    errors  = NULL;
+    bad     = NULL;
+    lengthsView.buf = NULL;
+    if( lengths != Py_None && !PyArg_Parse(lengths, "s*", &lengthsView) )
+	goto fail;
+
+    total = offsetsView.len / sizeof(int);
+    if( lengthsView.buf != NULL && lengthsView.len / (Py_ssize_t)sizeof(int) != total ) {
+	PyErr_SetString(PyExc_ValueError, "offsets and lengths must be the same size");
+	goto fail;
+    }
+
+    columns = PyTuple_New(LIBBIND_HEADER_COLUMNS);
+    bad     = malloc((total ? total : 1) * sizeof(int));
+    if( columns == NULL || bad == NULL ) {
+	if( bad == NULL )
+	    PyErr_NoMemory();
+	goto fail;
+    }
+
+    for( i = 0; i < LIBBIND_HEADER_COLUMNS; i++ ) {
+	if( i == 0 || i > ns_f_max )
+	    column = PyString_FromStringAndSize(NULL, total * sizeof(unsigned short));
+	else
+	    column = PyString_FromStringAndSize(NULL, total * sizeof(unsigned char));
+	if( column == NULL )
+	    goto fail;
+	PyTuple_SET_ITEM(columns, i, column);
+	values[i] = PyString_AS_STRING(column);
+    }
+
+    offsets    = (const int *)offsetsView.buf;
+    lengthVals = (const int *)lengthsView.buf;
+    badCount   = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+    for( index = 0; index < total; index++ ) {
+	if( offsets[index] < 0 || offsets[index] > data.len - NS_HFIXEDSZ ||
+	    (lengthVals != NULL && lengthVals[index] < NS_HFIXEDSZ) ) {
+	    bad[badCount++] = (int)index;
+	    for( i = 0; i < LIBBIND_HEADER_COLUMNS; i++ ) {
+		if( i == 0 || i > ns_f_max )
+		    ((unsigned short *)values[i])[index] = 0;
+		else
+		    ((unsigned char *)values[i])[index] = 0;
+	    }
+	    continue;
+	}
+
+	header   = (const u_char *)data.buf + offsets[index];
+	flagBits = (header[2] << 8) | header[3];
+
+	((unsigned short *)values[0])[index] = (header[0] << 8) | header[1];
+	for( flag = 0; flag < ns_f_max; flag++ )
+	    ((unsigned char *)values[1 + flag])[index] = (flagBits & libbind_flag_masks[flag]) >> libbind_flag_shifts[flag];
+	for( section = 0; section < ns_s_max; section++ )
+	    ((unsigned short *)values[1 + ns_f_max + section])[index] =
+		(header[4 + 2*section] << 8) | header[5 + 2*section];
+    }
+    Py_END_ALLOW_THREADS
+
+    errors = PyList_New(0);
+    if( errors == NULL )
+	goto fail;
+    for( i = 0; i < badCount; i++ ) {
+	if( libbind_add_error(errors, bad[i], "Packet is too short for a DNS header") == -1 )
+	    goto fail;
+    }
+
+    free(bad);
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&offsetsView);
+    if( lengthsView.buf != NULL )
+	PyBuffer_Release(&lengthsView);
+    return Py_BuildValue("NN", columns, errors);
+
+fail:
+    free(bad);
+    PyBuffer_Release(&data);
+    PyBuffer_Release(&offsetsView);
+    if( lengthsView.buf != NULL )
+	PyBuffer_Release(&lengthsView);
+    Py_XDECREF(columns);
+    Py_XDECREF(errors);
+    return NULL;
+}
+
+/*
+ * Typed rdata decoding.  decode_rdata() works on the rdata string alone;
+ * compression pointers in names are absolute, so they are followed into the
+ * whole packet if it is given.
+ */
+
+/* Types which this libbind may not know by name */
+#define LIBBIND_T_DS      43
+#define LIBBIND_T_RRSIG   46
+#define LIBBIND_T_DNSKEY  48
+#define LIBBIND_T_CDS     59
+#define LIBBIND_T_CDNSKEY 60
+
+typedef struct {
+    const u_char *rdata;
+    int          length;
+    int          position;
+    const u_char *packet;		/* for compression pointers, or NULL */
+    int          packetLength;
+} libbind_rdata_reader;
+
+static PyObject *
+libbind_rdata_malformed(void)
+{
+    PyErr_SetString(PyExc_ValueError, "Malformed rdata");
+    return NULL;
+}
+
+static int
+libbind_rdata_u8(libbind_rdata_reader *reader, unsigned long *value)
+{
+    if( reader->position + 1 > reader->length )
+	return -1;
+    *value = reader->rdata[reader->position];
+    reader->position += 1;
+    return 0;
+}
+
+static int
+libbind_rdata_u16(libbind_rdata_reader *reader, unsigned long *value)
+{
+    const u_char *cp;
+    u_int16_t v;
+
+    if( reader->position + NS_INT16SZ > reader->length )
+	return -1;
+    cp = reader->rdata + reader->position;
+    NS_GET16(v, cp);
+    *value = v;
+    reader->position += NS_INT16SZ;
+    return 0;
+}
+
+static int
+libbind_rdata_u32(libbind_rdata_reader *reader, unsigned long *value)
+{
+    const u_char *cp;
+    u_int32_t v;
+
+    if( reader->position + NS_INT32SZ > reader->length )
+	return -1;
+    cp = reader->rdata + reader->position;
+    NS_GET32(v, cp);
+    *value = v;
+    reader->position += NS_INT32SZ;
+    return 0;
+}
+
+/* Decode a domain name which starts in the rdata into text, which must have
+ * room for MAXDNAME + 1 bytes, and set its length.  Returns -1 if the name is
+ * malformed.  No Python objects are touched.
+ */
+static int
+libbind_rdata_name_text(libbind_rdata_reader *reader, char *text, int *length)
+{
+    const u_char *source;
+    int sourceLength, position, next, textLength, bytes, hops, n;
+
+    source       = reader->rdata;
+    sourceLength = reader->length;
+    position     = reader->position;
+    next         = -1;
+    textLength   = 0;
+    bytes        = 0;
+    hops         = 0;
+
+    for( ;; ) {
+	if( position < 0 || position >= sourceLength )
+	    return -1;
+
+	n = source[position];
+	if( (n & NS_CMPRSFLGS) == NS_CMPRSFLGS ) {
+	    if( position + 1 >= sourceLength || reader->packet == NULL || ++hops > LIBBIND_MAXHOPS )
+		return -1;
+	    if( next == -1 )
+		next = position + 2;
+
+	    position     = ((n & ~NS_CMPRSFLGS) << 8) | source[position + 1];
+	    source       = reader->packet;
+	    sourceLength = reader->packetLength;
+	    continue;
+	}
+
+	if( (n & NS_CMPRSFLGS) != 0 )
+	    return -1;
+
+	if( n == 0 ) {
+	    if( next == -1 )
+		next = position + 1;
+	    break;
+	}
+
+	if( position + n >= sourceLength || bytes + n + 1 >= NS_MAXCDNAME )
+	    return -1;
+
+	if( textLength > 0 )
+	    text[textLength++] = '.';
+	textLength = libbind_label_text(text, textLength, source + position + 1, n);
+
+	bytes    += n + 1;
+	position += n + 1;
+    }
+
+    if( textLength == 0 )
+	text[textLength++] = '.';
+
+    reader->position = next;
+    *length          = textLength;
+    return 0;
+}
+
+/* Decode a domain name which starts in the rdata.  Returns NULL (without an
+ * exception set) if it is malformed.
+ */
+static PyObject *
+libbind_rdata_name(libbind_rdata_reader *reader)
+{
+    char text[MAXDNAME + 1];
+    int length;
+
+    if( libbind_rdata_name_text(reader, text, &length) == -1 )
+	return NULL;
+
+    return libbind_intern_length(text, length);
+}
+
+/* A <character-string>: a length byte and that many bytes */
+static PyObject *
+libbind_rdata_string(libbind_rdata_reader *reader)
+{
+    int length;
+
+    if( reader->position >= reader->length )
+	return NULL;
+
+    length = reader->rdata[reader->position];
+    if( reader->position + 1 + length > reader->length )
+	return NULL;
+
+    reader->position += 1 + length;
+    return PyString_FromStringAndSize((const char *)reader->rdata + reader->position - length, length);
+}
+
+/* Everything left in the rdata */
+static PyObject *
+libbind_rdata_rest(libbind_rdata_reader *reader)
+{
+    int start = reader->position;
+
+    reader->position = reader->length;
+    return PyString_FromStringAndSize((const char *)reader->rdata + start, reader->length - start);
+}
+
+static PyObject *
+libbind_rdata_address(libbind_rdata_reader *reader, int family, int size)
+{
+    char text[INET6_ADDRSTRLEN];
+
+    if( reader->length != size )
+	return NULL;
+
+    reader->position = size;
+    if( inet_ntop(family, reader->rdata, text, sizeof(text)) == NULL )
+	return NULL;
+    return PyString_FromString(text);
+}
+
+/* Build a tuple from a format of fields read in order:
+ *	B, H, I - unsigned 8, 16 and 32 bit integers
+ *	n       - a domain name
+ *	s       - a character string
+ *	r       - the rest of the rdata
+ * Returns NULL, without an exception set, if the rdata does not fit.
+ */
+static PyObject *
+libbind_rdata_fields(libbind_rdata_reader *reader, const char *format)
+{
+    PyObject *fields, *field;
+    unsigned long value;
+    int index, status;
+
+    fields = PyTuple_New(strlen(format));
+    if( fields == NULL )
+	return NULL;
+
+    for( index = 0; format[index] != '\0'; index++ ) {
+	field = NULL;
+	switch( format[index] ) {
+	    case 'B':
+	    case 'H':
+	    case 'I':
+		if( format[index] == 'B' )
+		    status = libbind_rdata_u8(reader, &value);
+		else if( format[index] == 'H' )
+		    status = libbind_rdata_u16(reader, &value);
+		else
+		    status = libbind_rdata_u32(reader, &value);
+		if( status == 0 )
+		    field = PyInt_FromLong((long)value);
+		break;
+	    case 'n':
+		field = libbind_rdata_name(reader);
+		break;
+	    case 's':
+		field = libbind_rdata_string(reader);
+		break;
+	    case 'r':
+		field = libbind_rdata_rest(reader);
+		break;
+	}
+
+	if( field == NULL ) {
+	    Py_DECREF(fields);
+	    return NULL;
+	}
+	PyTuple_SET_ITEM(fields, index, field);
+    }
+
+    return fields;
+}
+
+/* An OPT option: a code, and a length-prefixed value */
+static PyObject *
+libbind_rdata_option(libbind_rdata_reader *reader)
+{
+    unsigned long code, length;
+    PyObject *value;
+
+    if( libbind_rdata_u16(reader, &code) == -1 || libbind_rdata_u16(reader, &length) == -1 ||
+	reader->position + (int)length > reader->length )
+	return NULL;
+
+    value = PyString_FromStringAndSize((const char *)reader->rdata + reader->position, length);
+    reader->position += length;
+    if( value == NULL )
+	return NULL;
+
+    return Py_BuildValue("lN", (long)code, value);
+}
+
+/* A sequence of items up to the end of the rdata: character strings for TXT,
+ * (code, data) options for OPT.
+ */
+static PyObject *
+libbind_rdata_sequence(libbind_rdata_reader *reader, PyObject *(*decode)(libbind_rdata_reader *))
+{
+    PyObject *items, *item, *result;
+
+    items = PyList_New(0);
+    if( items == NULL )
+	return NULL;
+
+    while( reader->position < reader->length ) {
+	item = decode(reader);
+	if( item == NULL || PyList_Append(items, item) == -1 ) {
+	    Py_XDECREF(item);
+	    Py_DECREF(items);
+	    return NULL;
+	}
+	Py_DECREF(item);
+    }
+
+    result = PyList_AsTuple(items);
+    Py_DECREF(items);
+    return result;
+}
+
+/* Decode rdata by type.  Returns a new reference, Py_None for types which are
+ * not decoded, or NULL with an exception set.
+ */
+static PyObject *
+libbind_decode_rdata(int type, libbind_rdata_reader *reader)
+{
+    PyObject *value;
+
+    switch( type ) {
+	case ns_t_a:
+	    value = libbind_rdata_address(reader, AF_INET, NS_INADDRSZ);
+	    break;
+	case ns_t_aaaa:
+	    value = libbind_rdata_address(reader, AF_INET6, NS_IN6ADDRSZ);
+	    break;
+	case ns_t_ns:
+	case ns_t_cname:
+	case ns_t_ptr:
+	case ns_t_dname:
+	    value = libbind_rdata_name(reader);
+	    break;
+	case ns_t_mx:
+	    value = libbind_rdata_fields(reader, "Hn");
+	    break;
+	case ns_t_soa:
+	    value = libbind_rdata_fields(reader, "nnIIIII");
+	    break;
+	case ns_t_txt:
+	    value = libbind_rdata_sequence(reader, libbind_rdata_string);
+	    break;
+	case ns_t_srv:
+	    value = libbind_rdata_fields(reader, "HHHn");
+	    break;
+	case ns_t_naptr:
+	    value = libbind_rdata_fields(reader, "HHsssn");
+	    break;
+	case LIBBIND_T_DS:
+	case LIBBIND_T_CDS:
+	case LIBBIND_T_DNSKEY:
+	case LIBBIND_T_CDNSKEY:
+	    value = libbind_rdata_fields(reader, "HBBr");
+	    break;
+	case LIBBIND_T_RRSIG:
+	    value = libbind_rdata_fields(reader, "HBBIIIHnr");
+	    break;
+	case ns_t_opt:
+	    value = libbind_rdata_sequence(reader, libbind_rdata_option);
+	    break;
+	default:
+	    Py_INCREF(Py_None);
+	    return Py_None;
+    }
+
+    if( value == NULL ) {
+	if( PyErr_Occurred() )
+	    return NULL;
+	return libbind_rdata_malformed();
+    }
+
+    if( reader->position != reader->length ) {
+	Py_DECREF(value);
+	return libbind_rdata_malformed();
+    }
+
+    return value;
+}
+
+static char libbind_decode_rdata_doc[] =
+"Decodes the rdata of a record into Python values.\n\
+    \n\
+    decode_rdata(type, rdata, packet=None) returns, by type:\n\
+	A, AAAA              - the address as a string\n\
+	NS, CNAME, PTR, DNAME - the name\n\
+	MX                   - (preference, exchange)\n\
+	SOA                  - (mname, rname, serial, refresh, retry, expire, minimum)\n\
+	TXT                  - a tuple of strings\n\
+	SRV                  - (priority, weight, port, target)\n\
+	NAPTR                - (order, preference, flags, services, regexp, replacement)\n\
+	DS, CDS              - (keyTag, algorithm, digestType, digest)\n\
+	DNSKEY, CDNSKEY      - (flags, protocol, algorithm, publicKey)\n\
+	RRSIG                - (typeCovered, algorithm, labels, originalTTL,\n\
+				expiration, inception, keyTag, signer, signature)\n\
+	OPT                  - a tuple of (code, data) options\n\
+    and None for other types.  Compressed names can only be followed if the\n\
+    whole packet is given.  Raises ValueError if the rdata is malformed.";
+
+static PyObject *
+libbind_decode_rdata_py(PyObject *self, PyObject *args)
+{
+    libbind_rdata_reader reader;
+    PyObject *packet, *result;
+    Py_buffer view;
+    int type, length;
+
+    packet = Py_None;
+    if( !PyArg_ParseTuple(args, "is#|O", &type, (const char **)&reader.rdata, &length, &packet) )
+	return NULL;
+
+    reader.length       = length;
+    reader.position     = 0;
+    reader.packet       = NULL;
+    reader.packetLength = 0;
+
+    if( packet != Py_None ) {
+	if( !PyArg_Parse(packet, "s*", &view) )
+	    return NULL;
+	reader.packet       = (const u_char *)view.buf;
+	reader.packetLength = (int)view.len;
+    }
+
+    result = libbind_decode_rdata(type, &reader);
+
+    if( packet != Py_None )
+	PyBuffer_Release(&view);
+    return result;
+}
+
+/*
+ * EDNS0 (RFC 6891).  The OPT pseudo-record carries the UDP payload size in
+ * its class, the extended rcode, version and flags in its TTL, and options
+ * in its rdata.
+ */
+
+#define LIBBIND_OPT_ECS     8		/* client subnet, RFC 7871 */
+#define LIBBIND_OPT_COOKIE  10		/* RFC 7873 */
+#define LIBBIND_OPT_PADDING 12		/* RFC 7830 */
+
+#define LIBBIND_EDNS_DO     0x8000
+
+/* The value of a client subnet option: (family, sourcePrefix, scopePrefix, address).
+ * Returns NULL, without an exception set, if it is malformed.
+ */
+static PyObject *
+libbind_edns_ecs(const u_char *data, int length)
+{
+    u_char address[NS_IN6ADDRSZ];
+    char text[INET6_ADDRSTRLEN];
+    int family, source, scope, size, bytes;
+
+    if( length < 4 )
+	return NULL;
+
+    family = (data[0] << 8) | data[1];
+    source = data[2];
+    scope  = data[3];
+    bytes  = length - 4;
+
+    if( family == 1 )
+	size = NS_INADDRSZ;
+    else if( family == 2 )
+	size = NS_IN6ADDRSZ;
+    else
+	return Py_BuildValue("iiis#", family, source, scope, data + 4, bytes);
+
+    /* Only the bytes of the prefix are sent */
+    if( source > size * 8 || bytes != (source + 7) / 8 )
+	return NULL;
+
+    memset(address, 0, sizeof(address));
+    memcpy(address, data + 4, bytes);
+    if( inet_ntop(family == 1 ? AF_INET : AF_INET6, address, text, sizeof(text)) == NULL )
+	return NULL;
+
+    return Py_BuildValue("iiis", family, source, scope, text);
+}
+
+/* An option with its value decoded if it is one of the common ones; malformed
+ * values are left as strings.
+ */
+static PyObject *
+libbind_edns_option(libbind_rdata_reader *reader)
+{
+    unsigned long code, length;
+    const u_char *data;
+    PyObject *value;
+
+    if( libbind_rdata_u16(reader, &code) == -1 || libbind_rdata_u16(reader, &length) == -1 ||
+	reader->position + (int)length > reader->length )
+	return NULL;
+
+    data = reader->rdata + reader->position;
+    reader->position += length;
+
+    value = NULL;
+    switch( code ) {
+	case LIBBIND_OPT_ECS:
+	    value = libbind_edns_ecs(data, length);
+	    break;
+	case LIBBIND_OPT_COOKIE:
+	    /* An 8 byte client cookie, and an 8 to 32 byte server cookie if there is one */
+	    if( length == 8 || (length >= 16 && length <= 40) )
+		value = Py_BuildValue("s#s#", data, 8, data + 8, (int)length - 8);
+	    break;
+	case LIBBIND_OPT_PADDING:
+	    value = PyInt_FromLong((long)length);
+	    break;
+    }
+
+    if( value == NULL ) {
+	if( PyErr_Occurred() )
+	    return NULL;
+	value = PyString_FromStringAndSize((const char *)data, length);
+	if( value == NULL )
+	    return NULL;
+    }
+
+    return Py_BuildValue("lN", (long)code, value);
+}
+
+static char libbind_decode_edns_doc[] =
+"Decodes the EDNS0 fields of an OPT record.\n\
+    \n\
+    decode_edns(queryClass, ttl, rdata) takes the class, TTL and rdata of the\n\
+    OPT record, as in a parse_record() tuple, and returns (payloadSize,\n\
+    extendedRcode, version, dnssecOK, flags, options).  extendedRcode is the\n\
+    upper 8 bits of the rcode, and flags the 16 flag bits including DO.\n\
+    options is a tuple of (code, value), where value is:\n\
+	ECS (8)      - (family, sourcePrefix, scopePrefix, address)\n\
+	COOKIE (10)  - (clientCookie, serverCookie), serverCookie may be ''\n\
+	PADDING (12) - the length of the padding\n\
+    and the raw option data for other options, or malformed ones.  Raises\n\
+    ValueError if the options do not fit the rdata.";
+
+static PyObject *
+libbind_decode_edns(PyObject *self, PyObject *args)
+{
+    libbind_rdata_reader reader;
+    unsigned long ttl;
+    PyObject *options;
+    int queryClass, length;
+
+    if( !PyArg_ParseTuple(args, "ikz#", &queryClass, &ttl, (const char **)&reader.rdata, &length) )
+	return NULL;
+
+    reader.length       = length;
+    reader.position     = 0;
+    reader.packet       = NULL;
+    reader.packetLength = 0;
+
+    if( reader.rdata == NULL )
+	options = PyTuple_New(0);
+    else
+	options = libbind_rdata_sequence(&reader, libbind_edns_option);
+
+    if( options == NULL ) {
+	if( PyErr_Occurred() )
+	    return NULL;
+	return libbind_rdata_malformed();
+    }
+
+    return Py_BuildValue("iiiiiN", queryClass, (int)((ttl >> 24) & 0xff), (int)((ttl >> 16) & 0xff),
+			 (ttl & LIBBIND_EDNS_DO) != 0, (int)(ttl & 0xffff), options);
+}
+
+/*
+ * Encoding.  build_message() writes a message in wire format, compressing
+ * names with the libbind ns_name_compress() pointer table.  RFC 3597 only
+ * allows compression in the names of the original record types, so the
+ * names in SRV, NAPTR, DNAME and RRSIG data are written in full.
+ */
+
+#define LIBBIND_MAXPTRS 128
+
+typedef struct {
+    u_char       *buffer;
+    int          length;
+    int          position;
+    const u_char *dnptrs[LIBBIND_MAXPTRS];	/* names which later ones can point to */
+} libbind_writer;
+
+static int
+libbind_write_overflow(void)
+{
+    PyErr_SetString(PyExc_ValueError, "The message does not fit in the buffer");
+    return -1;
+}
+
+/* Write an integer of size bytes, checking that it fits */
+static int
+libbind_write_int(libbind_writer *writer, PyObject *object, int size)
+{
+    unsigned long value, limit;
+    u_char *cp;
+
+    if( PyInt_Check(object) && PyInt_AS_LONG(object) < 0 ) {
+	PyErr_SetString(PyExc_ValueError, "Integer fields cannot be negative");
+	return -1;
+    }
+    value = PyInt_AsUnsignedLongMask(object);
+    if( value == (unsigned long)-1 && PyErr_Occurred() )
+	return -1;
+
+    limit = size == NS_INT32SZ ? 0xffffffffUL : (1UL << (size * 8)) - 1;
+    if( value > limit ) {
+	PyErr_SetString(PyExc_ValueError, "Integer field out of range");
+	return -1;
+    }
+
+    if( writer->position + size > writer->length )
+	return libbind_write_overflow();
+
+    cp = writer->buffer + writer->position;
+    if( size == 1 )
+	*cp = value;
+    else if( size == NS_INT16SZ )
+	NS_PUT16(value, cp);
+    else
+	NS_PUT32(value, cp);
+
+    writer->position += size;
+    return 0;
+}
+
+static int
+libbind_write_bytes(libbind_writer *writer, const void *data, int length)
+{
+    if( writer->position + length > writer->length )
+	return libbind_write_overflow();
+
+    memcpy(writer->buffer + writer->position, data, length);
+    writer->position += length;
+    return 0;
+}
+
+/* Write the raw bytes of a string or buffer */
+static int
+libbind_write_data(libbind_writer *writer, PyObject *object)
+{
+    const char *data;
+    Py_ssize_t length;
+
+    if( PyObject_AsCharBuffer(object, &data, &length) == -1 )
+	return -1;
+
+    return libbind_write_bytes(writer, data, length);
+}
+
+/* Write a domain name from its presentation form, compressed if compress is set */
+static int
+libbind_write_name(libbind_writer *writer, PyObject *object, int compress)
+{
+    const char *name;
+    int length;
+
+    name = PyString_AsString(object);
+    if( name == NULL )
+	return -1;
+
+    if( compress )
+	length = ns_name_compress(name, writer->buffer + writer->position, writer->length - writer->position,
+				  writer->dnptrs, writer->dnptrs + LIBBIND_MAXPTRS);
+    else
+	length = ns_name_compress(name, writer->buffer + writer->position, writer->length - writer->position,
+				  NULL, NULL);
+
+    if( length == -1 ) {
+	if( writer->length - writer->position < NS_MAXCDNAME )
+	    return libbind_write_overflow();
+	PyErr_Format(PyExc_ValueError, "Invalid domain name: %s", name);
+	return -1;
+    }
+
+    writer->position += length;
+    return 0;
+}
+
+/* A <character-string> */
+static int
+libbind_write_string(libbind_writer *writer, PyObject *object)
+{
+    const char *data;
+    Py_ssize_t length;
+    u_char size;
+
+    if( PyObject_AsCharBuffer(object, &data, &length) == -1 )
+	return -1;
+
+    if( length > 255 ) {
+	PyErr_SetString(PyExc_ValueError, "Character strings are at most 255 bytes");
+	return -1;
+    }
+
+    size = length;
+    if( libbind_write_bytes(writer, &size, 1) == -1 )
+	return -1;
+    return libbind_write_bytes(writer, data, length);
+}
+
+static int
+libbind_write_address(libbind_writer *writer, PyObject *object, int family)
+{
+    u_char address[NS_IN6ADDRSZ];
+    const char *text;
+
+    text = PyString_AsString(object);
+    if( text == NULL )
+	return -1;
+
+    if( inet_pton(family, text, address) != 1 ) {
+	PyErr_Format(PyExc_ValueError, "Invalid address: %s", text);
+	return -1;
+    }
+
+    return libbind_write_bytes(writer, address, family == AF_INET ? NS_INADDRSZ : NS_IN6ADDRSZ);
+}
+
+/* Write a tuple of fields, with the format of libbind_rdata_fields();
+ * names are compressed if compress is set.
+ */
+static int
+libbind_write_fields(libbind_writer *writer, PyObject *fields, const char *format, int compress)
+{
+    PyObject *field;
+    int index, status;
+
+    if( !PyTuple_Check(fields) || PyTuple_GET_SIZE(fields) != (Py_ssize_t)strlen(format) ) {
+	PyErr_Format(PyExc_TypeError, "The record value must be a tuple of %d fields", (int)strlen(format));
+	return -1;
+    }
+
+    for( index = 0; format[index] != '\0'; index++ ) {
+	field = PyTuple_GET_ITEM(fields, index);
+	switch( format[index] ) {
+	    case 'B':
+		status = libbind_write_int(writer, field, 1);
+		break;
+	    case 'H':
+		status = libbind_write_int(writer, field, NS_INT16SZ);
+		break;
+	    case 'I':
+		status = libbind_write_int(writer, field, NS_INT32SZ);
+		break;
+	    case 'n':
+		status = libbind_write_name(writer, field, compress);
+		break;
+	    case 's':
+		status = libbind_write_string(writer, field);
+		break;
+	    default:
+		status = libbind_write_data(writer, field);
+		break;
+	}
+
+	if( status == -1 )
+	    return -1;
+    }
+
+    return 0;
+}
+
+/* Write each item of a sequence: TXT strings, or OPT (code, data) options */
+static int
+libbind_write_sequence(libbind_writer *writer, PyObject *items, int type)
+{
+    PyObject *sequence, *item;
+    Py_ssize_t index;
+    int status;
+
+    sequence = PySequence_Fast(items, "The record value must be a sequence");
+    if( sequence == NULL )
+	return -1;
+
+    status = 0;
+    for( index = 0; index < PySequence_Fast_GET_SIZE(sequence) && status == 0; index++ ) {
+	item = PySequence_Fast_GET_ITEM(sequence, index);
+	if( type == ns_t_txt )
+	    status = libbind_write_string(writer, item);
+	else if( !PyTuple_Check(item) || PyTuple_GET_SIZE(item) != 2 ) {
+	    PyErr_SetString(PyExc_TypeError, "OPT options must be (code, data) tuples");
+	    status = -1;
+	}
+	else {
+	    status = libbind_write_int(writer, PyTuple_GET_ITEM(item, 0), NS_INT16SZ);
+	    if( status == 0 ) {
+		PyObject *length = PyInt_FromSsize_t(PyObject_Length(PyTuple_GET_ITEM(item, 1)));
+		if( length == NULL )
+		    status = -1;
+		else {
+		    status = libbind_write_int(writer, length, NS_INT16SZ);
+		    Py_DECREF(length);
+		}
+	    }
+	    if( status == 0 )
+		status = libbind_write_data(writer, PyTuple_GET_ITEM(item, 1));
+	}
+    }
+
+    Py_DECREF(sequence);
+    return status;
+}
+
+/* Encode a record value, as from decode_rdata(), for a type */
+static int
+libbind_encode_rdata(libbind_writer *writer, int type, PyObject *value)
+{
+    switch( type ) {
+	case ns_t_a:
+	    return libbind_write_address(writer, value, AF_INET);
+	case ns_t_aaaa:
+	    return libbind_write_address(writer, value, AF_INET6);
+	case ns_t_ns:
+	case ns_t_cname:
+	case ns_t_ptr:
+	    return libbind_write_name(writer, value, 1);
+	case ns_t_dname:
+	    return libbind_write_name(writer, value, 0);
+	case ns_t_mx:
+	    return libbind_write_fields(writer, value, "Hn", 1);
+	case ns_t_soa:
+	    return libbind_write_fields(writer, value, "nnIIIII", 1);
+	case ns_t_txt:
+	case ns_t_opt:
+	    return libbind_write_sequence(writer, value, type);
+	case ns_t_srv:
+	    return libbind_write_fields(writer, value, "HHHn", 0);
+	case ns_t_naptr:
+	    return libbind_write_fields(writer, value, "HHsssn", 0);
+	case LIBBIND_T_DS:
+	case LIBBIND_T_CDS:
+	case LIBBIND_T_DNSKEY:
+	case LIBBIND_T_CDNSKEY:
+	    return libbind_write_fields(writer, value, "HBBr", 0);
+	case LIBBIND_T_RRSIG:
+	    return libbind_write_fields(writer, value, "HBBIIIHnr", 0);
+    }
+
+    PyErr_Format(PyExc_ValueError, "Record values of type %d cannot be encoded; give the rdata", type);
+    return -1;
+}
+
+/* Write one record tuple: (name, type, class) for questions, and
+ * (name, type, class, ttl, rdata[, value]) for the other sections.
+ */
+static int
+libbind_write_record(libbind_writer *writer, PyObject *record, int question)
+{
+    PyObject *rdata, *value;
+    Py_ssize_t size;
+    int type, start;
+    u_char *cp;
+
+    size = PyTuple_Check(record) ? PyTuple_GET_SIZE(record) : -1;
+    if( size < (question ? 3 : 5) ) {
+	PyErr_SetString(PyExc_TypeError, question ? "Questions must be (name, type, class) tuples"
+				: "Records must be (name, type, class, ttl, rdata[, value]) tuples");
+	return -1;
+    }
+
+    type = PyInt_AsLong(PyTuple_GET_ITEM(record, 1));
+    if( type == -1 && PyErr_Occurred() )
+	return -1;
+
+    if( libbind_write_name(writer, PyTuple_GET_ITEM(record, 0), 1) == -1 ||
+	libbind_write_int(writer, PyTuple_GET_ITEM(record, 1), NS_INT16SZ) == -1 ||
+	libbind_write_int(writer, PyTuple_GET_ITEM(record, 2), NS_INT16SZ) == -1 )
+	return -1;
+
+    if( question )
+	return 0;
+
+    if( libbind_write_int(writer, PyTuple_GET_ITEM(record, 3), NS_INT32SZ) == -1 )
+	return -1;
+
+    /* The rdata length is filled in after the rdata */
+    if( writer->position + NS_INT16SZ > writer->length )
+	return libbind_write_overflow();
+    writer->position += NS_INT16SZ;
+    start = writer->position;
+
+    rdata = PyTuple_GET_ITEM(record, 4);
+    value = size > 5 ? PyTuple_GET_ITEM(record, 5) : Py_None;
+    if( rdata != Py_None ) {
+	if( libbind_write_data(writer, rdata) == -1 )
+	    return -1;
+    }
+    else if( value != Py_None ) {
+	if( libbind_encode_rdata(writer, type, value) == -1 )
+	    return -1;
+    }
+
+    if( writer->position - start > 0xffff ) {
+	PyErr_SetString(PyExc_ValueError, "The record data is too long");
+	return -1;
+    }
+
+    cp = writer->buffer + start - NS_INT16SZ;
+    NS_PUT16(writer->position - start, cp);
+    return 0;
+}
+
+/* Pack a flags tuple, as from parse_flags(), or a raw 16-bit int */
+static int
+libbind_pack_flags(PyObject *flags, unsigned long *packed)
+{
+    long value;
+    int flag;
+
+    if( !PyTuple_Check(flags) ) {
+	value = PyInt_AsLong(flags);
+	if( value == -1 && PyErr_Occurred() )
+	    return -1;
+	if( value < 0 || value > 0xffff ) {
+	    PyErr_SetString(PyExc_ValueError, "The flags must fit in 16 bits");
+	    return -1;
+	}
+	*packed = value;
+	return 0;
+    }
+
+    if( PyTuple_GET_SIZE(flags) != ns_f_max ) {
+	PyErr_Format(PyExc_TypeError, "The flags tuple must have %d items", ns_f_max);
+	return -1;
+    }
+
+    *packed = 0;
+    for( flag = 0; flag < ns_f_max; flag++ ) {
+	value = PyInt_AsLong(PyTuple_GET_ITEM(flags, flag));
+	if( value == -1 && PyErr_Occurred() )
+	    return -1;
+	if( value < 0 || ((value << libbind_flag_shifts[flag]) & ~(long)libbind_flag_masks[flag]) != 0 ) {
+	    PyErr_Format(PyExc_ValueError, "Flag %d out of range", flag);
+	    return -1;
+	}
+	*packed |= value << libbind_flag_shifts[flag];
+    }
+
+    return 0;
+}
+
+/* Write a whole message.  Returns its length, or -1 with an exception set. */
+static int
+libbind_write_message(libbind_writer *writer, PyObject *messageId, PyObject *flags, PyObject *sections)
+{
+    PyObject *sequence, *records[ns_s_max];
+    unsigned long packed;
+    Py_ssize_t count;
+    int section, index, status;
+    u_char *cp;
+
+    sequence = PySequence_Fast(sections, "The sections must be a sequence");
+    if( sequence == NULL )
+	return -1;
+
+    if( PySequence_Fast_GET_SIZE(sequence) > ns_s_max ) {
+	PyErr_Format(PyExc_ValueError, "A message has at most %d sections", ns_s_max);
+	Py_DECREF(sequence);
+	return -1;
+    }
+
+    memset(records, 0, sizeof(records));
+    memset(writer->dnptrs, 0, sizeof(writer->dnptrs));
+    writer->dnptrs[0] = writer->buffer;
+
+    status = libbind_pack_flags(flags, &packed);
+    if( status == 0 && writer->length < NS_HFIXEDSZ )
+	status = libbind_write_overflow();
+    if( status == 0 ) {
+	writer->position = 0;
+	status = libbind_write_int(writer, messageId, NS_INT16SZ);
+    }
+
+    if( status == 0 ) {
+	cp = writer->buffer + NS_INT16SZ;
+	NS_PUT16(packed, cp);
+    }
+
+    for( section = 0; section < ns_s_max && status == 0; section++ ) {
+	count = 0;
+	if( section < PySequence_Fast_GET_SIZE(sequence) ) {
+	    records[section] = PySequence_Fast(PySequence_Fast_GET_ITEM(sequence, section),
+					       "Each section must be a sequence of records");
+	    if( records[section] == NULL ) {
+		status = -1;
+		break;
+	    }
+	    count = PySequence_Fast_GET_SIZE(records[section]);
+	}
+
+	if( count > 0xffff ) {
+	    PyErr_SetString(PyExc_ValueError, "Too many records in a section");
+	    status = -1;
+	    break;
+	}
+	cp = writer->buffer + NS_INT16SZ * (2 + section);
+	NS_PUT16(count, cp);
+    }
+
+    writer->position = NS_HFIXEDSZ;
+    for( section = 0; section < ns_s_max && status == 0; section++ ) {
+	if( records[section] == NULL )
+	    continue;
+
+	for( index = 0; index < PySequence_Fast_GET_SIZE(records[section]) && status == 0; index++ )
+	    status = libbind_write_record(writer, PySequence_Fast_GET_ITEM(records[section], index),
+					  section == ns_s_qd);
+    }
+
+    for( section = 0; section < ns_s_max; section++ )
+	Py_XDECREF(records[section]);
+    Py_DECREF(sequence);
+
+    if( status == -1 )
+	return -1;
+    return writer->position;
+}
+
+static char libbind_build_message_doc[] =
+"Encodes a DNS message in wire format.\n\
+    \n\
+    build_message(id, flags, sections, buffer=None, offset=0)\n\
+    \n\
+    flags is a tuple as from parse_flags(), or the raw 16-bit flags.  sections\n\
+    holds up to four sequences of records, in section order.  Questions are\n\
+    (name, type, class) tuples; other records are (name, type, class, ttl,\n\
+    rdata, value) tuples, where the raw rdata is written as it is unless it is\n\
+    None, in which case value (as from decode_rdata()) is encoded.  Names are\n\
+    compressed where RFC 3597 allows.\n\
+    \n\
+    Without a buffer, the message is returned as a string.  With a writable\n\
+    buffer such as a bytearray, it is written at offset and its length is\n\
+    returned.  Raises ValueError if it does not fit, or a field is invalid.";
+
+static PyObject *
+libbind_build_message_py(PyObject *self, PyObject *args)
+{
+    libbind_writer writer;
+    PyObject *messageId, *flags, *sections, *buffer;
+    u_char data[NS_MAXMSG];
+    Py_ssize_t offset;
+    Py_buffer view;
+    int length;
+
+    buffer = Py_None;
+    offset = 0;
+    if( !PyArg_ParseTuple(args, "OOO|On", &messageId, &flags, &sections, &buffer, &offset) )
+	return NULL;
+
+    if( buffer == Py_None ) {
+	writer.buffer = data;
+	writer.length = sizeof(data);
+
+	length = libbind_write_message(&writer, messageId, flags, sections);
+	if( length == -1 )
+	    return NULL;
+	return PyString_FromStringAndSize((const char *)data, length);
+    }
+
+    if( PyObject_GetBuffer(buffer, &view, PyBUF_WRITABLE) == -1 )
+	return NULL;
+
+    if( offset < 0 || offset > view.len ) {
+	PyBuffer_Release(&view);
+	PyErr_SetString(PyExc_ValueError, "The offset is outside the buffer");
+	return NULL;
+    }
+
+    writer.buffer = (u_char *)view.buf + offset;
+    writer.length = view.len - offset > NS_MAXMSG ? NS_MAXMSG : view.len - offset;
+
+    length = libbind_write_message(&writer, messageId, flags, sections);
+    PyBuffer_Release(&view);
+
+    if( length == -1 )
+	return NULL;
+    return PyInt_FromLong(length);
+}
+
+/*
+ * Patching.  patch_message() rewrites the ID, flags and TTLs of a message in
+ * a writable buffer, without decoding any names.
+ */
+
+/* Walk the records of a message, decrementing their TTLs if patch is set.
+ * Returns the smallest TTL seen (after decrementing), LIBBIND_NOTTL if there
+ * are no TTLs, or -1 if the message is malformed.
+ */
+#define LIBBIND_NOTTL 0x100000000LL
+
+static long long
+libbind_patch_ttls(u_char *message, int length, unsigned long decrement, int patch)
+{
+    const u_char *cp, *eom;
+    u_char *ttlp;
+    u_int16_t count, type, rdlength;
+    u_int32_t ttl;
+    long long smallest;
+    int section, index;
+
+    if( length < NS_HFIXEDSZ )
+	return -1;
+
+    eom      = message + length;
+    cp       = message + NS_HFIXEDSZ;
+    smallest = LIBBIND_NOTTL;
+
+    for( section = ns_s_qd; section < ns_s_max; section++ ) {
+	ttlp = message + NS_INT16SZ * (2 + section);
+	NS_GET16(count, ttlp);
+
+	for( index = 0; index < count; index++ ) {
+	    if( ns_name_skip(&cp, eom) == -1 )
+		return -1;
+
+	    if( section == ns_s_qd ) {
+		if( cp + NS_QFIXEDSZ > eom )
+		    return -1;
+		cp += NS_QFIXEDSZ;
+		continue;
+	    }
+
+	    if( cp + NS_RRFIXEDSZ > eom )
+		return -1;
+	    NS_GET16(type, cp);
+	    cp += NS_INT16SZ;		/* class */
+	    ttlp = (u_char *)cp;
+	    NS_GET32(ttl, cp);
+	    NS_GET16(rdlength, cp);
+	    if( cp + rdlength > eom )
+		return -1;
+	    cp += rdlength;
+
+	    /* OPT records keep EDNS flags in the TTL */
+	    if( type == ns_t_opt )
+		continue;
+
+	    if( decrement > 0 ) {
+		ttl = ttl > decrement ? ttl - decrement : 0;
+		if( patch )
+		    NS_PUT32(ttl, ttlp);
+	    }
+	    if( ttl < smallest )
+		smallest = ttl;
+	}
+    }
+
+    return smallest;
+}
+
+static char libbind_patch_message_doc[] =
+"Rewrites the header and TTLs of a message in place.\n\
+    \n\
+    patch_message(buffer, id=-1, setFlags=0, clearFlags=0, ttlDecrement=0,\n\
+		  offset=0, length=-1)\n\
+    \n\
+    buffer is a writable buffer such as a bytearray, holding the message at\n\
+    offset (to the end of the buffer if length is -1).  The ID is replaced\n\
+    unless it is -1; the bits of setFlags are set and those of clearFlags\n\
+    cleared in the 16-bit flags; every TTL except those of OPT records is\n\
+    decreased by ttlDecrement, stopping at 0.\n\
+    \n\
+    Returns the smallest TTL left, or None if the message has no TTLs.  Raises\n\
+    ValueError if the message is malformed, in which case it is not changed,\n\
+    or if ttlDecrement is negative.";
+
+static PyObject *
+libbind_patch_message(PyObject *self, PyObject *args)
+{
+    PyObject *buffer;
+    Py_buffer view;
+    Py_ssize_t offset, length;
+    long messageId, setFlags, clearFlags, decrement;
+    unsigned long flags;
+    long long smallest;
+    u_char *message, *cp;
+
+    messageId  = -1;
+    setFlags   = 0;
+    clearFlags = 0;
+    decrement  = 0;
+    offset     = 0;
+    length     = -1;
+    if( !PyArg_ParseTuple(args, "O|llllnn", &buffer, &messageId, &setFlags, &clearFlags, &decrement,
+			  &offset, &length) )
+	return NULL;
+
+    if( messageId < -1 || messageId > 0xffff || setFlags < 0 || setFlags > 0xffff ||
+	clearFlags < 0 || clearFlags > 0xffff ) {
+	PyErr_SetString(PyExc_ValueError, "The ID and flags must fit in 16 bits");
+	return NULL;
+    }
+    if( decrement < 0 ) {
+	PyErr_SetString(PyExc_ValueError, "The TTL decrement cannot be negative");
+	return NULL;
+    }
+
+    if( PyObject_GetBuffer(buffer, &view, PyBUF_WRITABLE) == -1 )
+	return NULL;
+
+    if( length == -1 )
+	length = view.len - offset;
+    if( offset < 0 || length < 0 || offset + length > view.len ) {
+	PyBuffer_Release(&view);
+	PyErr_SetString(PyExc_ValueError, "The message is outside the buffer");
+	return NULL;
+    }
+
+    message = (u_char *)view.buf + offset;
+
+    /* Check the whole message before changing anything */
+    smallest = libbind_patch_ttls(message, length, (unsigned long)decrement, 0);
+    if( smallest == -1 ) {
+	PyBuffer_Release(&view);
+	PyErr_SetString(PyExc_ValueError, "Malformed message");
+	return NULL;
+    }
+
+    if( messageId != -1 ) {
+	cp = message;
+	NS_PUT16(messageId, cp);
+    }
+
+    if( setFlags != 0 || clearFlags != 0 ) {
+	cp = message + NS_INT16SZ;
+	NS_GET16(flags, cp);
+	flags = (flags | setFlags) & ~clearFlags;
+	cp = message + NS_INT16SZ;
+	NS_PUT16(flags, cp);
+    }
+
+    if( decrement > 0 )
+	libbind_patch_ttls(message, length, (unsigned long)decrement, 1);
+
+    PyBuffer_Release(&view);
+
+    if( smallest == LIBBIND_NOTTL ) {
+	Py_INCREF(Py_None);
+	return Py_None;
+    }
+    return PyInt_FromLong((long)smallest);
+}
+
+static char libbind_parse_question_doc[] =
+"Decodes only the header and the first question of a raw DNS message.\n\
+    \n\
+    parse_question(data) returns (id, flags, qname, qtype, qclass), with flags\n\
+    as from parse_flags().  The question fields are None if the message has\n\
+    no question.  The other sections are not looked at, let alone checked.\n\
+    Raises TypeError if the header or question cannot be parsed.";
+
+static PyObject *
+libbind_parse_question(PyObject *self, PyObject *args)
+{
+    libbind_rdata_reader reader;
+    Py_buffer data;
+    PyObject *flags, *name;
+    const u_char *cp;
+    u_int16_t messageId, flagBits, count, flagVals[ns_f_max];
+    unsigned long questionType, questionClass;
+    int flag;
+
+    if( !PyArg_ParseTuple(args, "s*", &data) )
+	return NULL;
+
+    if( data.len < NS_HFIXEDSZ ) {
+	PyBuffer_Release(&data);
+	PyErr_SetString(PyExc_TypeError, "The message is too short for a header");
+	return NULL;
+    }
+
+    cp = (const u_char *)data.buf;
+    NS_GET16(messageId, cp);
+    NS_GET16(flagBits, cp);
+    NS_GET16(count, cp);
+
+    for( flag = 0; flag < ns_f_max; flag++ )
+	flagVals[flag] = (flagBits & libbind_flag_masks[flag]) >> libbind_flag_shifts[flag];
+
+    if( count == 0 ) {
+	PyBuffer_Release(&data);
+	return Py_BuildValue("iNOOO", (int)messageId, libbind_build_flags(flagVals), Py_None, Py_None, Py_None);
+    }
+
+    reader.rdata        = (const u_char *)data.buf;
+    reader.length       = data.len;
+    reader.position     = NS_HFIXEDSZ;
+    reader.packet       = reader.rdata;
+    reader.packetLength = data.len;
+
+    name = libbind_rdata_name(&reader);
+    if( name == NULL || libbind_rdata_u16(&reader, &questionType) == -1 ||
+	libbind_rdata_u16(&reader, &questionClass) == -1 ) {
+	PyBuffer_Release(&data);
+	Py_XDECREF(name);
+	if( !PyErr_Occurred() )
+	    PyErr_SetString(PyExc_TypeError, "The question cannot be parsed");
 	return NULL;
     }
 
-    /* It would be nice to validate whether the ns_rr came from the ns_msg. */
+    PyBuffer_Release(&data);
 
-    msgStart     = ns_msg_base(message->packet);
-    dataLocation = ns_rr_rdata(rr->record);
+    flags = libbind_build_flags(flagVals);
+    if( flags == NULL ) {
+	Py_DECREF(name);
+	return NULL;
+    }
 
-    /* NULL data location means the record does not have data (e.g. for a query). */
-    if( dataLocation == (const u_char *)NULL ) {
-	Py_INCREF(Py_None);
-	return Py_None;
+    return Py_BuildValue("iNNll", (int)messageId, flags, name, (long)questionType, (long)questionClass);
+}
+
+/*
+ * Packet filters.  A filter is a program of comparisons on the header and
+ * the first question of a raw message, combined in postfix order, and it is
+ * run before anything else is parsed.  Strangle.Filter compiles its
+ * expression language into the program, which is a sequence of tuples:
+ *
+ *     (op, field, value)  - a comparison.  op is "=", "!=", "<", "<=", ">",
+ *                           ">=" or "in" (value a sequence of numbers) for
+ *                           the number fields, and "=", "!=" or "endswith"
+ *                           (value a lower case string) for qname.
+ *     ("and",), ("or",), ("not",)
+ *                         - combine the results of what comes before
+ *
+ * Comparisons on the question are false for a message without one, and a
+ * packet whose header or question cannot be decoded never matches.
+ */
+enum { LIBBIND_FILTER_EQ, LIBBIND_FILTER_NE, LIBBIND_FILTER_LT, LIBBIND_FILTER_LE,
+       LIBBIND_FILTER_GT, LIBBIND_FILTER_GE, LIBBIND_FILTER_IN, LIBBIND_FILTER_ENDSWITH,
+       LIBBIND_FILTER_AND, LIBBIND_FILTER_OR, LIBBIND_FILTER_NOT, LIBBIND_FILTER_OPS };
+
+static const char *libbind_filter_ops[LIBBIND_FILTER_OPS] = {
+    "=", "!=", "<", "<=", ">", ">=", "in", "endswith", "and", "or", "not"
+};
+
+/* The fields, in the order of libbind_filter_fields: the ID, the ns_f_* flags,
+ * the section counts, the packet length, and the question.  Only the ones
+ * from qtype on need the question decoded.
+ */
+#define LIBBIND_FIELD_FLAGS   1
+#define LIBBIND_FIELD_COUNTS  (LIBBIND_FIELD_FLAGS + ns_f_max)
+#define LIBBIND_FIELD_LENGTH  (LIBBIND_FIELD_COUNTS + ns_s_max)
+#define LIBBIND_FIELD_QTYPE   (LIBBIND_FIELD_LENGTH + 1)
+#define LIBBIND_FIELD_QCLASS  (LIBBIND_FIELD_QTYPE + 1)
+#define LIBBIND_FIELD_QNAME   (LIBBIND_FIELD_QCLASS + 1)
+#define LIBBIND_FIELD_MAX     (LIBBIND_FIELD_QNAME + 1)
+
+static const char *libbind_filter_fields[LIBBIND_FIELD_MAX] = {
+    "id",
+    "qr", "opcode", "aa", "tc", "rd", "ra", "z", "ad", "cd", "rcode",
+    "qdcount", "ancount", "nscount", "arcount",
+    "length",
+    "qtype", "qclass", "qname"
+};
+
+/* The deepest the result stack of a program may get */
+#define LIBBIND_FILTER_DEPTH 64
+
+typedef struct {
+    int        op;
+    int        field;
+    long       value;
+    long      *values;		/* The numbers for "in" */
+    Py_ssize_t count;
+    char      *text;		/* The name for qname comparisons */
+    int        textLength;
+} libbind_filter_step;
+
+static char libbind_ns_filter_doc[] =
+"A compiled packet filter, run on the raw header and first question.\n\
+    \n\
+    ns_filter(program) takes the postfix program that Strangle.Filter\n\
+    compiles.  match(data) tells whether one packet matches, and\n\
+    select(packets) returns the indexes of the packets which do.";
+
+typedef struct {
+    PyObject_HEAD
+    libbind_filter_step *program;
+    Py_ssize_t           length;
+    int                  question;	/* Whether the question is looked at */
+    int                  name;		/* Whether qname is */
+} libbind_ns_filter;
+
+/* The header and question of a packet, as a filter sees them */
+typedef struct {
+    long fields[LIBBIND_FIELD_QNAME];
+    int  question;			/* Whether qtype, qclass and name are set */
+    char name[MAXDNAME + 1];		/* The qname, in lower case */
+    int  nameLength;
+} libbind_filter_packet;
+
+static void
+libbind_filter_free(libbind_filter_step *program, Py_ssize_t length)
+{
+    Py_ssize_t index;
+
+    if( program == NULL )
+	return;
+
+    for( index = 0; index < length; index++ ) {
+	PyMem_Free(program[index].values);
+	PyMem_Free(program[index].text);
+    }
+    PyMem_Free(program);
+}
+
+/* Return the index of a string in a table, or -1. */
+static int
+libbind_filter_lookup(const char **table, int size, PyObject *name)
+{
+    const char *text;
+    int index;
+
+    if( !PyString_Check(name) )
+	return -1;
+
+    text = PyString_AS_STRING(name);
+    for( index = 0; index < size; index++ )
+	if( strcmp(text, table[index]) == 0 )
+	    return index;
+    return -1;
+}
+
+/* Fill in one step from its tuple.  Returns -1 with an exception set if it is bad. */
+static int
+libbind_filter_step_init(libbind_filter_step *step, PyObject *item)
+{
+    PyObject *value, *sequence;
+    Py_ssize_t index, size;
+    char *text;
+
+    if( !PyTuple_Check(item) || PyTuple_GET_SIZE(item) < 1 ) {
+	PyErr_SetString(PyExc_ValueError, "Every filter step must be a tuple");
+	return -1;
+    }
+
+    step->op = libbind_filter_lookup(libbind_filter_ops, LIBBIND_FILTER_OPS, PyTuple_GET_ITEM(item, 0));
+    if( step->op == -1 ) {
+	PyErr_SetString(PyExc_ValueError, "Unknown filter operation");
+	return -1;
+    }
+
+    if( step->op >= LIBBIND_FILTER_AND ) {
+	if( PyTuple_GET_SIZE(item) != 1 ) {
+	    PyErr_SetString(PyExc_ValueError, "and, or and not take no operands");
+	    return -1;
+	}
+	return 0;
+    }
+
+    if( PyTuple_GET_SIZE(item) != 3 ) {
+	PyErr_SetString(PyExc_ValueError, "A comparison needs a field and a value");
+	return -1;
+    }
+
+    step->field = libbind_filter_lookup(libbind_filter_fields, LIBBIND_FIELD_MAX, PyTuple_GET_ITEM(item, 1));
+    if( step->field == -1 ) {
+	PyErr_SetString(PyExc_ValueError, "Unknown filter field");
+	return -1;
+    }
+
+    value = PyTuple_GET_ITEM(item, 2);
+
+    if( step->field == LIBBIND_FIELD_QNAME ) {
+	if( step->op != LIBBIND_FILTER_EQ && step->op != LIBBIND_FILTER_NE &&
+	    step->op != LIBBIND_FILTER_ENDSWITH ) {
+	    PyErr_SetString(PyExc_ValueError, "qname can only be compared with =, != and endswith");
+	    return -1;
+	}
+	if( PyString_AsStringAndSize(value, &text, &size) == -1 )
+	    return -1;
+	if( size > MAXDNAME ) {
+	    PyErr_SetString(PyExc_ValueError, "The name is too long");
+	    return -1;
+	}
+
+	step->text = PyMem_Malloc(size + 1);
+	if( step->text == NULL ) {
+	    PyErr_NoMemory();
+	    return -1;
+	}
+	memcpy(step->text, text, size + 1);
+	step->textLength = (int)size;
+	return 0;
+    }
+
+    if( step->op == LIBBIND_FILTER_ENDSWITH ) {
+	PyErr_SetString(PyExc_ValueError, "Only qname can be compared with endswith");
+	return -1;
+    }
+
+    if( step->op != LIBBIND_FILTER_IN ) {
+	step->value = PyInt_AsLong(value);
+	return step->value == -1 && PyErr_Occurred() ? -1 : 0;
+    }
+
+    sequence = PySequence_Fast(value, "in needs a sequence of numbers");
+    if( sequence == NULL )
+	return -1;
+
+    /* One more than needed, so that an empty set still has an array. */
+    step->count  = PySequence_Fast_GET_SIZE(sequence);
+    step->values = PyMem_New(long, step->count + 1);
+    if( step->values == NULL ) {
+	Py_DECREF(sequence);
+	PyErr_NoMemory();
+	return -1;
+    }
+
+    for( index = 0; index < step->count; index++ ) {
+	step->values[index] = PyInt_AsLong(PySequence_Fast_GET_ITEM(sequence, index));
+	if( step->values[index] == -1 && PyErr_Occurred() ) {
+	    Py_DECREF(sequence);
+	    return -1;
+	}
+    }
+
+    Py_DECREF(sequence);
+    return 0;
+}
+
+/* __init__() */
+static int
+libbind_ns_filter_init(libbind_ns_filter *self, PyObject *args)
+{
+    PyObject *program, *sequence;
+    libbind_filter_step *steps;
+    Py_ssize_t length, index;
+    int depth, question, name;
+
+    if( !PyArg_ParseTuple(args, "O", &program) )
+	return -1;
+
+    sequence = PySequence_Fast(program, "The filter program must be a sequence of tuples");
+    if( sequence == NULL )
+	return -1;
+
+    length = PySequence_Fast_GET_SIZE(sequence);
+    steps  = PyMem_New(libbind_filter_step, length + 1);
+    if( steps == NULL ) {
+	Py_DECREF(sequence);
+	PyErr_NoMemory();
+	return -1;
+    }
+    memset(steps, 0, (length + 1) * sizeof(libbind_filter_step));
+
+    /* Check that every step has the results it combines, and that one is left. */
+    depth    = 0;
+    question = 0;
+    name     = 0;
+    for( index = 0; index < length; index++ ) {
+	if( libbind_filter_step_init(&steps[index], PySequence_Fast_GET_ITEM(sequence, index)) == -1 )
+	    goto fail;
+
+	/* NOT replaces the result on top of the stack, so it needs one too. */
+	if( steps[index].op == LIBBIND_FILTER_AND || steps[index].op == LIBBIND_FILTER_OR )
+	    depth--;
+	else if( steps[index].op != LIBBIND_FILTER_NOT ) {
+	    depth++;
+	    question |= steps[index].field >= LIBBIND_FIELD_QTYPE;
+	    name     |= steps[index].field == LIBBIND_FIELD_QNAME;
+	}
+
+	if( depth < 1 ) {
+	    PyErr_SetString(PyExc_ValueError, "A filter step has nothing to combine");
+	    goto fail;
+	}
+	if( depth > LIBBIND_FILTER_DEPTH ) {
+	    PyErr_SetString(PyExc_ValueError, "The filter is nested too deeply");
+	    goto fail;
+	}
+    }
+
+    if( depth != 1 ) {
+	PyErr_SetString(PyExc_ValueError, "A filter must leave exactly one result");
+	goto fail;
+    }
+
+    Py_DECREF(sequence);
+
+    libbind_filter_free(self->program, self->length);
+    self->program  = steps;
+    self->length   = length;
+    self->question = question;
+    self->name     = name;
+    return 0;
+
+fail:
+    Py_DECREF(sequence);
+    libbind_filter_free(steps, length);
+    return -1;
+}
+
+static void
+libbind_ns_filter_dealloc(libbind_ns_filter *self)
+{
+    libbind_filter_free(self->program, self->length);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
+/* Decode what the filter looks at.  Returns -1 if the packet is too short or
+ * its question is malformed.
+ */
+static int
+libbind_filter_load(libbind_ns_filter *self, const u_char *data, Py_ssize_t length,
+		    libbind_filter_packet *packet)
+{
+    libbind_rdata_reader reader;
+    const u_char *cp;
+    u_int16_t flagBits, value;
+    unsigned long questionType, questionClass;
+    int flag, section, i;
+
+    if( length < NS_HFIXEDSZ )
+	return -1;
+
+    cp = data;
+    NS_GET16(value, cp);
+    packet->fields[0] = value;
+    NS_GET16(flagBits, cp);
+    for( flag = 0; flag < ns_f_max; flag++ )
+	packet->fields[LIBBIND_FIELD_FLAGS + flag] = (flagBits & libbind_flag_masks[flag]) >> libbind_flag_shifts[flag];
+    for( section = 0; section < ns_s_max; section++ ) {
+	NS_GET16(value, cp);
+	packet->fields[LIBBIND_FIELD_COUNTS + section] = value;
+    }
+    packet->fields[LIBBIND_FIELD_LENGTH] = (long)length;
+
+    packet->question = 0;
+    if( !self->question || packet->fields[LIBBIND_FIELD_COUNTS + ns_s_qd] == 0 )
+	return 0;
+
+    reader.rdata        = data;
+    reader.length       = length;
+    reader.position     = NS_HFIXEDSZ;
+    reader.packet       = data;
+    reader.packetLength = length;
+
+    if( self->name ) {
+	if( libbind_rdata_name_text(&reader, packet->name, &packet->nameLength) == -1 )
+	    return -1;
+	for( i = 0; i < packet->nameLength; i++ )
+	    if( packet->name[i] >= 'A' && packet->name[i] <= 'Z' )
+		packet->name[i] += 'a' - 'A';
+    }
+    else {
+	cp = data + NS_HFIXEDSZ;
+	if( ns_name_skip(&cp, data + length) == -1 )
+	    return -1;
+	reader.position = cp - data;
+    }
+
+    if( libbind_rdata_u16(&reader, &questionType) == -1 || libbind_rdata_u16(&reader, &questionClass) == -1 )
+	return -1;
+
+    packet->fields[LIBBIND_FIELD_QTYPE]  = (long)questionType;
+    packet->fields[LIBBIND_FIELD_QCLASS] = (long)questionClass;
+    packet->question = 1;
+    return 0;
+}
+
+/* Return the result of one comparison. */
+static int
+libbind_filter_compare(libbind_filter_step *step, libbind_filter_packet *packet)
+{
+    Py_ssize_t index;
+    long value;
+    int equal;
+
+    if( step->field >= LIBBIND_FIELD_QTYPE && !packet->question )
+	return 0;
+
+    if( step->field == LIBBIND_FIELD_QNAME ) {
+	if( step->op == LIBBIND_FILTER_ENDSWITH )
+	    return packet->nameLength >= step->textLength &&
+		   memcmp(packet->name + packet->nameLength - step->textLength, step->text, step->textLength) == 0;
+
+	equal = packet->nameLength == step->textLength && memcmp(packet->name, step->text, step->textLength) == 0;
+	return step->op == LIBBIND_FILTER_EQ ? equal : !equal;
+    }
+
+    value = packet->fields[step->field];
+    switch( step->op ) {
+	case LIBBIND_FILTER_EQ: return value == step->value;
+	case LIBBIND_FILTER_NE: return value != step->value;
+	case LIBBIND_FILTER_LT: return value <  step->value;
+	case LIBBIND_FILTER_LE: return value <= step->value;
+	case LIBBIND_FILTER_GT: return value >  step->value;
+	case LIBBIND_FILTER_GE: return value >= step->value;
+	case LIBBIND_FILTER_IN:
+	    for( index = 0; index < step->count; index++ )
+		if( value == step->values[index] )
+		    return 1;
+	    return 0;
+    }
+    return 0;
+}
+
+/* Return whether a raw packet matches the filter. */
+static int
+libbind_filter_run(libbind_ns_filter *self, const u_char *data, Py_ssize_t length)
+{
+    libbind_filter_packet packet;
+    char stack[LIBBIND_FILTER_DEPTH];
+    Py_ssize_t index;
+    int depth;
+
+    if( self->program == NULL || libbind_filter_load(self, data, length, &packet) == -1 )
+	return 0;
+
+    depth = 0;
+    for( index = 0; index < self->length; index++ ) {
+	switch( self->program[index].op ) {
+	    case LIBBIND_FILTER_AND:
+		depth--;
+		stack[depth - 1] = stack[depth - 1] && stack[depth];
+		break;
+	    case LIBBIND_FILTER_OR:
+		depth--;
+		stack[depth - 1] = stack[depth - 1] || stack[depth];
+		break;
+	    case LIBBIND_FILTER_NOT:
+		stack[depth - 1] = !stack[depth - 1];
+		break;
+	    default:
+		stack[depth++] = libbind_filter_compare(&self->program[index], &packet);
+	}
+    }
+
+    return stack[0];
+}
+
+/* Run the filter on an object with the buffer interface.  Returns -1 with an
+ * exception set if it has none.
+ */
+static int
+libbind_filter_object(libbind_ns_filter *self, PyObject *object)
+{
+    Py_buffer view;
+    int result;
+
+    if( PyObject_GetBuffer(object, &view, PyBUF_SIMPLE) == -1 )
+	return -1;
+
+    result = libbind_filter_run(self, (const u_char *)view.buf, view.len);
+    PyBuffer_Release(&view);
+    return result;
+}
+
+static char libbind_ns_filter_match_doc[] =
+"Returns whether a raw DNS message matches the filter";
+
+static PyObject *
+libbind_filter_match(libbind_ns_filter *self, PyObject *data)
+{
+    int result;
+
+    result = libbind_filter_object(self, data);
+    if( result == -1 )
+	return NULL;
+
+    return PyBool_FromLong(result);
+}
+
+static char libbind_ns_filter_select_doc[] =
+"Returns a list of the indexes of the raw DNS messages which match the filter.\n\
+    \n\
+    Items which are not strings or buffers do not match.";
+
+static PyObject *
+libbind_filter_select(libbind_ns_filter *self, PyObject *packets)
+{
+    PyObject *sequence, *selected, *number;
+    Py_ssize_t total, index;
+    int result;
+
+    sequence = PySequence_Fast(packets, "select() needs an iterable of packets");
+    if( sequence == NULL )
+	return NULL;
+
+    selected = PyList_New(0);
+    if( selected == NULL )
+	goto fail;
+
+    total = PySequence_Fast_GET_SIZE(sequence);
+    for( index = 0; index < total; index++ ) {
+	result = libbind_filter_object(self, PySequence_Fast_GET_ITEM(sequence, index));
+	if( result == -1 ) {
+	    if( !PyErr_ExceptionMatches(PyExc_TypeError) )
+		goto fail;
+	    PyErr_Clear();
+	    continue;
+	}
+	if( !result )
+	    continue;
+
+	number = PyInt_FromSsize_t(index);
+	if( number == NULL || PyList_Append(selected, number) == -1 ) {
+	    Py_XDECREF(number);
+	    goto fail;
+	}
+	Py_DECREF(number);
+    }
+
+    Py_DECREF(sequence);
+    return selected;
+
+fail:
+    Py_DECREF(sequence);
+    Py_XDECREF(selected);
+    return NULL;
+}
+
+static PyMethodDef libbind_ns_filter_methods[] = {
+    {"match" , (PyCFunction)libbind_filter_match , METH_O, libbind_ns_filter_match_doc},
+    {"select", (PyCFunction)libbind_filter_select, METH_O, libbind_ns_filter_select_doc},
+    {NULL, NULL}
+};
+
+static PyTypeObject libbind_ns_filterType = {
+    PyObject_HEAD_INIT(NULL)
+    0,						/* ob_size */
+    "Strangle.libbind.ns_filter",		/* tp_name */
+    sizeof(libbind_ns_filter),			/* tp_basicsize */
+    0,						/* tp_itemsize */
+    (destructor)libbind_ns_filter_dealloc,	/* tp_dealloc */
+    0,						/* tp_print */
+    0,						/* tp_getattr */
+    0,						/* tp_setattr */
+    0,						/* tp_compare */
+    0,						/* tp_repr */
+    0,						/* tp_as_number */
+    0,						/* tp_as_sequence */
+    0,						/* tp_as_mapping */
+    0,						/* tp_hash */
+    0,						/* tp_call */
+    0,						/* tp_str */
+    0,						/* tp_getattro */
+    0,						/* tp_setattro */
+    0,						/* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,				/* tp_flags */
+    libbind_ns_filter_doc,			/* tp_doc */
+    0,						/* tp_traverse       */
+    0,						/* tp_clear          */
+    0,						/* tp_richcompare    */
+    0,						/* tp_weaklistoffset */
+    0,						/* tp_iter           */
+    0,						/* tp_iternext       */
+    libbind_ns_filter_methods,			/* tp_methods        */
+    0,						/* tp_members        */
+    0,						/* tp_getset         */
+    0,						/* tp_base           */
+    0,						/* tp_dict           */
+    0,						/* tp_descr_get      */
+    0,						/* tp_descr_set      */
+    0,						/* tp_dictoffset     */
+    (initproc)libbind_ns_filter_init,		/* tp_init           */
+};
+
+static char libbind_parse_flags_doc[] =
+"Returns a tuple of all header flags of an ns_msg object, indexed by the ns_f_* values";
+
+static PyObject *
+libbind_parse_flags(PyObject *self, PyObject *arg)
+{
+    libbind_ns_msg *message;
+    u_int16_t flagVals[ns_f_max];
+    int flag;
+
+    message = libbind_as_ns_msg(arg);
+    if( message == NULL )
+	return NULL;
+
+    for( flag = 0; flag < ns_f_max; flag++ )
+	flagVals[flag] = ns_msg_getflag(message->packet, flag);
+
+    return libbind_build_flags(flagVals);
+}
+
+static char libbind_parse_section_doc[] =
+"Returns a tuple of record tuples for every record in a section of an ns_msg object";
+
+static PyObject *
+libbind_parse_section(PyObject *self, PyObject *args)
+{
+    PyObject *message, *result;
+    ns_msg *handle;
+    libbind_parsed parsed;
+    libbind_name_entry nameCache[LIBBIND_NAMECACHE];
+    int section;
+
+    if( !PyArg_ParseTuple(args, "Oi", &message, &section) )
+	return NULL;
+
+    if( libbind_as_ns_msg(message) == NULL )
+	return NULL;
+
+    if( section < 0 || section >= ns_s_max ) {
+	PyErr_SetString(PyExc_ValueError, "No such section");
+	return NULL;
     }
 
-    offset = dataLocation - msgStart;
-    return PyInt_FromLong(offset);
+    handle = &((libbind_ns_msg *)message)->packet;
+    libbind_parsed_init(&parsed, ns_msg_base(*handle), ns_msg_size(*handle));
+    libbind_parsed_cache(&parsed, nameCache);
+
+    if( libbind_parse_sections(&parsed, handle, section, section + 1) == -1 )
+	result = libbind_parsed_error(&parsed);
+    else
+	result = libbind_build_records(&parsed, 0, parsed.total);
+
+    libbind_parsed_free(&parsed);
+    return result;
+}
+
+static char libbind_parse_record_doc[] =
+"Returns the record tuple for an ns_rr object.\n\
+    \n\
+    Pass this function the ns_msg object and the ns_rr record taken from it.";
+
+static PyObject *
+libbind_parse_record(PyObject *self, PyObject *args)
+{
+    libbind_ns_msg *message;
+    libbind_ns_rr  *rr;
+    PyObject *result;
+    libbind_parsed parsed;
+    libbind_parsed_rr record;
+    libbind_name_entry nameCache[LIBBIND_NAMECACHE];
+
+    if( !libbind_msg_rr_args(args, &message, &rr) )
+	return NULL;
+
+    libbind_parsed_init(&parsed, ns_msg_base(message->packet), ns_msg_size(message->packet));
+    libbind_parsed_cache(&parsed, nameCache);
+
+    if( libbind_parse_rr(&parsed, &message->packet, &rr->record, &record) == -1 )
+	result = libbind_parsed_error(&parsed);
+    else
+	result = libbind_build_record(&parsed, &record);
+
+    libbind_parsed_free(&parsed);
+    return result;
 }
 
 static PyMethodDef libbind_methods[] = {
-    {"ns_msg_id"     , libbind_ns_msg_id     , METH_VARARGS, libbind_ns_msg_id_doc},
+    {"ns_msg_id"     , libbind_ns_msg_id     , METH_O      , libbind_ns_msg_id_doc},
     {"ns_msg_getflag", libbind_ns_msg_getflag, METH_VARARGS, libbind_ns_msg_getflag_doc},
     {"ns_msg_count"  , libbind_ns_msg_count  , METH_VARARGS, libbind_ns_msg_count_doc},
+    {"iter_records"  , (PyCFunction)libbind_iter_records, METH_VARARGS | METH_KEYWORDS,
+     libbind_ns_msg_iter_records_doc},
 
-    {"ns_rr_name"    , libbind_ns_rr_name    , METH_VARARGS, libbind_ns_rr_name_doc},
-    {"ns_rr_type"    , libbind_ns_rr_type    , METH_VARARGS, libbind_ns_rr_type_doc},
-    {"ns_rr_class"   , libbind_ns_rr_class   , METH_VARARGS, libbind_ns_rr_class_doc},
-    {"ns_rr_ttl"     , libbind_ns_rr_ttl     , METH_VARARGS, libbind_ns_rr_ttl_doc},
-    {"ns_rr_rdlen"   , libbind_ns_rr_rdlen   , METH_VARARGS, libbind_ns_rr_rdlen_doc},
-    {"ns_rr_rdata"   , libbind_ns_rr_rdata   , METH_VARARGS, libbind_ns_rr_rdata_doc},
+    {"ns_rr_name"    , libbind_ns_rr_name    , METH_O      , libbind_ns_rr_name_doc},
+    {"ns_rr_type"    , libbind_ns_rr_type    , METH_O      , libbind_ns_rr_type_doc},
+    {"ns_rr_class"   , libbind_ns_rr_class   , METH_O      , libbind_ns_rr_class_doc},
+    {"ns_rr_ttl"     , libbind_ns_rr_ttl     , METH_O      , libbind_ns_rr_ttl_doc},
+    {"ns_rr_rdlen"   , libbind_ns_rr_rdlen   , METH_O      , libbind_ns_rr_rdlen_doc},
+    {"ns_rr_rdata"   , libbind_ns_rr_rdata   , METH_O      , libbind_ns_rr_rdata_doc},
 
     {"ns_name_uncompress", libbind_ns_name_uncompress, METH_VARARGS, libbind_ns_name_uncompress_doc},
 
     {"ns_data_offset", libbind_ns_data_offset, METH_VARARGS, libbind_ns_data_offset_doc},
+
+    {"parse_message" , libbind_parse_message , METH_VARARGS, libbind_parse_message_doc},
+    {"parse_many"    , libbind_parse_many    , METH_VARARGS, libbind_parse_many_doc},
+    {"parse_columns" , libbind_parse_columns , METH_VARARGS, libbind_parse_columns_doc},
+    {"parse_headers" , libbind_parse_headers , METH_VARARGS, libbind_parse_headers_doc},
+    {"parse_question", libbind_parse_question, METH_VARARGS, libbind_parse_question_doc},
+    {"parse_flags"   , libbind_parse_flags   , METH_O      , libbind_parse_flags_doc},
+    {"parse_section" , libbind_parse_section , METH_VARARGS, libbind_parse_section_doc},
+    {"parse_record"  , libbind_parse_record  , METH_VARARGS, libbind_parse_record_doc},
+
+    {"decode_rdata"  , libbind_decode_rdata_py, METH_VARARGS, libbind_decode_rdata_doc},
+    {"decode_edns"   , libbind_decode_edns, METH_VARARGS, libbind_decode_edns_doc},
+    {"build_message" , libbind_build_message_py, METH_VARARGS, libbind_build_message_doc},
+    {"patch_message" , libbind_patch_message , METH_VARARGS, libbind_patch_message_doc},
+
+    {"set_intern_size", libbind_set_intern_size, METH_VARARGS, libbind_set_intern_size_doc},
+    {"set_stats"     , libbind_set_stats     , METH_VARARGS, libbind_set_stats_doc},
+    {"stats"         , libbind_stats_py      , METH_VARARGS, libbind_stats_doc},
     {NULL, NULL}
 };
 
@@ -554,14 +4270,27 @@ initlibbind(void)
 {
     PyObject *m;
 
-    libbind_ns_msgType.tp_new = PyType_GenericNew;
+    libbind_ns_msgType.tp_new     = PyType_GenericNew;
+    libbind_ns_msgType.tp_methods = libbind_ns_msg_methods;
+    libbind_ns_msgType.tp_getset  = libbind_ns_msg_getset;
     if( PyType_Ready(&libbind_ns_msgType) < 0 )
 	return;
 
-    libbind_ns_rrType.tp_new = PyType_GenericNew;
+    libbind_init_root_owner();
+
+    libbind_ns_rrType.tp_new     = PyType_GenericNew;
+    libbind_ns_rrType.tp_methods = libbind_ns_rr_methods;
+    libbind_ns_rrType.tp_getset  = libbind_ns_rr_getset;
     if( PyType_Ready(&libbind_ns_rrType) < 0 )
 	return;
 
+    if( PyType_Ready(&libbind_ns_recordsType) < 0 )
+	return;
+
+    libbind_ns_filterType.tp_new = PyType_GenericNew;
+    if( PyType_Ready(&libbind_ns_filterType) < 0 )
+	return;
+
     m = Py_InitModule3("Strangle.libbind", libbind_methods, libbind_doc);
 
     if( m == NULL )
@@ -573,6 +4302,12 @@ initlibbind(void)
     Py_INCREF(&libbind_ns_rrType);
     PyModule_AddObject(m, "ns_rr" , (PyObject *)&libbind_ns_rrType);
 
+    Py_INCREF(&libbind_ns_recordsType);
+    PyModule_AddObject(m, "ns_records", (PyObject *)&libbind_ns_recordsType);
+
+    Py_INCREF(&libbind_ns_filterType);
+    PyModule_AddObject(m, "ns_filter", (PyObject *)&libbind_ns_filterType);
+
     /* These are the ns_flag enums.  We just use Python ints. */
     PyModule_AddObject(m, "ns_f_qr"    , PyInt_FromLong(ns_f_qr));
     PyModule_AddObject(m, "ns_f_opcode", PyInt_FromLong(ns_f_opcode));
@@ -638,6 +4373,11 @@ initlibbind(void)
     PyModule_AddObject(m, "ns_t_dname", PyInt_FromLong(ns_t_dname));
     PyModule_AddObject(m, "ns_t_sink", PyInt_FromLong(ns_t_sink));
     PyModule_AddObject(m, "ns_t_opt", PyInt_FromLong(ns_t_opt));
+    PyModule_AddObject(m, "ns_t_ds", PyInt_FromLong(LIBBIND_T_DS));
+    PyModule_AddObject(m, "ns_t_rrsig", PyInt_FromLong(LIBBIND_T_RRSIG));
+    PyModule_AddObject(m, "ns_t_dnskey", PyInt_FromLong(LIBBIND_T_DNSKEY));
+    PyModule_AddObject(m, "ns_t_cds", PyInt_FromLong(LIBBIND_T_CDS));
+    PyModule_AddObject(m, "ns_t_cdnskey", PyInt_FromLong(LIBBIND_T_CDNSKEY));
     //PyModule_AddObject(m, "ns_t_apl", PyInt_FromLong(ns_t_apl));	/* (These two have no C symbol even       */
     //PyModule_AddObject(m, "ns_t_tkey", PyInt_FromLong(ns_t_tkey));	/*  though I got this code from nameser.h */
     PyModule_AddObject(m, "ns_t_tsig", PyInt_FromLong(ns_t_tsig));
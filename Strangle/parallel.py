@@ -0,0 +1,107 @@
+# parallel.py - Parse DNS messages on several processors at once
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Parse batches of DNS messages in a pool of worker processes
+
+The libbind objects cannot be pickled, so the workers send back the plain
+tuples from libbind.parse_many() and the DNSMessage objects are built from
+those in the calling process, without parsing the packets again.
+"""
+
+import multiprocessing
+
+import Strangle
+from Strangle import libbind
+
+def parseChunk(packets):
+    """Worker function: parse a list of packets, returning libbind.parse_many() output"""
+    return libbind.parse_many(packets)
+
+def chunks(packets, chunksize):
+    """Generate lists of at most chunksize packets"""
+    chunk = []
+    for packet in packets:
+	chunk.append(packet)
+	if len(chunk) == chunksize:
+	    yield chunk
+	    chunk = []
+
+    if chunk:
+	yield chunk
+
+def imap(packets, workers=None, chunksize=256, pool=None):
+    """Parse packets in worker processes, generating results in input order
+
+    Each result is a tuple of (index, parsed, reason).  parsed is the tuple
+    libbind.parse_message() would return, which can be passed straight to
+    DNSMessage(packet, parsed=parsed); for a bad packet it is None and reason
+    says why.  The results are plain tuples, so they can be pickled again.
+
+    workers is the number of processes (default: one per CPU).  To avoid
+    starting new processes for every batch, pass an existing
+    multiprocessing.Pool as "pool" instead.
+    """
+    if chunksize < 1:
+	raise ValueError, "chunksize must be at least 1"
+
+    ownPool = pool is None
+    if ownPool:
+	pool = multiprocessing.Pool(workers)
+
+    try:
+	# Every chunk but the last is full, so a chunk's offset follows from its number.
+	pieces = pool.imap(parseChunk, chunks(packets, chunksize))
+	for chunkNum, (results, errors) in enumerate(pieces):
+	    offset  = chunkNum * chunksize
+	    reasons = dict(errors)
+	    for index in xrange(len(results)):
+		yield offset + index, results[index], reasons.get(index)
+    finally:
+	if ownPool:
+	    pool.terminate()
+	    pool.join()
+
+def parse(packets, workers=None, chunksize=256, on_error='none', lazy=False, pool=None,
+	  filter=None):
+    """Parse a batch of raw DNS messages in worker processes
+
+    This returns (messages, errors) just like Strangle.parse_many(), and the
+    on_error, lazy and filter arguments work the same way.  The filter is run
+    here, so only the packets which match it are sent to the workers.  See
+    imap() for workers, chunksize and pool.
+    """
+    Strangle.checkOnError(on_error)
+    if type(packets) not in (list, tuple):
+	packets = list(packets)
+
+    indexes = Strangle.selectPackets(packets, filter)
+    if indexes is not None:
+	packets = [packets[index] for index in indexes]
+
+    results = []
+    errors  = []
+    for index, parsed, reason in imap(packets, workers, chunksize, pool):
+	results.append(parsed)
+	if parsed is None:
+	    if indexes is not None:
+		index = indexes[index]
+	    errors.append((index, reason))
+
+    return Strangle.buildMessages(packets, results, errors, on_error, lazy, indexes), errors
+
+# vim: sts=4 sw=4 noet
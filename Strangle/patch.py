@@ -0,0 +1,71 @@
+# patch.py - Rewrite DNS messages in place
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Rewrite the ID, flags and TTLs of DNS messages in place
+
+A proxy replaying a cached response only needs to change a few fields of it.
+message() does that directly in a bytearray (or any writable buffer), with
+libbind.patch_message(), without parsing the message into objects:
+
+    response = bytearray(cached)
+    patch.message(response, id=queryId, recursionAvailable=True,
+		  ttlDecrement=int(time.time() - cachedAt))
+    sock.sendto(response, peer)
+"""
+
+from Strangle import libbind
+
+# Header flag bits, for libbind.patch_message()
+QR = 0x8000
+AA = 0x0400
+TC = 0x0200
+RD = 0x0100
+RA = 0x0080
+AD = 0x0020
+CD = 0x0010
+
+def message(buffer, id=None, authoritative=None, truncated=None, recursionDesired=None,
+	    recursionAvailable=None, answer=None, authenticData=None, checkingDisabled=None,
+	    ttlDecrement=0, offset=0, length=None):
+    """Patch the message in a writable buffer
+
+    Flags given as True or False are set or cleared, and those left as None
+    are kept; answer is the QR bit, authenticData AD and checkingDisabled CD.
+    Every TTL (except those of OPT records) is decreased by ttlDecrement,
+    stopping at 0.  Returns the smallest TTL left, or None if the message has
+    no TTLs.  Raises ValueError, without changing anything, if the message is
+    malformed or ttlDecrement is negative."""
+    setFlags = clearFlags = 0
+    for value, bit in ((authoritative, AA), (truncated, TC), (recursionDesired, RD),
+		       (recursionAvailable, RA), (answer, QR), (authenticData, AD),
+		       (checkingDisabled, CD)):
+	if value is None:
+	    continue
+	elif value:
+	    setFlags |= bit
+	else:
+	    clearFlags |= bit
+
+    if id is None:
+	id = -1
+    if length is None:
+	length = -1
+
+    return libbind.patch_message(buffer, id, setFlags, clearFlags, ttlDecrement, offset, length)
+
+# vim: sts=4 sw=4 noet
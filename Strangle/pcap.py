@@ -0,0 +1,562 @@
+# pcap.py - Read DNS messages out of pcap and pcapng capture files
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Stream DNS messages out of classic pcap and pcapng capture files
+
+Everything here is a generator that reads the capture one packet at a time,
+so memory use does not depend on the size of the file.  The usual entry point
+is messages():
+
+    >>> from Strangle import pcap
+    >>> for timestamp, src, dst, msg in pcap.messages('capture.pcap'):
+    ...     print src, dst, msg.id
+
+src and dst are (address, port) tuples.  Ethernet (with any number of VLAN
+tags), Linux cooked, BSD loopback and raw IP link types are understood, over
+IPv4 and IPv6.  DNS over TCP is reassembled per connection and split on the
+2-byte length prefix.  IP fragments are skipped.
+"""
+
+import mmap
+import os
+import socket
+import struct
+from collections import OrderedDict
+
+import Strangle
+
+# Link layer types (see http://www.tcpdump.org/linktypes.html)
+LINKTYPE_NULL      = 0
+LINKTYPE_ETHERNET  = 1
+LINKTYPE_RAW       = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4      = 228
+LINKTYPE_IPV6      = 229
+
+# Raw IP in files written with the DLT_RAW value of the capturing system
+# rather than LINKTYPE_RAW: 12 on most systems, 14 on OpenBSD.
+LINKTYPE_DLT_RAW         = 12
+LINKTYPE_DLT_RAW_OPENBSD = 14
+
+# The largest captured length accepted in a pcap record, as in libpcap
+MAXIMUM_SNAPLEN = 262144
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+# Classic pcap magic numbers: (byte order, timestamp resolution)
+pcapMagics = { '\xd4\xc3\xb2\xa1' : ('<', 1e-6),
+	       '\xa1\xb2\xc3\xd4' : ('>', 1e-6),
+	       '\x4d\x3c\xb2\xa1' : ('<', 1e-9),
+	       '\xa1\xb2\x3c\x4d' : ('>', 1e-9),
+	     }
+
+class PcapError(Strangle.StrangleError):
+    """Error reading a capture file"""
+
+def frames(source, mapped=False):
+    """Generate (timestamp, linktype, data) for every packet in a pcap or pcapng file
+
+    source is a file name or a file-like object with a read() method.
+
+    With mapped=True the file is memory-mapped instead of read, and each data
+    item is a read-only buffer into the mapping rather than a copy of the bytes.
+    Strangle can parse those buffers directly.  source may then also be an
+    mmap object.  The mapping is closed when the last buffer into it is gone.
+    """
+    if mapped:
+	for frame in mappedFrames(source):
+	    yield frame
+	return
+
+    ownFile = getattr(source, 'read', None) is None
+    if ownFile:
+	source = open(source, 'rb')
+
+    try:
+	magic = source.read(4)
+	if len(magic) < 4:
+	    return
+
+	if magic == '\x0a\x0d\x0d\x0a':
+	    reader = pcapngFrames(source, magic)
+	else:
+	    reader = pcapFrames(source, magic)
+
+	for frame in reader:
+	    yield frame
+    finally:
+	if ownFile:
+	    source.close()
+
+def mappedFrames(source):
+    """Generate the frames of a pcap or pcapng file as buffers into a memory mapping"""
+    if type(source) is mmap.mmap:
+	mapping = source
+    else:
+	ownFile = getattr(source, 'fileno', None) is None
+	if ownFile:
+	    source = open(source, 'rb')
+
+	try:
+	    if os.fstat(source.fileno()).st_size < 4:
+		return
+	    mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+	    # The mapping stays valid after the file is closed.
+	    if ownFile:
+		source.close()
+
+    if mapping[0:4] == '\x0a\x0d\x0d\x0a':
+	reader = mappedPcapngFrames(mapping)
+    else:
+	reader = mappedPcapFrames(mapping)
+
+    for frame in reader:
+	yield frame
+
+def pcapFrames(source, magic):
+    """Generate the frames of a classic pcap file whose magic number has been read"""
+    try:
+	order, resolution = pcapMagics[magic]
+    except KeyError:
+	raise PcapError, "Not a pcap or pcapng file"
+
+    header = source.read(20)
+    if len(header) < 20:
+	raise PcapError, "Truncated pcap file header"
+    snaplen, linktype = struct.unpack(order + 'II', header[12:20])
+    linktype   &= 0x0fffffff
+    maxCaptured = max(snaplen, MAXIMUM_SNAPLEN)
+
+    recordHeader = struct.Struct(order + 'IIII')
+    while True:
+	header = source.read(16)
+	if len(header) < 16:
+	    return
+
+	seconds, fraction, capturedLength, originalLength = recordHeader.unpack(header)
+	if capturedLength > maxCaptured:
+	    raise PcapError, "Bad pcap record length %d" % capturedLength
+	data = source.read(capturedLength)
+	if len(data) < capturedLength:
+	    return
+
+	yield seconds + fraction * resolution, linktype, data
+
+def pcapngFrames(source, magic):
+    """Generate the frames of a pcapng file whose first block type has been read"""
+    order      = '<'
+    interfaces = []
+    blockType  = magic
+
+    while True:
+	if len(blockType) < 4:
+	    return
+
+	lengthData = source.read(4)
+	if len(lengthData) < 4:
+	    return
+
+	if blockType == '\x0a\x0d\x0d\x0a':
+	    # Section header: the byte order magic decides the order of everything else.
+	    byteOrder = source.read(4)
+	    if byteOrder == '\x4d\x3c\x2b\x1a':
+		order = '<'
+	    elif byteOrder == '\x1a\x2b\x3c\x4d':
+		order = '>'
+	    else:
+		raise PcapError, "Bad pcapng byte order magic"
+
+	    blockLength = struct.unpack(order + 'I', lengthData)[0]
+	    if blockLength < 16:
+		raise PcapError, "Bad pcapng section header"
+	    body        = byteOrder + source.read(blockLength - 16)
+	    interfaces  = []
+	else:
+	    blockLength = struct.unpack(order + 'I', lengthData)[0]
+	    if blockLength < 12:
+		raise PcapError, "Bad pcapng block length"
+	    body        = source.read(blockLength - 12)
+
+	if len(body) < blockLength - 12:
+	    return
+	source.read(4)      # The trailing copy of the block length
+
+	code = struct.unpack(order + 'I', blockType)[0]
+	checkPcapngBlock(code, len(body))
+	if code == 1:
+	    # Interface description
+	    linktype = struct.unpack(order + 'H', body[0:2])[0]
+	    interfaces.append((linktype, pcapngResolution(body[8:], order)))
+	elif code == 6:
+	    # Enhanced packet
+	    interface, high, low, capturedLength = struct.unpack(order + 'IIII', body[0:16])
+	    linktype, resolution = pcapngInterface(interfaces, interface)
+	    yield ((high << 32) | low) * resolution, linktype, body[20:20 + capturedLength]
+	elif code == 3:
+	    # Simple packet (no timestamp, always the first interface)
+	    linktype, resolution = pcapngInterface(interfaces, 0)
+	    originalLength = struct.unpack(order + 'I', body[0:4])[0]
+	    yield None, linktype, body[4:4 + originalLength]
+	elif code == 2:
+	    # Obsolete packet block
+	    interface, drops, high, low, capturedLength = struct.unpack(order + 'HHIII', body[0:16])
+	    linktype, resolution = pcapngInterface(interfaces, interface)
+	    yield ((high << 32) | low) * resolution, linktype, body[20:20 + capturedLength]
+
+	blockType = source.read(4)
+
+def mappedPcapFrames(mapping):
+    """Generate the frames of a memory-mapped classic pcap file"""
+    magic = mapping[0:4]
+    try:
+	order, resolution = pcapMagics[magic]
+    except KeyError:
+	raise PcapError, "Not a pcap or pcapng file"
+
+    if len(mapping) < 24:
+	raise PcapError, "Truncated pcap file header"
+    snaplen, linktype = struct.unpack_from(order + 'II', mapping, 16)
+    linktype   &= 0x0fffffff
+    maxCaptured = max(snaplen, MAXIMUM_SNAPLEN)
+
+    recordHeader = struct.Struct(order + 'IIII')
+    position = 24
+    end      = len(mapping)
+    while position + 16 <= end:
+	seconds, fraction, capturedLength, originalLength = recordHeader.unpack_from(mapping, position)
+	if capturedLength > maxCaptured:
+	    raise PcapError, "Bad pcap record length %d" % capturedLength
+	position += 16
+	if position + capturedLength > end:
+	    return
+
+	yield seconds + fraction * resolution, linktype, buffer(mapping, position, capturedLength)
+	position += capturedLength
+
+def mappedPcapngFrames(mapping):
+    """Generate the frames of a memory-mapped pcapng file"""
+    order      = '<'
+    interfaces = []
+    position   = 0
+    end        = len(mapping)
+
+    while position + 12 <= end:
+	if mapping[position:position + 4] == '\x0a\x0d\x0d\x0a':
+	    byteOrder = mapping[position + 8:position + 12]
+	    if byteOrder == '\x4d\x3c\x2b\x1a':
+		order = '<'
+	    elif byteOrder == '\x1a\x2b\x3c\x4d':
+		order = '>'
+	    else:
+		raise PcapError, "Bad pcapng byte order magic"
+	    interfaces = []
+
+	code, blockLength = struct.unpack_from(order + 'II', mapping, position)
+	if blockLength < 12:
+	    raise PcapError, "Bad pcapng block length"
+	if position + blockLength > end:
+	    return
+	checkPcapngBlock(code, blockLength - 12)
+	body = position + 8
+
+	if code == 1:
+	    # Interface description
+	    linktype = struct.unpack_from(order + 'H', mapping, body)[0]
+	    options  = mapping[body + 8:position + blockLength - 4]
+	    interfaces.append((linktype, pcapngResolution(options, order)))
+	elif code == 6:
+	    # Enhanced packet
+	    interface, high, low, capturedLength = struct.unpack_from(order + 'IIII', mapping, body)
+	    linktype, resolution = pcapngInterface(interfaces, interface)
+	    capturedLength = max(0, min(capturedLength, blockLength - 32))
+	    yield (((high << 32) | low) * resolution, linktype,
+		   buffer(mapping, body + 20, capturedLength))
+	elif code == 3:
+	    # Simple packet (no timestamp, always the first interface)
+	    linktype, resolution = pcapngInterface(interfaces, 0)
+	    originalLength = struct.unpack_from(order + 'I', mapping, body)[0]
+	    capturedLength = min(originalLength, blockLength - 16)
+	    yield None, linktype, buffer(mapping, body + 4, capturedLength)
+	elif code == 2:
+	    # Obsolete packet block
+	    interface, drops, high, low, capturedLength = struct.unpack_from(order + 'HHIII', mapping, body)
+	    linktype, resolution = pcapngInterface(interfaces, interface)
+	    capturedLength = max(0, min(capturedLength, blockLength - 32))
+	    yield (((high << 32) | low) * resolution, linktype,
+		   buffer(mapping, body + 20, capturedLength))
+
+	position += blockLength
+
+# The size of the fixed fields of the pcapng blocks which are read, by block type:
+# interface description, enhanced packet, simple packet and obsolete packet
+pcapngFixedSizes = { 1 : 8, 6 : 16, 3 : 4, 2 : 16 }
+
+def checkPcapngBlock(code, bodyLength):
+    """Raise PcapError if a pcapng block body is too short for its fixed fields"""
+    if bodyLength < pcapngFixedSizes.get(code, 0):
+	raise PcapError, "Truncated pcapng block of type %d" % code
+
+def pcapngInterface(interfaces, interface):
+    """Return the (linktype, resolution) of a pcapng interface, by its index"""
+    if interface >= len(interfaces):
+	raise PcapError, "A pcapng packet refers to the missing interface %d" % interface
+    return interfaces[interface]
+
+def pcapngResolution(options, order):
+    """Return the timestamp resolution from interface description block options"""
+    position = 0
+    while position + 4 <= len(options):
+	code, length = struct.unpack(order + 'HH', options[position:position + 4])
+	if code == 0:
+	    break
+	if code == 9 and length >= 1:
+	    value = ord(options[position + 4])
+	    if value & 0x80:
+		return 2.0 ** -(value & 0x7f)
+	    return 10.0 ** -value
+	position += 4 + ((length + 3) & ~3)
+
+    return 1e-6
+
+def ipPacket(linktype, data):
+    """Return the offset of the IP packet in a link layer frame, or None if it does not carry IP"""
+    if linktype == LINKTYPE_ETHERNET:
+	if len(data) < 14:
+	    return None
+	etherType = struct.unpack_from('!H', data, 12)[0]
+	position  = 14
+	while etherType in ETHERTYPE_VLAN:
+	    if len(data) < position + 4:
+		return None
+	    etherType = struct.unpack_from('!H', data, position + 2)[0]
+	    position += 4
+	if etherType not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+	    return None
+	return position
+    elif linktype == LINKTYPE_LINUX_SLL:
+	if len(data) < 16:
+	    return None
+	if struct.unpack_from('!H', data, 14)[0] not in (ETHERTYPE_IPV4, ETHERTYPE_IPV6):
+	    return None
+	return 16
+    elif linktype == LINKTYPE_NULL:
+	# The address family is in the byte order of the machine which captured it.
+	return 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6, LINKTYPE_DLT_RAW,
+		      LINKTYPE_DLT_RAW_OPENBSD):
+	return 0
+
+    return None
+
+def transport(data, start):
+    """Return (protocol, srcAddress, dstAddress, segmentStart, segmentEnd) for an IP packet
+
+    The IP packet begins at offset start of data, and the offsets returned are
+    also into data.  Returns None for anything which is not the first fragment
+    of an unfragmented IPv4 or IPv6 packet.
+    """
+    if len(data) < start + 20:
+	return None
+
+    version = ord(data[start]) >> 4
+    if version == 4:
+	headerLength = (ord(data[start]) & 0x0f) * 4
+	totalLength, fragment = struct.unpack_from('!H2xH', data, start + 2)
+	if fragment & 0x3fff:
+	    # More fragments, or not the first one
+	    return None
+	return (ord(data[start + 9]),
+		socket.inet_ntoa(data[start + 12:start + 16]),
+		socket.inet_ntoa(data[start + 16:start + 20]),
+		start + headerLength, min(start + totalLength, len(data)))
+    elif version == 6 and len(data) >= start + 40:
+	payloadLength = struct.unpack_from('!H', data, start + 4)[0]
+	nextHeader    = ord(data[start + 6])
+	src = socket.inet_ntop(socket.AF_INET6, data[start + 8:start + 24])
+	dst = socket.inet_ntop(socket.AF_INET6, data[start + 24:start + 40])
+	position = start + 40
+	end      = min(position + payloadLength, len(data))
+
+	# Skip extension headers: hop-by-hop, routing, destination options, AH.
+	while nextHeader in (0, 43, 60, 51) and end - position >= 8:
+	    if nextHeader == 51:
+		headerLength = (ord(data[position + 1]) + 2) * 4
+	    else:
+		headerLength = (ord(data[position + 1]) + 1) * 8
+	    nextHeader = ord(data[position])
+	    position  += headerLength
+
+	if nextHeader == 44:
+	    # Fragment
+	    return None
+	return nextHeader, src, dst, position, end
+
+    return None
+
+def piece(data, start, end):
+    """Return data[start:end], without copying if data is a buffer into a mapped file"""
+    if type(data) is buffer:
+	return buffer(data, start, end - start)
+    return data[start:end]
+
+class TCPStreams(object):
+    """Reassembles DNS messages from TCP segments
+
+    Each direction of a connection is kept separately and in sequence order, and
+    complete length-prefixed messages are handed back as they appear.  At most
+    maxStreams connections are tracked; when there are more, the oldest is
+    dropped.
+    """
+
+    maxMessage = 65537
+
+    def __init__(self, maxStreams=4096):
+	self.maxStreams = maxStreams
+	self.streams    = OrderedDict()
+
+    def add(self, key, segment):
+	"""Add a TCP segment; return a list of the complete DNS messages it finishes"""
+	if len(segment) < 20:
+	    return []
+
+	sequence, offset, flags = struct.unpack('!4xI4xBB', segment[0:14])
+	payload = segment[(offset >> 4) * 4:]
+
+	if flags & 0x02:
+	    # SYN: a new connection; the data starts after the SYN's sequence number.
+	    self.start(key, (sequence + 1) & 0xffffffff)
+	    return []
+
+	messages = []
+	if payload:
+	    messages = self.append(key, sequence, payload)
+
+	if flags & 0x05:
+	    # FIN or RST: this direction is finished, after the data the segment carries.
+	    self.streams.pop(key, None)
+	return messages
+
+    def append(self, key, sequence, payload):
+	"""Add the payload of a segment to its stream; return the complete DNS messages"""
+	stream = self.streams.get(key)
+	if stream is None:
+	    # Picked up in the middle; hope the segment starts a message.
+	    stream = self.start(key, sequence)
+
+	gap = (sequence - stream[0]) & 0xffffffff
+	if gap >= 0x80000000:
+	    # Retransmission of data already seen, maybe with some new data.
+	    overlap = 0x100000000 - gap
+	    if overlap >= len(payload):
+		return []
+	    payload = payload[overlap:]
+	    gap     = 0
+	elif gap:
+	    # Missing data; start over from here.
+	    stream[1] = ''
+
+	stream[0]  = (stream[0] + gap + len(payload)) & 0xffffffff
+	stream[1] += payload
+
+	messages = []
+	buffer   = stream[1]
+	while len(buffer) >= 2:
+	    length = struct.unpack('!H', buffer[0:2])[0]
+	    if len(buffer) < length + 2:
+		break
+	    messages.append(buffer[2:length + 2])
+	    buffer = buffer[length + 2:]
+
+	if len(buffer) > self.maxMessage:
+	    buffer = ''
+	stream[1] = buffer
+	return messages
+
+    def start(self, key, sequence):
+	"""Begin tracking a stream, dropping the oldest one if there are too many"""
+	self.streams.pop(key, None)
+	while len(self.streams) >= self.maxStreams:
+	    self.streams.popitem(last=False)
+
+	stream = [sequence, '']
+	self.streams[key] = stream
+	return stream
+
+def payloads(source, ports=(53,), tcp=True, mapped=False):
+    """Generate (timestamp, src, dst, dnsPayload) for the DNS packets in a capture
+
+    Only UDP and TCP traffic to or from one of the given ports is used.  Pass
+    ports=None to treat everything as DNS.  With mapped=True (see frames()),
+    UDP payloads are buffers into the mapped file rather than strings.
+    """
+    streams = TCPStreams()
+
+    for timestamp, linktype, data in frames(source, mapped):
+	start = ipPacket(linktype, data)
+	if start is None:
+	    continue
+
+	segment = transport(data, start)
+	if segment is None:
+	    continue
+	protocol, srcAddress, dstAddress, start, end = segment
+
+	if protocol == IPPROTO_UDP or (protocol == IPPROTO_TCP and tcp):
+	    if end - start < 8:
+		continue
+	    srcPort, dstPort = struct.unpack_from('!HH', data, start)
+	    if ports is not None and srcPort not in ports and dstPort not in ports:
+		continue
+	else:
+	    continue
+
+	src = (srcAddress, srcPort)
+	dst = (dstAddress, dstPort)
+
+	if protocol == IPPROTO_UDP:
+	    yield timestamp, src, dst, piece(data, start + 8, end)
+	else:
+	    for message in streams.add((src, dst), data[start:end]):
+		yield timestamp, src, dst, message
+
+def messages(source, ports=(53,), tcp=True, lazy=False, mapped=False, filter=None):
+    """Generate (timestamp, src, dst, DNSMessage) for the DNS messages in a capture
+
+    Payloads which libbind cannot parse are skipped, and so are those which do
+    not match filter (a Strangle.Filter), if it is given, without being parsed.
+    See payloads() for the ports, tcp and mapped arguments, and DNSMessage for
+    lazy.
+    """
+    for timestamp, src, dst, payload in payloads(source, ports, tcp, mapped):
+	if filter is not None and not filter.match(payload):
+	    continue
+
+	try:
+	    msg = Strangle.DNSMessage(payload, lazy=lazy)
+	except Strangle.StrangleError:
+	    continue
+
+	yield timestamp, src, dst, msg
+
+# vim: sts=4 sw=4 noet
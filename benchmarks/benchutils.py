@@ -0,0 +1,28 @@
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+# Should be imported for benchmarking, like test/testutils.py for testing
+import sys, os
+import glob
+
+here    = os.path.dirname(os.path.abspath(__file__))
+baseDir = glob.glob(os.path.join(here, '..', 'build', 'lib*'))
+if not baseDir:
+    sys.stderr.write("Cannot find build directory.  Try running 'setup.py build' first.\n")
+    sys.exit(1)
+
+if baseDir[0] not in sys.path:
+    sys.path.insert(0, baseDir[0])
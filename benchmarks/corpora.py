@@ -0,0 +1,159 @@
+# corpora.py - Synthetic DNS traffic for the benchmarks
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Generate reproducible corpora of DNS messages
+
+Every corpus is a list of packet strings built with Strangle.build from a
+random.Random seeded by the caller, so the same seed always gives the same
+bytes and results can be compared between releases.
+
+    queries     - single-question queries, as most captured traffic is
+    referrals   - large delegation responses: 13 NS records and their glue
+    compression - answers with long CNAME chains and MX/SRV sets, whose
+		  names share suffixes and so are mostly compression pointers
+    malformed   - a mix of the above, three in four of them damaged by
+		  truncation, flipped bytes or compression pointer loops
+"""
+
+import random
+
+import benchutils
+from Strangle import libbind, build
+
+IN = 1
+
+labels = ('www', 'mail', 'api', 'cdn', 'static', 'login', 'shop', 'news', 'img',
+	  'm', 'dev', 'blog', 'a1', 'edge', 'ns', 'mx', 'vpn', 'git', 'docs', 'app')
+domains = ('example', 'company', 'university', 'provider', 'shop', 'media',
+	   'cloudhost', 'bank', 'search', 'social')
+tlds = ('com', 'net', 'org', 'example', 'test', 'io', 'de', 'uk')
+
+queryTypes = ((libbind.ns_t_a, 60), (libbind.ns_t_aaaa, 25), (libbind.ns_t_mx, 4),
+	      (libbind.ns_t_txt, 4), (libbind.ns_t_ptr, 3), (libbind.ns_t_srv, 2),
+	      (libbind.ns_t_any, 2))
+
+def weighted(rng, choices):
+    """Pick from (value, weight) pairs"""
+    total = sum([weight for value, weight in choices])
+    point = rng.randrange(total)
+    for value, weight in choices:
+	if point < weight:
+	    return value
+	point -= weight
+
+def hostName(rng, depth=None):
+    """A random host name under one of a few domains"""
+    if depth is None:
+	depth = rng.randint(1, 3)
+    parts = [rng.choice(labels) for i in range(depth)]
+    return '.'.join(parts + [rng.choice(domains), rng.choice(tlds)])
+
+def ipv4(rng):
+    return '%d.%d.%d.%d' % (rng.randint(1, 223), rng.randrange(256), rng.randrange(256), rng.randint(1, 254))
+
+def ipv6(rng):
+    return '2001:db8:%x:%x::%x' % (rng.randrange(65536), rng.randrange(65536), rng.randint(1, 65535))
+
+def queries(rng, count):
+    """Single-question queries with a realistic type mix"""
+    return [build.query(hostName(rng), weighted(rng, queryTypes), id=rng.randrange(65536))
+	    for i in xrange(count)]
+
+def referral(rng):
+    """A delegation from a TLD server: no answer, NS records and glue"""
+    zone = '%s.%s' % (rng.choice(domains), rng.choice(tlds))
+    qname = '%s.%s' % (rng.choice(labels), zone)
+    servers = ['%s%d.%s' % (rng.choice(('ns', 'dns', 'a', 'b')), index, zone) for index in range(13)]
+
+    authority = [(zone, libbind.ns_t_ns, IN, 172800, None, server) for server in servers]
+    additional = []
+    for server in servers:
+	additional.append((server, libbind.ns_t_a, IN, 172800, None, ipv4(rng)))
+	additional.append((server, libbind.ns_t_aaaa, IN, 172800, None, ipv6(rng)))
+
+    flags = 0x8000 | (rng.random() < 0.5 and 0x0100 or 0)
+    return libbind.build_message(rng.randrange(65536), flags,
+				 (((qname, libbind.ns_t_a, IN),), (), authority, additional))
+
+def referrals(rng, count):
+    return [referral(rng) for i in xrange(count)]
+
+def compressed(rng):
+    """An answer full of names sharing long suffixes"""
+    zone = 'service.%s.%s' % (rng.choice(domains), rng.choice(tlds))
+    qname = 'www.%s' % zone
+    answers = []
+
+    # A CNAME chain through the zone
+    owner = qname
+    for index in range(rng.randint(2, 6)):
+	target = '%s%d.edge.%s' % (rng.choice(labels), index, zone)
+	answers.append((owner, libbind.ns_t_cname, IN, 300, None, target))
+	owner = target
+    for index in range(rng.randint(1, 4)):
+	answers.append((owner, libbind.ns_t_a, IN, 60, None, ipv4(rng)))
+
+    authority = [(zone, libbind.ns_t_mx, IN, 3600, None, (10 * index, 'mx%d.%s' % (index, zone)))
+		 for index in range(rng.randint(2, 5))]
+    authority.append((zone, libbind.ns_t_soa, IN, 3600, None,
+		      ('ns1.%s' % zone, 'hostmaster.%s' % zone, rng.randrange(2 ** 31), 7200, 900, 1209600, 300)))
+    additional = [('_sip._udp.%s' % zone, libbind.ns_t_srv, IN, 600, None,
+		   (index, 5, 5060, 'sip%d.%s' % (index, zone))) for index in range(rng.randint(1, 4))]
+
+    return libbind.build_message(rng.randrange(65536), 0x8180,
+				 (((qname, libbind.ns_t_a, IN),), answers, authority, additional))
+
+def compression(rng, count):
+    return [compressed(rng) for i in xrange(count)]
+
+def damage(rng, packet):
+    """Break a packet in one of a few ways parsers get wrong"""
+    how = rng.randrange(3)
+    if how == 0:
+	return packet[:rng.randrange(len(packet))]
+    elif how == 1:
+	data = bytearray(packet)
+	for flip in range(rng.randint(1, 8)):
+	    data[rng.randrange(len(data))] = rng.randrange(256)
+	return str(data)
+    else:
+	# Point the first name after the header at itself
+	return packet[:12] + '\xc0\x0c' + packet[14:]
+
+def malformed(rng, count):
+    packets = []
+    for i in xrange(count):
+	packet = rng.choice((queries, referrals, compression))(rng, 1)[0]
+	if rng.random() < 0.75:
+	    packet = damage(rng, packet)
+	packets.append(packet)
+    return packets
+
+# Corpus generators, by name
+corpora = { 'queries'     : queries,
+	    'referrals'   : referrals,
+	    'compression' : compression,
+	    'malformed'   : malformed,
+	  }
+
+def generate(name, count, seed=1):
+    """Return the packets of a corpus; the same seed gives the same packets"""
+    rng = random.Random(seed * 100 + sorted(corpora.keys()).index(name))
+    return corpora[name](rng, count)
+
+# vim: sts=4 sw=4 noet
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+"""Measure the parsers over synthetic corpora
+
+Every benchmark is run over every corpus (see corpora.py), each pair in a
+forked process so that its peak RSS is its own.  For each pair this reports:
+
+    packetsPerSecond  - packets parsed per second, best of the repeats
+    nsPerRecord       - nanoseconds per record in the corpus
+    objectsPerPacket  - garbage-collected objects still alive per packet
+			while the results are kept (Python 2 has no
+			allocation counter, so this stands in for one)
+    peakRSS           - peak resident set size of the process, in kB
+
+Results are printed as a table, or written as JSON with --json, and can be
+compared against an earlier JSON file with --compare:
+
+    python runBenchmarks.py --json before.json
+    ... change things, rebuild ...
+    python runBenchmarks.py --compare before.json
+"""
+
+import gc
+import os
+import resource
+import sys
+import timeit
+import traceback
+from optparse import OptionParser
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import benchutils
+import corpora
+
+import Strangle
+from Strangle import libbind, columnar
+
+def recordCount(packets):
+    """The number of records in the packets which parse"""
+    results, errors = libbind.parse_many(packets)
+    return sum([len(section) for parsed in results if parsed is not None for section in parsed[2]])
+
+# Each benchmark takes a list of packets and returns what it built, so that
+# what stays alive can be counted.
+
+def benchDNSMessage(packets):
+    messages = []
+    for packet in packets:
+	try:
+	    messages.append(Strangle.DNSMessage(packet))
+	except Strangle.StrangleError:
+	    pass
+    return messages
+
+def benchLazy(packets):
+    """Lazy messages of which only the header is looked at"""
+    messages = []
+    for packet in packets:
+	try:
+	    msg = Strangle.DNSMessage(packet, lazy=True)
+	except Strangle.StrangleError:
+	    continue
+	msg.flags.response
+	messages.append(msg)
+    return messages
+
+def benchParseMessage(packets):
+    results = []
+    for packet in packets:
+	try:
+	    results.append(libbind.parse_message(packet))
+	except TypeError:
+	    pass
+    return results
+
+def benchNsRR(packets):
+    """The C-style API: an ns_rr and its fields for every record"""
+    results = []
+    for packet in packets:
+	try:
+	    msg = libbind.ns_msg(packet)
+	except TypeError:
+	    continue
+	for section in (libbind.ns_s_qd, libbind.ns_s_an, libbind.ns_s_ns, libbind.ns_s_ar):
+	    for index in range(libbind.ns_msg_count(msg, section)):
+		try:
+		    rr = libbind.ns_rr(msg, section, index)
+		except TypeError:
+		    break
+		results.append((libbind.ns_rr_name(rr), libbind.ns_rr_type(rr),
+				libbind.ns_rr_class(rr), libbind.ns_rr_ttl(rr)))
+    return results
+
+def benchNsRRGetters(packets):
+    """The same walk with the ns_msg methods and ns_rr getters"""
+    results = []
+    for packet in packets:
+	try:
+	    msg = libbind.ns_msg(packet)
+	except TypeError:
+	    continue
+	for section in (libbind.ns_s_qd, libbind.ns_s_an, libbind.ns_s_ns, libbind.ns_s_ar):
+	    for index in range(msg.count(section)):
+		try:
+		    rr = libbind.ns_rr(msg, section, index)
+		except TypeError:
+		    break
+		results.append((rr.name, rr.type, rr.queryClass, rr.ttl))
+    return results
+
+def benchIterRecords(packets):
+    """The same fields from ns_msg.iter_records(), with no section lists"""
+    results = []
+    for packet in packets:
+	try:
+	    msg = libbind.ns_msg(packet)
+	except TypeError:
+	    continue
+	try:
+	    for rr in msg.iter_records():
+		results.append((rr.name, rr.type, rr.queryClass, rr.ttl))
+	except TypeError:
+	    pass
+    return results
+
+def benchParseMany(packets):
+    return libbind.parse_many(packets)
+
+def benchRecordBatch(packets):
+    return columnar.RecordBatch(packets)
+
+def benchHeaderBatch(packets):
+    return columnar.HeaderBatch.fromPackets(packets)
+
+def benchParseQuestion(packets):
+    results = []
+    for packet in packets:
+	try:
+	    results.append(libbind.parse_question(packet))
+	except TypeError:
+	    pass
+    return results
+
+nxdomainFilter = Strangle.Filter("rcode=NXDOMAIN or qtype=ANY")
+
+def benchFilterSelect(packets):
+    return nxdomainFilter.select(packets)
+
+# Benchmark functions, by name, in the order they are run
+benchmarks = (('DNSMessage'     , benchDNSMessage),
+	      ('DNSMessage-lazy', benchLazy),
+	      ('parse_message'  , benchParseMessage),
+	      ('ns_rr'          , benchNsRR),
+	      ('ns_rr-getters'  , benchNsRRGetters),
+	      ('iter_records'   , benchIterRecords),
+	      ('parse_many'     , benchParseMany),
+	      ('RecordBatch'    , benchRecordBatch),
+	      ('HeaderBatch'    , benchHeaderBatch),
+	      ('parse_question' , benchParseQuestion),
+	      ('Filter.select'  , benchFilterSelect),
+	     )
+
+def measure(function, packets, records, repeat):
+    """Return the measurements of one benchmark over one corpus"""
+    timer = timeit.Timer(lambda: function(packets))
+    best = min(timer.repeat(repeat, 1))
+
+    gc.collect()
+    before = len(gc.get_objects())
+    kept = function(packets)
+    gc.collect()
+    objects = len(gc.get_objects()) - before
+    del kept
+
+    return { 'packetsPerSecond' : len(packets) / best,
+	     'nsPerRecord'      : records and best * 1e9 / records or None,
+	     'objectsPerPacket' : float(objects) / len(packets),
+	     'peakRSS'          : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	   }
+
+def isolated(function, *args):
+    """Run function in a forked process and return its (JSON-able) result"""
+    if not hasattr(os, 'fork'):
+	return function(*args)
+
+    readEnd, writeEnd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+	os.close(readEnd)
+	try:
+	    try:
+		os.write(writeEnd, json.dumps(function(*args)))
+	    except:
+		traceback.print_exc()
+	finally:
+	    os._exit(0)
+
+    os.close(writeEnd)
+    data = []
+    while True:
+	chunk = os.read(readEnd, 65536)
+	if not chunk:
+	    break
+	data.append(chunk)
+    os.close(readEnd)
+    os.waitpid(pid, 0)
+
+    if not data:
+	raise RuntimeError, "The benchmark process failed"
+    return json.loads(''.join(data))
+
+def run(corpusNames, benchmarkNames, count, seed, repeat, report=None):
+    """Return {corpus: {benchmark: measurements}}"""
+    results = {}
+    for corpusName in corpusNames:
+	packets = corpora.generate(corpusName, count, seed)
+	records = recordCount(packets)
+	results[corpusName] = {}
+	for name, function in benchmarks:
+	    if name not in benchmarkNames:
+		continue
+	    result = isolated(measure, function, packets, records, repeat)
+	    results[corpusName][name] = result
+	    if report is not None:
+		report(corpusName, name, result)
+    return results
+
+def printResult(corpusName, name, result):
+    nsPerRecord = result['nsPerRecord']
+    if nsPerRecord is None:
+	nsPerRecord = '-'
+    else:
+	nsPerRecord = '%.0f' % nsPerRecord
+    print '%-12s %-16s %12.0f %10s %10.1f %10d' % (corpusName, name, result['packetsPerSecond'],
+						   nsPerRecord, result['objectsPerPacket'], result['peakRSS'])
+    sys.stdout.flush()
+
+def compare(results, baseline, tolerance):
+    """Print the change in packets/s against a baseline; return the regressions"""
+    regressions = []
+    print
+    print '%-12s %-16s %12s %12s %8s' % ('corpus', 'benchmark', 'before', 'after', 'change')
+    for corpusName in sorted(results):
+	for name in sorted(results[corpusName]):
+	    try:
+		before = baseline['results'][corpusName][name]['packetsPerSecond']
+	    except KeyError:
+		continue
+	    after = results[corpusName][name]['packetsPerSecond']
+	    change = after / before - 1
+	    print '%-12s %-16s %12.0f %12.0f %+7.1f%%' % (corpusName, name, before, after, change * 100)
+	    if change < -tolerance:
+		regressions.append((corpusName, name, change))
+    return regressions
+
+def main(argv):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--packets', type='int', default=10000,
+		      help="packets in each corpus (default %default)")
+    parser.add_option('-s', '--seed', type='int', default=1,
+		      help="corpus seed (default %default)")
+    parser.add_option('-r', '--repeat', type='int', default=3,
+		      help="timing runs per benchmark; the best counts (default %default)")
+    parser.add_option('-c', '--corpus', action='append',
+		      help="corpus to run (repeatable; default all of %s)" % ', '.join(sorted(corpora.corpora)))
+    parser.add_option('-b', '--benchmark', action='append',
+		      help="benchmark to run (repeatable; default all of %s)" %
+			   ', '.join([name for name, function in benchmarks]))
+    parser.add_option('-j', '--json', metavar='FILE',
+		      help="write the results as JSON to FILE ('-' for standard output)")
+    parser.add_option('--compare', metavar='FILE',
+		      help="compare packets/s with the JSON results in FILE")
+    parser.add_option('--tolerance', type='float', default=0.1,
+		      help="slowdown which counts as a regression in --compare (default %default)")
+    options, args = parser.parse_args(argv)
+
+    corpusNames = options.corpus or sorted(corpora.corpora)
+    benchmarkNames = options.benchmark or [name for name, function in benchmarks]
+    for name in corpusNames:
+	if name not in corpora.corpora:
+	    parser.error("unknown corpus %s" % name)
+    for name in benchmarkNames:
+	if name not in dict(benchmarks):
+	    parser.error("unknown benchmark %s" % name)
+
+    report = printResult
+    if options.json == '-':
+	report = None
+    else:
+	print '%-12s %-16s %12s %10s %10s %10s' % ('corpus', 'benchmark', 'packets/s', 'ns/record',
+						   'objects/pkt', 'peak kB')
+
+    results = run(corpusNames, benchmarkNames, options.packets, options.seed, options.repeat, report)
+    output = { 'packets' : options.packets,
+	       'seed'    : options.seed,
+	       'python'  : sys.version.split()[0],
+	       'results' : results,
+	     }
+
+    if options.json == '-':
+	print json.dumps(output, indent=1, sort_keys=True)
+    elif options.json:
+	f = open(options.json, 'w')
+	json.dump(output, f, indent=1, sort_keys=True)
+	f.close()
+
+    if options.compare:
+	f = open(options.compare)
+	baseline = json.load(f)
+	f.close()
+	if baseline.get('packets') != options.packets or baseline.get('seed') != options.seed:
+	    sys.stderr.write("Warning: the baseline was run on a different corpus\n")
+	if compare(results, baseline, options.tolerance):
+	    return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -34,6 +34,27 @@ fullSuite.addTest(testlibbind.suite())
 import testStrangle
 fullSuite.addTest(testStrangle.suite())
 
+import testparallel
+fullSuite.addTest(testparallel.suite())
+
+import testpcap
+fullSuite.addTest(testpcap.suite())
+
+import testaio
+fullSuite.addTest(testaio.suite())
+
+import testcolumnar
+fullSuite.addTest(testcolumnar.suite())
+
+import testcache
+fullSuite.addTest(testcache.suite())
+
+import testbuild
+fullSuite.addTest(testbuild.suite())
+
+import testpatch
+fullSuite.addTest(testpatch.suite())
+
 if __name__ == "__main__":
     runner = unittest.TextTestRunner()
     runner.verbosity = 2
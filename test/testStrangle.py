@@ -20,6 +20,8 @@
 
 import sys, testutils
 import unittest
+import struct
+import pickle
 
 import Strangle
 
@@ -74,6 +76,91 @@ class testDNSMessage(unittest.TestCase):
 	    msg = Strangle.DNSMessage(message['data'])
 	    self.assertEquals(msg.id, message['id'])
 
+    def testLazy(self):
+	"""Test whether a lazy DNSMessage decodes the same as an eager one"""
+	for message in self.queries + self.responses:
+	    lazy  = Strangle.DNSMessage(message['data'], lazy=True)
+	    eager = Strangle.DNSMessage(message['data'])
+	    self.assertEquals(lazy.id, eager.id)
+	    self.assertEquals(lazy.flags.type, eager.flags.type)
+	    self.assertEquals(str(lazy), str(eager))
+	    assert lazy.sections is lazy.sections
+
+    def testBuffer(self):
+	"""Test whether a DNSMessage can be made from a buffer, and pickled"""
+	import pickle
+
+	for message in self.queries + self.responses:
+	    expected = str(Strangle.DNSMessage(message['data']))
+	    for packet in (bytearray(message['data']), buffer('xx' + message['data'], 2)):
+		for lazy in (False, True):
+		    msg = Strangle.DNSMessage(packet, lazy=lazy)
+		    self.assertEquals(str(msg), expected)
+		    copy = pickle.loads(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+		    self.assertEquals(copy.packetData, message['data'])
+		    self.assertEquals(str(copy), expected)
+
+    def testIterRecords(self):
+	"""Test whether iter_records yields the records of the sections, filtered by type"""
+	for message in self.queries + self.responses:
+	    for lazy in (False, True):
+		msg = Strangle.DNSMessage(message['data'], lazy=lazy)
+		for sectionName in ('question', 'answer', 'authority', 'additional'):
+		    expected = []
+		    if sectionName in msg.sections:
+			expected = [(record.name, record.type, record.ttl)
+				    for record in msg.sections[sectionName].records]
+		    records = [(rr.name, Strangle.typeNames.get(rr.type, 'Unknown'), rr.ttl)
+			       for rr in msg.iter_records(sectionName)]
+		    self.assertEquals(records, expected)
+
+	msg = Strangle.DNSMessage(self.responses[2]['data'])
+	self.assertEquals(len(list(msg.iter_records())),
+			  sum([len(section.records) for section in msg.sections.values()]))
+	names = [rr.name for rr in msg.iter_records(types=('NS', Strangle.libbind.ns_t_a))]
+	self.assertEquals(names, ['oreilly.com'] * 3 + [record.name for record in msg.sections['additional'].records])
+	self.assertEquals(list(msg.iter_records('question', types=['A'])), [])
+
+	# Bad arguments are refused by the call, not on the first next()
+	self.assertRaises(Strangle.DNSSectionError, msg.iter_records, 'no such section')
+	self.assertRaises(Strangle.DNSRecordError, msg.iter_records, types=['NOPE'])
+	self.assertRaises(Strangle.DNSRecordError, msg.iter_records, types=[65536])
+
+	# An owner name pointing past the end passes ns_initparse() but not ns_parserr()
+	header = struct.pack('!HHHHHH', 1, 0x8000, 0, 1, 0, 0)
+	msg = Strangle.DNSMessage(header + '\xc0\x7f' + struct.pack('!HHIH', 1, 1, 0, 4) + '\0' * 4,
+				  lazy=True)
+	self.assertRaises(Strangle.DNSRecordError, list, msg.iter_records())
+
+class testEDNS(unittest.TestCase):
+    """Tests the EDNS object of a message"""
+    def setUp(self):
+	# A query for example.com with an OPT record carrying ECS and a cookie
+	options = (struct.pack('!HHHBB', 8, 7, 1, 24, 0) + '\xc6\x33\x64' +
+		   struct.pack('!HH', 10, 24) + 'clientck' + 'servercookie1234')
+	self.packet = (struct.pack('!HHHHHH', 4242, 0x0100, 1, 0, 0, 1) +
+		       '\x07example\x03com\x00' + struct.pack('!HH', 1, 1) +
+		       '\x00' + struct.pack('!HHIH', 41, 1232, 0x00008000, len(options)) + options)
+
+    def testEDNS(self):
+	"""Test whether the OPT record is decoded, lazily or not"""
+	for lazy in (False, True):
+	    msg = Strangle.DNSMessage(self.packet, lazy=lazy)
+	    edns = msg.edns
+	    self.assertEquals(edns.payloadSize, 1232)
+	    self.assertEquals(edns.dnssecOK, True)
+	    self.assertEquals(edns.version, 0)
+	    self.assertEquals(edns.clientSubnet, (1, 24, 0, '198.51.100.0'))
+	    self.assertEquals(edns.cookie, ('clientck', 'servercookie1234'))
+	    self.assertEquals(edns.padding, None)
+	    self.assertEquals(edns.rcode(msg.flags), 0)
+	    self.assertEquals(msg.sections['additional'].records[0].type, 'OPT')
+
+    def testNoEDNS(self):
+	"""Test whether a message without an OPT record has no EDNS"""
+	for message in testutils.queries + testutils.responses:
+	    self.assertEquals(Strangle.DNSMessage(message['data']).edns, None)
+
 class testDNSFlags(unittest.TestCase):
     """Tests all interfaces to the DNSFlags object"""
     def setUp(self):
@@ -375,18 +462,237 @@ class testDNSRecord(unittest.TestCase):
 	rr = DNSRecord(msg, 'additional', 4)
 	self.assertEquals(rr.data, '208.201.224.33')
 
+    def testLazy(self):
+	"""Test whether a lazy DNSRecord decodes its members on access"""
+	from Strangle import DNSRecord
+
+	msg = Strangle.libbind.ns_msg(file('data/oreilly.com-response').read())
+	rr = DNSRecord(msg, 'answer', 1, lazy=True)
+	self.assertEquals(rr.type, 'MX')
+	self.assertEquals(rr.data, '20 smtp2.oreilly.com')
+	self.assertEquals(rr.ttl, 3600)
+	self.assertRaises(AttributeError, getattr, rr, 'noSuchMember')
+
+    def testSlots(self):
+	"""Test whether the message classes have no per-instance dict"""
+	msg = Strangle.DNSMessage(file('data/oreilly.com-response').read())
+	record = msg.sections['answer'].records[0]
+	for obj in (msg, msg.flags, msg.sections['answer'], record):
+	    assert not hasattr(obj, '__dict__')
+	self.assertRaises(AttributeError, setattr, record, 'noSuchMember', 1)
+
+	lazy = Strangle.DNSMessage(file('data/oreilly.com-response').read(), lazy=True)
+	self.assertEquals(str(lazy), str(msg))
+
+    def testUnknownClass(self):
+	"""Test whether records of the same unknown class share one class name"""
+	from Strangle import DNSRecord
+
+	parsed = ("example.com", Strangle.libbind.ns_t_a, 23, 0, None, None)
+	first  = DNSRecord(None, 'question', 0, parsed=parsed)
+	second = DNSRecord(None, 'question', 0, parsed=parsed)
+	self.assertEquals(first.queryClass, 'Unknown (23)')
+	assert first.queryClass is second.queryClass
+
+    def testTypedData(self):
+	"""Test whether newer record types get structured data, and old ones keep theirs"""
+	from Strangle import DNSRecord
+
+	target = '\x03sip\x07example\x03com\x00'
+	srv = ("_sip._udp.example.com", Strangle.libbind.ns_t_srv, 1, 60,
+	       struct.pack('!HHH', 1, 5, 5060) + target, None)
+	record = DNSRecord(None, 'answer', 0, parsed=srv)
+	self.assertEquals(record.type, 'SRV')
+	self.assertEquals(record.data, (1, 5, 5060, 'sip.example.com'))
+	assert record.value is record.data
+	self.assertEquals(record.rdata, srv[4])
+
+	aaaa = ("example.com", Strangle.libbind.ns_t_aaaa, 1, 60, '\0' * 15 + '\x01', None)
+	self.assertEquals(DNSRecord(None, 'answer', 0, parsed=aaaa, lazy=True).data, '::1')
+
+	broken = aaaa[:4] + ('\0' * 3, None)
+	self.assertEquals(DNSRecord(None, 'answer', 0, parsed=broken).data, '\0' * 3)
+
+	msg = Strangle.DNSMessage(testutils.responses[2]['data'])
+	mx = msg.sections['answer'].records[0]
+	self.assertEquals(mx.data, '20 smtp1.oreilly.com')
+	self.assertEquals(mx.value, (20, 'smtp1.oreilly.com'))
+
     def testDynamicUpdate(self):
-        """Test that dynamic updates parse properly."""
-        msg = Strangle.libbind.ns_msg(file('data/dynamic-update').read())
-        rr = Strangle.DNSRecord(msg, 'answer', 0)
-        self.assertEquals(rr.data, "")
+	"""Test that dynamic updates parse properly."""
+	msg = Strangle.libbind.ns_msg(file('data/dynamic-update').read())
+	rr = Strangle.DNSRecord(msg, 'answer', 0)
+	self.assertEquals(rr.data, "")
+
+class testParseQuestion(unittest.TestCase):
+    """Tests the parse_question fast path"""
+    def testQuestion(self):
+	"""Test whether parse_question agrees with DNSMessage"""
+	for message in testutils.queries + testutils.responses:
+	    msg = Strangle.DNSMessage(message['data'])
+	    messageId, flags, qname, qtype, qclass = Strangle.parse_question(message['data'])
+	    question = msg.sections['question'].records[0]
+	    self.assertEquals(messageId, msg.id)
+	    self.assertEquals(str(Strangle.DNSFlags(flags)), str(msg.flags))
+	    self.assertEquals(qname, question.name)
+	    self.assertEquals(Strangle.typeNames[qtype], question.type)
+	    self.assertEquals(Strangle.classNames[qclass], question.queryClass)
+
+	self.assertRaises(Strangle.StrangleError, Strangle.parse_question, 'short')
+
+class testStats(unittest.TestCase):
+    """Tests the parse counters"""
+    def tearDown(self):
+	Strangle.enableStats(False)
+	Strangle.stats(reset=True)
+
+    def testStats(self):
+	"""Test whether packets, records, failures and time are counted only when enabled"""
+	packet = testutils.responses[2]['data']
+	Strangle.stats(reset=True)
+	Strangle.DNSMessage(packet)
+	self.assertEquals(Strangle.stats()['packets'], 0)
+
+	self.assertEquals(Strangle.enableStats(), False)
+	# Owner and MX names pointing past the end pass ns_initparse() but not the records
+	header    = struct.pack('!HHHHHH', 1, 0x8000, 0, 1, 0, 0)
+	badOwner  = header + '\xc0\x7f' + struct.pack('!HHIH', 1, 1, 0, 4) + '\0' * 4
+	badMXName = header + '\x00' + struct.pack('!HHIHH', 15, 1, 0, 4, 10) + '\xc0\x7f'
+
+	parsed = Strangle.libbind.parse_message(packet)
+	Strangle.parse_many([packet, packet[:5], badOwner, badMXName])
+	Strangle.libbind.ns_msg(packet)
+
+	snapshot = Strangle.stats(reset=True)
+	self.assertEquals(snapshot['enabled'], True)
+	self.assertEquals(snapshot['packets'], 3)
+	self.assertEquals(snapshot['failures'], { 'initparse' : 1, 'parserr' : 1, 'name' : 1, 'other' : 0 })
+	for name, number in Strangle.sectionNumbers.items():
+	    self.assertEquals(snapshot['sections'][name], 2 * len(parsed[2][number]))
+	# The question is counted too
+	mx = [record for records in parsed[2] for record in records if record[1] == Strangle.libbind.ns_t_mx]
+	self.assertEquals(snapshot['types']['MX'], 2 * len(mx))
+	assert snapshot['nanoseconds']['native'] > 0
+
+	self.assertEquals(Strangle.stats()['packets'], 0)
+
+class testFilter(unittest.TestCase):
+    """Tests the packet filters"""
+    def setUp(self):
+	self.messages = testutils.queries + testutils.responses
+	self.packets  = [message['data'] for message in self.messages]
+
+	# An NXDOMAIN answer for an ANY query, and a message with no question
+	self.nxdomain = struct.pack('!HHHHHH', 7, 0x8183, 1, 0, 0, 0) + '\x04Test\x07example\x00\x00\xff\x00\x01'
+	self.empty    = struct.pack('!HHHHHH', 8, 0x8000, 0, 0, 0, 0)
+
+    def matching(self, expression):
+	return Strangle.Filter(expression).select(self.packets + [self.nxdomain, self.empty])
+
+    def testCompile(self):
+	"""Test whether expressions compile to the right postfix programs"""
+	self.assertEquals(Strangle.Filter("rcode=3 and qtype=ANY").program,
+			  (('=', 'rcode', 3), ('=', 'qtype', 255), ('and',)))
+	self.assertEquals(Strangle.Filter("qtype in {any, TXT} or not (QR == 0 and opcode != QUERY)").program,
+			  (('in', 'qtype', (255, 16)), ('=', 'qr', 0), ('!=', 'opcode', 0), ('and',),
+			   ('not',), ('or',)))
+	self.assertEquals(Strangle.Filter("qname in {Example.COM., b.example} or qname ends with .test").program,
+			  (('=', 'qname', 'example.com'), ('=', 'qname', 'b.example'), ('or',),
+			   ('endswith', 'qname', '.test'), ('or',)))
+
+	for bad in ("", "rcode=", "foo=1", "rcode=BOGUS", "(qr=1", "qr=1 qr=0", "qr=1 and",
+		    "qtype ends with x", "qr ! 1", "qtype in {A, }", "qname < a", "not"):
+	    self.assertRaises(Strangle.FilterError, Strangle.Filter, bad)
+
+    def testMatch(self):
+	"""Test whether header and question fields are matched"""
+	count = len(self.packets)
+	self.assertEquals(self.matching("qr=0"), [index for index in range(0, count)
+						  if not self.messages[index]['flags']['ns_f_qr']])
+	self.assertEquals(self.matching("qtype=MX"), [2, 5])
+	self.assertEquals(self.matching("qname ends with oreilly.com"), [2, 5])
+	self.assertEquals(self.matching("qname = OREILLY.com."), [2, 5])
+	self.assertEquals(self.matching("rcode=3 and qtype=ANY"), [count])
+	self.assertEquals(self.matching("rcode == NXDOMAIN and qname = test.example"), [count])
+	self.assertEquals(self.matching("qdcount = 0"), [count + 1])
+	self.assertEquals(self.matching("length > 12 and id < 65536"), range(0, count + 1))
+
+	# Question comparisons are false without a question, even negative ones
+	self.assertEquals(self.matching("qtype != A"), [2, 5, count])
+	self.assertEquals(self.matching("not qtype = A"), [2, 5, count, count + 1])
+
+	qfilter = Strangle.Filter("qr=1")
+	self.assertEquals(qfilter.select(['short', 23, bytearray(self.packets[3])]), [2])
+	self.assertEquals(qfilter.match(self.packets[0]), False)
+	self.assertRaises(TypeError, qfilter.match, 23)
+
+	copy = pickle.loads(pickle.dumps(qfilter))
+	self.assertEquals(copy.program, qfilter.program)
+	self.assertEquals(repr(copy), "Filter('qr=1')")
+
+    def testParseMany(self):
+	"""Test whether parse_many only parses the matching packets, with the original indexes"""
+	bad = struct.pack('!HHHHHH', 9, 0x8000, 1, 1, 0, 0) + '\x00\x00\x01\x00\x01'
+	packets = self.packets + [bad]
+	messages, errors = Strangle.parse_many(packets, filter=Strangle.Filter("qr=1"))
+	self.assertEquals([msg and msg.id for msg in messages],
+			  [message['id'] for message in self.messages if message['flags']['ns_f_qr']] + [None])
+	self.assertEquals([index for index, reason in errors], [len(self.packets)])
+
+	seen = []
+	Strangle.parse_many(packets, filter=Strangle.Filter("qdcount=1"),
+			    on_error=lambda index, packetData, reason: seen.append(index))
+	self.assertEquals(seen, [len(self.packets)])
+
+class testParseMany(unittest.TestCase):
+    """Tests the parse_many batch interface"""
+    def setUp(self):
+	self.messages = testutils.queries + testutils.responses
+	self.packets  = [message['data'] for message in self.messages]
+
+    def testParsesAll(self):
+	"""Test whether parse_many returns the same messages as DNSMessage"""
+	messages, errors = Strangle.parse_many(iter(self.packets))
+	self.assertEquals(errors, [])
+	self.assertEquals(len(messages), len(self.packets))
+	for i in range(0, len(self.packets)):
+	    self.assertEquals(messages[i].id, self.messages[i]['id'])
+	    self.assertEquals(str(messages[i]), str(Strangle.DNSMessage(self.packets[i])))
+
+    def testCollectsErrors(self):
+	"""Test whether parse_many reports bad packets instead of raising"""
+	packets = ['bad', self.packets[0], 23, self.packets[1]]
+
+	messages, errors = Strangle.parse_many(packets)
+	self.assertEquals([index for index, reason in errors], [0, 2])
+	assert messages[0] is None and messages[2] is None
+	self.assertEquals(messages[3].id, self.messages[1]['id'])
+
+	messages, errors = Strangle.parse_many(packets, on_error='skip')
+	self.assertEquals(len(messages), 2)
+
+	messages, errors = Strangle.parse_many(packets, on_error=lambda index, data, reason: index)
+	self.assertEquals(messages[2], 2)
+
+	self.assertRaises(Strangle.StrangleError, Strangle.parse_many, packets, on_error='raise')
+	self.assertRaises(ValueError, Strangle.parse_many, packets, on_error='bogus')
+
+	# A bad on_error is refused before any packet is read
+	remaining = iter(packets)
+	self.assertRaises(ValueError, Strangle.parse_many, remaining, on_error='bogus')
+	self.assertEquals(list(remaining), packets)
 
 def suite():
     s = unittest.TestSuite()
     s.addTest( unittest.makeSuite(testDNSMessage, 'test') )
     s.addTest( unittest.makeSuite(testDNSFlags  , 'test') )
+    s.addTest( unittest.makeSuite(testEDNS      , 'test') )
     s.addTest( unittest.makeSuite(testDNSSection, 'test') )
     s.addTest( unittest.makeSuite(testDNSRecord , 'test') )
+    s.addTest( unittest.makeSuite(testParseMany , 'test') )
+    s.addTest( unittest.makeSuite(testParseQuestion, 'test') )
+    s.addTest( unittest.makeSuite(testStats     , 'test') )
+    s.addTest( unittest.makeSuite(testFilter    , 'test') )
     return s
 
 if __name__ == "__main__":
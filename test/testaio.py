@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+import socket, struct, threading
+
+import Strangle
+from Strangle import aio
+
+class aioTestCase(unittest.TestCase):
+    """Tests for receiving DNS messages on loopback sockets"""
+    def setUp(self):
+	self.query    = testutils.queries[0]
+	self.response = testutils.responses[2]
+	self.listener = None
+
+	self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	self.client.settimeout(5)
+
+    def tearDown(self):
+	self.client.close()
+	if self.listener is not None:
+	    self.listener.close()
+
+    def collect(self, count, tries=50):
+	"""Poll the listener until count messages have arrived"""
+	results = []
+	while len(results) < count and tries > 0:
+	    results.extend(self.listener.poll())
+	    tries -= 1
+	return results
+
+    def testUDP(self):
+	"""Test whether UDP queries are parsed, bad ones dropped, and replies sent"""
+	self.listener = aio.Listener()
+	address = self.listener.listenUDP(('127.0.0.1', 0)).address
+
+	self.client.sendto('garbage', address)
+	self.client.sendto(self.query['data'], address)
+
+	results = self.collect(1)
+	self.assertEquals(len(results), 1)
+	msg, peer = results[0]
+	self.assertEquals(msg.id, self.query['id'])
+	self.assertEquals(peer.protocol, 'udp')
+	self.assertEquals(peer.address[1], self.client.getsockname()[1])
+	self.assertEquals(self.listener.received, 2)
+	self.assertEquals(self.listener.invalid, 1)
+
+	peer.send(self.response['data'])
+	self.assertEquals(self.client.recv(65535), self.response['data'])
+
+    def testFilter(self):
+	"""Test whether packets which do not match the filter are dropped before queueing"""
+	self.listener = aio.Listener(filter=Strangle.Filter("qr=1"))
+	address = self.listener.listenUDP(('127.0.0.1', 0)).address
+
+	self.client.sendto('garbage', address)
+	self.client.sendto(self.query['data'], address)
+	self.client.sendto(self.response['data'], address)
+
+	results = self.collect(1)
+	self.assertEquals([msg.id for msg, peer in results], [self.response['id']])
+	self.assertEquals(self.listener.received, 3)
+	self.assertEquals(self.listener.filtered, 2)
+	self.assertEquals(self.listener.invalid, 0)
+
+    def testTCP(self):
+	"""Test whether length-prefixed TCP messages are split and answered"""
+	self.listener = aio.Listener(lazy=True)
+	address = self.listener.listenTCP(('127.0.0.1', 0)).address
+
+	stream = (struct.pack('!H', len(self.query['data'])) + self.query['data'] +
+		  struct.pack('!H', len(self.response['data'])) + self.response['data'])
+	client = socket.create_connection(address, 5)
+	try:
+	    client.sendall(stream[:5])
+	    self.assertEquals(self.collect(1, tries=3), [])
+	    client.sendall(stream[5:])
+
+	    results = self.collect(2)
+	    self.assertEquals([msg.id for msg, peer in results],
+			      [self.query['id'], self.response['id']])
+	    self.assertEquals(results[1][0].sections['answer'].records[0].data,
+			      '20 smtp1.oreilly.com')
+
+	    results[0][1].send(self.response['data'])
+	    self.listener.poll()
+	    reply = client.recv(65535)
+	    self.assertEquals(reply, stream[len(self.query['data']) + 2:])
+	finally:
+	    client.close()
+
+    def testBackpressure(self):
+	"""Test whether a full queue stops the listener reading its socket"""
+	self.listener = aio.Listener(maxsize=1)
+	dispatcher = self.listener.listenUDP(('127.0.0.1', 0))
+
+	for i in range(0, 3):
+	    self.client.sendto(self.query['data'], dispatcher.address)
+
+	import asyncore
+	asyncore.loop(0.5, False, self.listener.map, 1)
+	asyncore.loop(0.1, False, self.listener.map, 1)
+	self.assertEquals(self.listener.received, 1)
+	assert self.listener.full()
+	assert not dispatcher.readable()
+
+	self.assertEquals(len(self.collect(3)), 3)
+	self.assertEquals(self.listener.received, 3)
+
+    def testPool(self):
+	"""Test whether parsing can be offloaded to a pool"""
+	from multiprocessing.pool import ThreadPool
+
+	pool = ThreadPool(2)
+	try:
+	    self.listener = aio.Listener(pool=pool)
+	    address = self.listener.listenUDP(('127.0.0.1', 0)).address
+	    for packet in ('garbage', self.query['data'], self.response['data']):
+		self.client.sendto(packet, address)
+
+	    results = self.collect(2)
+	    self.assertEquals(sorted([msg.id for msg, peer in results]),
+			      sorted([self.query['id'], self.response['id']]))
+	    self.assertEquals(self.listener.invalid, 1)
+	finally:
+	    pool.close()
+	    pool.join()
+
+    def testPoolFailures(self):
+	"""Test whether packets the pool fails on are counted, and do not stop reading"""
+	from multiprocessing.pool import ThreadPool
+
+	class BrokenLibbind(object):
+	    def parse_many(self, packets):
+		raise MemoryError
+
+	pool = ThreadPool(1)
+	realLibbind = aio.libbind
+	aio.libbind = BrokenLibbind()
+	try:
+	    self.listener = aio.Listener(pool=pool, maxsize=1)
+	    address = self.listener.listenUDP(('127.0.0.1', 0)).address
+	    for i in range(0, 3):
+		self.client.sendto(self.query['data'], address)
+
+	    tries = 50
+	    while self.listener.invalid < 3 and tries > 0:
+		self.assertEquals(self.listener.poll(), [])
+		tries -= 1
+	    self.assertEquals(self.listener.invalid, 3)
+	    self.assertEquals(self.listener.inFlight, 0)
+	finally:
+	    aio.libbind = realLibbind
+	    pool.close()
+	    pool.join()
+
+	# A closed pool refuses the packet (with an AssertionError in Python 2.7)
+	# without holding on to its slot
+	self.assertRaises(Exception, self.listener.deliver, self.query['data'], None)
+	self.assertEquals((self.listener.invalid, self.listener.inFlight), (4, 0))
+	assert not self.listener.full()
+
+    def testServe(self):
+	"""Test whether serve() runs a callback for each message until closed"""
+	seen = []
+	def callback(msg, peer):
+	    seen.append(msg.id)
+	    self.listener.close()
+
+	self.listener = aio.Listener(callback)
+	address = self.listener.listenUDP(('127.0.0.1', 0)).address
+	self.client.sendto(self.query['data'], address)
+
+	thread = threading.Thread(target=self.listener.serve)
+	thread.start()
+	thread.join(5)
+	assert not thread.isAlive()
+	self.assertEquals(seen, [self.query['id']])
+
+    def testGet(self):
+	"""Test whether another thread can consume messages with get()"""
+	self.listener = aio.Listener()
+	address = self.listener.listenUDP(('127.0.0.1', 0)).address
+
+	thread = threading.Thread(target=self.listener.serve)
+	thread.start()
+	try:
+	    self.client.sendto(self.query['data'], address)
+	    msg, peer = self.listener.get(timeout=5)
+	    self.assertEquals(msg.id, self.query['id'])
+	finally:
+	    self.listener.close()
+	    thread.join(5)
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(aioTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+
+import Strangle
+from Strangle import libbind, build, patch
+
+class buildTestCase(unittest.TestCase):
+    """Tests for encoding messages"""
+    def setUp(self):
+	self.packets = [message['data'] for message in testutils.queries + testutils.responses]
+
+    def testRoundTrip(self):
+	"""Test whether encoding a parsed message gives back the same message"""
+	for packet in self.packets:
+	    msg = Strangle.DNSMessage(packet)
+	    encoded = build.message(msg)
+	    self.assertEquals(str(Strangle.DNSMessage(encoded)), str(msg))
+	    self.assertEquals(libbind.parse_message(encoded)[:2], msg.parsed[:2])
+
+	    # The fixtures are compressed as well as they can be
+	    self.assertEquals(len(encoded), len(packet))
+
+	    lazy = Strangle.DNSMessage(packet, lazy=True)
+	    self.assertEquals(build.message(lazy), encoded)
+
+    def testEditedFlags(self):
+	"""Test whether flags changed on a parsed message are encoded, and AD and CD kept"""
+	packet = bytearray(testutils.queries[0]['data'])
+	patch.message(packet, authenticData=True, checkingDisabled=True)
+
+	for lazy in (False, True):
+	    msg = Strangle.DNSMessage(str(packet), lazy=lazy)
+	    msg.id = 4242
+	    msg.flags.truncated = True
+	    msg.flags.recursionDesired = False
+
+	    id, flags, sections = libbind.parse_message(build.message(msg))
+	    self.assertEquals(id, 4242)
+	    self.assertEquals((flags[libbind.ns_f_tc], flags[libbind.ns_f_rd]), (1, 0))
+	    self.assertEquals((flags[libbind.ns_f_ad], flags[libbind.ns_f_cd]), (1, 1))
+
+    def testQuery(self):
+	"""Test whether a query is written into a buffer at an offset"""
+	original = Strangle.DNSMessage(testutils.queries[0]['data'])
+	name = original.sections['question'].records[0].name
+	packet = build.query(name, id=original.id)
+	self.assertEquals(packet, testutils.queries[0]['data'])
+
+	buffer = bytearray(600)
+	length = build.query(name, 'A', 'IN', id=original.id, buffer=buffer, offset=100)
+	self.assertEquals(length, len(packet))
+	self.assertEquals(str(buffer[100:100 + length]), packet)
+	self.assertEquals(buffer[:100], bytearray(100))
+
+	msg = Strangle.DNSMessage(build.query('example.com', libbind.ns_t_srv, recursionDesired=False))
+	self.assertEquals(msg.sections['question'].records[0].type, 'SRV')
+	self.assertEquals(msg.flags.recursionDesired, False)
+
+    def testCompression(self):
+	"""Test whether names are compressed where they may be, and only there"""
+	records = [('example.com', libbind.ns_t_mx, 1, 60, None, (10, 'mail.example.com')),
+		   ('example.com', libbind.ns_t_srv, 1, 60, None, (1, 2, 3, 'sip.example.com'))]
+	packet = libbind.build_message(1, 0, ((('example.com', libbind.ns_t_mx, 1),), records))
+
+	# example.com once in full, then pointers; the SRV target in full
+	self.assertEquals(packet.count('\x07example\x03com\x00'), 2)
+	parsed = libbind.parse_message(packet)
+	self.assertEquals(libbind.decode_rdata(libbind.ns_t_mx, parsed[2][1][0][4], packet), (10, 'mail.example.com'))
+	self.assertEquals(libbind.decode_rdata(libbind.ns_t_srv, parsed[2][1][1][4]), (1, 2, 3, 'sip.example.com'))
+
+    def testValues(self):
+	"""Test whether every value decode_rdata() gives can be encoded again"""
+	values = [(libbind.ns_t_a, '192.0.2.1'),
+		  (libbind.ns_t_aaaa, '2001:db8::1'),
+		  (libbind.ns_t_soa, ('ns.example.com', 'admin.example.com', 1, 2, 3, 4, 5)),
+		  (libbind.ns_t_txt, ('hello', '', 'a b')),
+		  (libbind.ns_t_naptr, (100, 10, 'U', 'E2U+sip', '', 'x.example')),
+		  (libbind.ns_t_ds, (60485, 5, 1, 'digest')),
+		  (libbind.ns_t_rrsig, (1, 8, 2, 3600, 2000, 1000, 4242, 'example.com', 'sig')),
+		  (libbind.ns_t_opt, ((10, 'clientck'), (12, '\0\0')))]
+	for recordType, value in values:
+	    packet = libbind.build_message(0, 0, ((), [('example.com', recordType, 1, 0, None, value)]))
+	    rdata = libbind.parse_message(packet)[2][1][0][4]
+	    self.assertEquals(libbind.decode_rdata(recordType, rdata, packet), value)
+
+    def testErrors(self):
+	"""Test whether bad input is refused"""
+	bad = [((), [('example.com', libbind.ns_t_a, 1, 0, None, 'not an address')]),
+	       ((), [('example.com', libbind.ns_t_hinfo, 1, 0, None, 'x')]),
+	       ((), [('example.com', libbind.ns_t_a, 1, -1, '\0' * 4)]),
+	       ((('example.com', 70000, 1),),),
+	       ((('bad..name', 1, 1),),),
+	       ((('example.com', 1, 1),),) * 5]
+	for sections in bad:
+	    self.assertRaises(ValueError, libbind.build_message, 0, 0, sections)
+
+	self.assertRaises(TypeError, libbind.build_message, 0, 0, ((('example.com', 1),),))
+	self.assertRaises(TypeError, libbind.build_message, 0, 0,
+			  ((), [('example.com', libbind.ns_t_mx, 1, 0, None, (10,))]))
+	self.assertRaises(ValueError, libbind.build_message, 0, 0x10000, ())
+	self.assertRaises(ValueError, build.query, 'example.com', buffer=bytearray(20))
+	self.assertRaises(BufferError, build.query, 'example.com', buffer='read only')
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(buildTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+import struct
+
+import Strangle
+from Strangle import cache
+
+class Clock(object):
+    """A clock which only moves when told to"""
+    def __init__(self):
+	self.now = 1000.0
+
+    def __call__(self):
+	return self.now
+
+class cacheTestCase(unittest.TestCase):
+    """Tests for the parsed message cache"""
+    def setUp(self):
+	self.query    = testutils.queries[0]['data']
+	self.response = testutils.responses[2]['data']	# oreilly.com MX, smallest TTL 3600
+	self.clock    = Clock()
+
+    def withId(self, packet, messageId):
+	return struct.pack('!H', messageId) + packet[2:]
+
+    def testHits(self):
+	"""Test whether a repeated packet is a hit and gives the same message"""
+	messages = cache.MessageCache(clock=self.clock)
+	first  = messages.parse(self.response)
+	second = messages.parse(bytearray(self.response))
+	self.assertEquals(str(first), str(second))
+	assert first.parsed is second.parsed
+	self.assertEquals(messages.stats(), { 'hits' : 1, 'misses' : 1, 'expired' : 0,
+					      'evictions' : 0, 'size' : 1 })
+
+	self.assertRaises(Strangle.StrangleError, messages.parse, 'garbage')
+	self.assertEquals(len(messages), 1)
+
+    def testIgnoreId(self):
+	"""Test whether a different ID is patched in instead of parsing again"""
+	messages = cache.MessageCache(clock=self.clock)
+	first  = messages.parse(self.response)
+	second = messages.parse(self.withId(self.response, 4242))
+	self.assertEquals(messages.hits, 1)
+	self.assertEquals(second.id, 4242)
+	self.assertEquals(second.parsed, (4242,) + first.parsed[1:])
+	self.assertEquals(second.sections['answer'].records[0].data, '20 smtp1.oreilly.com')
+
+	messages = cache.MessageCache(ignoreId=False, clock=self.clock)
+	messages.parse(self.response)
+	messages.parse(self.withId(self.response, 4242))
+	self.assertEquals((messages.hits, messages.misses), (0, 2))
+
+    def testLRU(self):
+	"""Test whether the least recently used message is evicted first"""
+	messages = cache.MessageCache(maxSize=2, ignoreId=False, clock=self.clock)
+	packets = [self.withId(self.query, messageId) for messageId in (1, 2, 3)]
+	messages.parse(packets[0])
+	messages.parse(packets[1])
+	messages.parse(packets[0])
+	messages.parse(packets[2])
+	self.assertEquals(messages.evictions, 1)
+
+	messages.parse(packets[0])
+	self.assertEquals(messages.hits, 2)
+	messages.parse(packets[1])
+	self.assertEquals(messages.misses, 4)
+
+    def testTTL(self):
+	"""Test whether messages expire with their smallest TTL"""
+	messages = cache.MessageCache(clock=self.clock)
+	messages.parse(self.response)
+	self.clock.now += 3599
+	messages.parse(self.response)
+	self.assertEquals(messages.hits, 1)
+
+	self.clock.now += 1
+	messages.parse(self.response)
+	self.assertEquals((messages.hits, messages.expired, messages.misses), (1, 1, 2))
+
+	messages = cache.MessageCache(maxAge=10, clock=self.clock)
+	messages.parse(self.response)
+	self.clock.now += 10
+	messages.parse(self.response)
+	self.assertEquals(messages.expired, 1)
+
+    def testEmpty(self):
+	"""Test whether messages without TTLs follow emptyAge"""
+	messages = cache.MessageCache(clock=self.clock)
+	messages.parse(self.query)
+	self.clock.now += 1000000
+	messages.parse(self.query)
+	self.assertEquals(messages.hits, 1)
+
+	messages = cache.MessageCache(emptyAge=0, clock=self.clock)
+	messages.parse(self.query)
+	self.assertEquals(len(messages), 0)
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(cacheTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
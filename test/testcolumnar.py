@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+
+import Strangle
+from Strangle import libbind, columnar
+
+class columnarTestCase(unittest.TestCase):
+    """Tests for the column-oriented record store"""
+    def setUp(self):
+	self.packets = [message['data'] for message in testutils.queries + testutils.responses]
+
+    def expected(self, packets):
+	"""The (message, section, record tuple) of every record, from parse_message()"""
+	records = []
+	for index in range(0, len(packets)):
+	    try:
+		parsed = libbind.parse_message(packets[index])
+	    except TypeError:
+		continue
+	    for section in range(0, len(parsed[2])):
+		for record in parsed[2][section]:
+		    records.append((index, section, record))
+	return records
+
+    def testRecords(self):
+	"""Test whether a batch holds the same records as parse_message() gives"""
+	batch = columnar.RecordBatch(self.packets)
+	expected = self.expected(self.packets)
+
+	self.assertEquals(len(batch), len(expected))
+	for row in range(0, len(batch)):
+	    index, section, record = expected[row]
+	    self.assertEquals(batch.message[row], index)
+	    self.assertEquals(batch.section[row], section)
+	    self.assertEquals(batch.record(row), record)
+
+	self.assertEquals(list(batch.ids), [message['id'] for message in testutils.queries + testutils.responses])
+	self.assertEquals(batch.errors, [])
+
+    def testNames(self):
+	"""Test whether names are stored once and shared between extend() calls"""
+	batch = columnar.RecordBatch(self.packets[:1])
+	batch.extend(self.packets)
+
+	self.assertEquals(len(batch.names), len(set(batch.names)))
+	for name, code in batch.codes.items():
+	    self.assertEquals(batch.names[code], name)
+
+	code = batch.nameCode('oreilly.com')
+	assert code != -1
+	self.assertEquals(batch.nameCode('no.such.name'), -1)
+	rows = batch.rows('name', code)
+	assert len(rows) > 0
+	for row in rows:
+	    self.assertEquals(batch.record(row)[0], 'oreilly.com')
+
+	self.assertEquals(batch.message[-1], len(self.packets))
+	self.assertEquals(len(batch.ids), len(self.packets) + 1)
+
+    def testErrors(self):
+	"""Test whether bad packets are reported and get no records"""
+	packets = ['garbage'] + self.packets[:2] + [23]
+	batch = columnar.RecordBatch(self.packets[:1])
+	batch.extend(packets)
+
+	self.assertEquals([index for index, reason in batch.errors], [1, 4])
+	self.assertEquals(len(batch), len(self.expected(self.packets[:1] + packets)))
+	self.assertEquals(sorted(set(batch.message)), [0, 2, 3])
+
+    def testFilter(self):
+	"""Test whether a filtered batch only holds the matching packets"""
+	batch = columnar.RecordBatch(self.packets, filter=Strangle.Filter("qtype=MX"))
+	matching = [self.packets[index] for index in (2, 5)]
+	self.assertEquals(batch.packets, matching)
+	self.assertEquals(len(batch), len(self.expected(matching)))
+
+	batch.extend(['garbage'] + self.packets[:3])
+	self.assertEquals(batch.packets, matching + [self.packets[2]])
+	self.assertEquals(batch.errors, [])
+
+    def testNumpy(self):
+	"""Test whether the columns can be seen as numpy arrays"""
+	batch = columnar.RecordBatch(self.packets)
+	if columnar.numpy is None:
+	    self.assertRaises(columnar.Strangle.StrangleError, batch.numpyColumns)
+	    return
+
+	arrays = batch.numpyColumns()
+	self.assertEquals(list(arrays['ttl']), list(batch.ttl))
+	self.assertEquals(int((arrays['type'] == libbind.ns_t_mx).sum()),
+			  len(batch.rows('type', libbind.ns_t_mx)))
+
+class headerTestCase(unittest.TestCase):
+    """Tests for decoding only the headers of many messages"""
+    def setUp(self):
+	self.packets = [message['data'] for message in testutils.queries + testutils.responses]
+
+    def testHeaders(self):
+	"""Test whether the header columns match the ns_msg functions"""
+	headers = columnar.HeaderBatch.fromPackets(self.packets)
+	self.assertEquals(len(headers), len(self.packets))
+	self.assertEquals(headers.errors, [])
+
+	flags = ['qr', 'opcode', 'aa', 'tc', 'rd', 'ra', 'z', 'ad', 'cd', 'rcode']
+	counts = ['qdcount', 'ancount', 'nscount', 'arcount']
+	for index in range(0, len(self.packets)):
+	    msg = libbind.ns_msg(self.packets[index])
+	    self.assertEquals(headers.id[index], libbind.ns_msg_id(msg))
+	    for flag in flags:
+		self.assertEquals(getattr(headers, flag)[index],
+				  libbind.ns_msg_getflag(msg, getattr(libbind, 'ns_f_' + flag)))
+	    for section in range(0, len(counts)):
+		self.assertEquals(getattr(headers, counts[section])[index],
+				  libbind.ns_msg_count(msg, section))
+
+	self.assertEquals(sum(headers.histogram('qr').values()), len(self.packets))
+
+    def testBuffer(self):
+	"""Test whether headers are found by offset in one buffer, and short ones reported"""
+	import array
+
+	data    = 'xx' + self.packets[0] + self.packets[1] + 'short'
+	offsets = array.array('i', [2, 2 + len(self.packets[0]), len(data) - 5, len(data), -1])
+	headers = columnar.HeaderBatch(buffer(data), offsets)
+	self.assertEquals(list(headers.id[:2]), [testutils.queries[0]['id'], testutils.queries[1]['id']])
+	self.assertEquals([index for index, reason in headers.errors], [2, 3, 4])
+	self.assertEquals(list(headers.qdcount[2:]), [0, 0, 0])
+
+	headers.extend(data, [2], [5])
+	self.assertEquals(headers.errors[-1][0], 5)
+
+	self.assertRaises(ValueError, columnar.HeaderBatch, data, [2, 3], [20])
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(columnarTestCase, 'test') )
+    s.addTest( unittest.makeSuite(headerTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,6 +20,7 @@
 
 import sys, testutils
 import unittest
+import struct
 
 from Strangle import libbind
 
@@ -328,6 +329,433 @@ class libbindTestCase(unittest.TestCase):
 	
 	assert True
 
+    def testlibbind_ns_rrKeepsMessage(self):
+	"""Test whether an ns_rr keeps its ns_msg and packet alive"""
+	packet = bytearray(self.packetData)
+	msg = libbind.ns_msg(packet)
+	rr  = libbind.ns_rr(msg, libbind.ns_s_ar, 0)
+	del msg
+
+	# The bytearray cannot be resized while records point into it.
+	self.assertRaises(BufferError, packet.extend, 'x')
+	packet[:] = 'x' * len(packet)
+	self.assertEquals(libbind.ns_rr_type(rr), libbind.ns_t_a)
+	self.assertEquals(libbind.ns_rr_rdata(rr), 'xxxx')
+
+	del rr
+	packet.extend('x')
+
+    def testlibbind_getters(self):
+	"""Test whether the ns_msg methods and ns_rr getters match the functions"""
+	for message in self.queries + self.responses:
+	    msg = libbind.ns_msg(message['data'])
+	    self.assertEquals(msg.id, libbind.ns_msg_id(msg))
+	    for flag in range(0, libbind.ns_f_max):
+		self.assertEquals(msg.getflag(flag), libbind.ns_msg_getflag(msg, flag))
+
+	    for section in (libbind.ns_s_qd, libbind.ns_s_an, libbind.ns_s_ns, libbind.ns_s_ar):
+		self.assertEquals(msg.count(section), libbind.ns_msg_count(msg, section))
+		for rrnum in range(0, msg.count(section)):
+		    rr = libbind.ns_rr(msg, section, rrnum)
+		    self.assertEquals((rr.name, rr.type, rr.queryClass, rr.ttl, rr.rdlen, rr.rdata),
+				      (libbind.ns_rr_name(rr), libbind.ns_rr_type(rr), libbind.ns_rr_class(rr),
+				       libbind.ns_rr_ttl(rr), libbind.ns_rr_rdlen(rr), libbind.ns_rr_rdata(rr)))
+		    self.assertEquals(rr.offset, libbind.ns_data_offset(msg, rr))
+		    if section != libbind.ns_s_qd and rr.type in (libbind.ns_t_mx, libbind.ns_t_ns):
+			self.assertEquals(rr.uncompress(), libbind.ns_name_uncompress(msg, rr))
+
+	self.assertRaises(ValueError, msg.count, libbind.ns_s_ar + 1)
+	self.assertRaises(ValueError, msg.getflag, -1)
+	self.assertRaises(TypeError, msg.count, 'not an int')
+	self.assertRaises(AttributeError, setattr, rr, 'ttl', 0)
+
+	# A record which was never initialised has no message
+	empty = libbind.ns_rr.__new__(libbind.ns_rr)
+	assert empty.offset is None
+	self.assertRaises(TypeError, empty.uncompress)
+	self.assertRaises(TypeError, libbind.ns_rr(msg, libbind.ns_s_qd, 0).uncompress)
+
+    def testlibbind_typeChecks(self):
+	"""Test whether the functions reject objects of the wrong type"""
+	msg = libbind.ns_msg(self.packetData)
+	rr  = libbind.ns_rr(msg, libbind.ns_s_an, 0)
+	for function in (libbind.ns_msg_id, libbind.parse_flags):
+	    self.assertRaises(TypeError, function, rr)
+	    self.assertRaises(TypeError, function)
+	for function in (libbind.ns_rr_name, libbind.ns_rr_ttl, libbind.ns_rr_rdata):
+	    self.assertRaises(TypeError, function, msg)
+	    self.assertRaises(TypeError, function, rr, rr)
+	for function in (libbind.ns_name_uncompress, libbind.ns_data_offset, libbind.parse_record):
+	    self.assertRaises(TypeError, function, rr, msg)
+	    self.assertRaises(TypeError, function, msg, msg)
+	self.assertRaises(TypeError, libbind.ns_rr, rr, libbind.ns_s_an, 0)
+
+    def testlibbind_iter_records(self):
+	"""Test whether iter_records yields the records parse_message gives, filtered"""
+	for message in self.queries + self.responses:
+	    msg = libbind.ns_msg(message['data'])
+	    parsed = libbind.parse_message(message['data'])
+	    expected = [record for records in parsed[2] for record in records]
+	    self.assertEquals([libbind.parse_record(msg, rr) for rr in msg.iter_records()], expected)
+
+	    for section in (libbind.ns_s_qd, libbind.ns_s_an, libbind.ns_s_ns, libbind.ns_s_ar):
+		records = libbind.iter_records(msg, section, types=[libbind.ns_t_a, libbind.ns_t_mx])
+		self.assertEquals([(rr.name, rr.type) for rr in records],
+				  [record[:2] for record in parsed[2][section]
+				   if record[1] in (libbind.ns_t_a, libbind.ns_t_mx)])
+
+	self.assertEquals(list(msg.iter_records(types=())), [])
+	self.assertRaises(ValueError, msg.iter_records, libbind.ns_s_ar + 1)
+	self.assertRaises(ValueError, msg.iter_records, types=[-1])
+	self.assertRaises(TypeError, msg.iter_records, types=23)
+	self.assertRaises(TypeError, libbind.iter_records, 'not an ns_msg')
+
+    def testlibbind_ns_filter(self):
+	"""Test whether ns_filter runs postfix programs and rejects bad ones"""
+	qfilter = libbind.ns_filter((('=', 'qr', 1), ('in', 'qtype', (libbind.ns_t_mx, libbind.ns_t_a)), ('and',)))
+	self.assertEquals([qfilter.match(message['data']) for message in self.queries + self.responses],
+			  [not not message['flags']['ns_f_qr'] for message in self.queries + self.responses])
+	self.assertEquals(qfilter.match('short'), False)
+
+	for program in ((), (('and',),), (('=', 'qr', 1), ('=', 'qr', 0)), (('=', 'nosuch', 1),),
+			(('~', 'qr', 1),), (('<', 'qname', 'a'),)):
+	    self.assertRaises(ValueError, libbind.ns_filter, program)
+	self.assertRaises(ValueError, libbind.ns_filter, (('not',),) * 65)
+
+	# Malformed programs which would run off either end of the stack
+	for program in ((('not',), ('=', 'id', 1)), (('not',),), (('=', 'id', 1), ('and',)),
+			(('=', 'id', 1), ('or',), ('=', 'id', 2)), (('=', 'id', 1), ('=', 'id', 2)),
+			(('=', 'id', 1), ('=', 'id', 2), ('=', 'id', 3), ('and',))):
+	    self.assertRaises(ValueError, libbind.ns_filter, program)
+	self.assertRaises(TypeError, libbind.ns_filter, (('=', 'qr', 'a'),))
+
+    def testlibbind_iter_recordsKeepsMessage(self):
+	"""Test whether the iterator and its records keep the ns_msg from being reused"""
+	msg = libbind.ns_msg(self.packetData)
+	records = msg.iter_records(libbind.ns_s_an)
+	rr = records.next()
+	del rr
+	self.assertRaises(BufferError, msg.__init__, self.queries[0]['data'])
+
+	# An exhausted iterator lets go of the ns_msg
+	for rr in records:
+	    pass
+	del rr
+	msg.__init__(self.queries[0]['data'])
+	self.assertRaises(StopIteration, records.next)
+
+	before = sys.getrefcount(msg)
+	records = msg.iter_records()
+	records.next()
+	del records
+	self.assertEquals(sys.getrefcount(msg), before)
+
+    def testlibbind_parse_messageCompression(self):
+	"""Test whether parse_message decompresses names exactly as libbind does"""
+	import random, struct
+
+	random.seed(1234)
+	alphabet = 'abc.\\"();@$- \x00\x7f\xff'
+
+	def encode(labels, packet, suffixes):
+	    """Append a name to the packet, pointing at a known suffix where possible"""
+	    for i in range(0, len(labels)):
+		suffix = tuple(labels[i:])
+		if suffix in suffixes and random.random() < 0.8:
+		    return packet + struct.pack('!H', 0xc000 | suffixes[suffix])
+		suffixes[suffix] = len(packet)
+		packet += chr(len(labels[i])) + labels[i]
+	    return packet + '\x00'
+
+	for attempt in range(0, 200):
+	    names = [[''.join([random.choice(alphabet) for j in range(0, random.randint(1, 6))])
+		      for i in range(0, random.randint(0, 4))] for k in range(0, 4)]
+	    count = random.randint(1, 12)
+	    suffixes = {}
+	    packet = encode(random.choice(names), struct.pack('!6H', attempt, 0x8400, 1, count, 0, 0), suffixes)
+	    packet += struct.pack('!HH', libbind.ns_t_a, libbind.ns_c_in)
+	    for i in range(0, count):
+		packet = encode(random.choice(names), packet, suffixes)
+		rrtype = random.choice((libbind.ns_t_ns, libbind.ns_t_mx, libbind.ns_t_a))
+		if rrtype == libbind.ns_t_a:
+		    rdata = '\x01\x02\x03\x04'
+		else:
+		    rdata = encode(random.choice(names), packet + '\x00' * 10 + '\x00\x05' * (rrtype == libbind.ns_t_mx),
+				   suffixes)[len(packet) + 10:]
+		packet += struct.pack('!HHIH', rrtype, libbind.ns_c_in, 60, len(rdata)) + rdata
+
+	    msg = libbind.ns_msg(packet)
+	    parsed = libbind.parse_message(packet)
+	    for section in (libbind.ns_s_qd, libbind.ns_s_an):
+		for rrnum in range(0, libbind.ns_msg_count(msg, section)):
+		    rr = libbind.ns_rr(msg, section, rrnum)
+		    record = parsed[2][section][rrnum]
+		    self.assertEquals(record[0], libbind.ns_rr_name(rr))
+		    self.assertEquals(record, libbind.parse_record(msg, rr))
+		    if record[1] != libbind.ns_t_a:
+			self.assertEquals(record[5], libbind.ns_name_uncompress(msg, rr))
+
+    def testlibbind_ns_msgReuse(self):
+	"""Test whether an ns_msg can be reused for another packet"""
+	packet = bytearray(self.packetData)
+	msg = libbind.ns_msg(packet)
+	rr  = libbind.ns_rr(msg, libbind.ns_s_an, 0)
+	self.assertRaises(BufferError, msg.__init__, self.queries[0]['data'])
+	self.assertEquals(libbind.ns_rr_name(rr), 'oreilly.com')
+
+	del rr
+	msg.__init__(self.queries[0]['data'])
+	self.assertEquals(libbind.ns_msg_id(msg), self.queries[0]['id'])
+	packet.extend('x')
+
+	# Records may be reinitialised in place, too.
+	rr = libbind.ns_rr(msg, libbind.ns_s_qd, 0)
+	rr.__init__(msg, libbind.ns_s_qd, 0)
+	del rr
+	msg.__init__(self.packetData)
+
+    def testlibbind_ns_msgFailedReuse(self):
+	"""Test whether a failed __init__ leaves the ns_msg on its old packet"""
+	msg = libbind.ns_msg(self.packetData)
+	expected = libbind.parse_message(self.packetData)
+	counts = [msg.count(section) for section in range(0, libbind.ns_s_ar + 1)]
+
+	# The header is good, but the question runs off the end
+	bad = struct.pack('!HHHHHH', 0x1234, 0, 1, 0, 0, 0) + '\x03abc'
+	self.assertRaises(TypeError, msg.__init__, bad)
+	self.assertEquals(msg.id, expected[0])
+	self.assertEquals([msg.count(section) for section in range(0, libbind.ns_s_ar + 1)], counts)
+	self.assertEquals(libbind.parse_record(msg, libbind.ns_rr(msg, libbind.ns_s_an, 0)),
+			  expected[2][libbind.ns_s_an][0])
+
+    def testlibbind_ns_msgRefcounts(self):
+	"""Test whether ns_msg and ns_rr release their references"""
+	packet = self.packetData
+	before = sys.getrefcount(packet)
+	for i in range(0, 1000):
+	    msg = libbind.ns_msg(packet)
+	    rr  = libbind.ns_rr(msg, libbind.ns_s_an, 0)
+	    rr.__init__(msg, libbind.ns_s_an, 1)
+	del msg, rr
+	self.assertEquals(sys.getrefcount(packet), before)
+
+    def testlibbind_parse_message(self):
+	"""Test whether parse_message returns the header and every record"""
+	for message in self.queries + self.responses:
+	    msg = libbind.ns_msg(message['data'])
+	    id, flags, sections = libbind.parse_message(message['data'])
+
+	    self.assertEquals(id, message['id'])
+	    for flag in self.flags[:-1]:
+		self.assertEquals(flags[getattr(libbind, flag)], message['flags'][flag])
+
+	    for section in self.sections:
+		sectionVal = getattr(libbind, section)
+		records = sections[sectionVal]
+		self.assertEquals(len(records), message['sections'][section])
+
+		for rrnum in range(0, len(records)):
+		    rr = libbind.ns_rr(msg, sectionVal, rrnum)
+		    name, type, queryClass, ttl, rdata, dataName = records[rrnum]
+		    self.assertEquals(name, libbind.ns_rr_name(rr))
+		    self.assertEquals(type, libbind.ns_rr_type(rr))
+		    self.assertEquals(queryClass, libbind.ns_rr_class(rr))
+		    self.assertEquals(ttl, libbind.ns_rr_ttl(rr))
+		    self.assertEquals(rdata, libbind.ns_rr_rdata(rr))
+		    self.assertEquals(records[rrnum], libbind.parse_record(msg, rr))
+
+		self.assertEquals(records, libbind.parse_section(msg, sectionVal))
+
+    def testlibbind_parse_messageNames(self):
+	"""Test whether parse_message uncompresses the names in record data"""
+	sections = libbind.parse_message(self.packetData)[2]
+	self.assertEquals(sections[libbind.ns_s_qd][0][5], None)
+	self.assertEquals(sections[libbind.ns_s_an][0][5], 'smtp1.oreilly.com')
+	self.assertEquals(sections[libbind.ns_s_ns][1][5], 'ns2.sonic.net')
+	self.assertEquals(sections[libbind.ns_s_ar][0][5], None)
+
+    def testlibbind_set_intern_size(self):
+	"""Test whether names are shared between messages while interning is on"""
+	self.assertEquals(libbind.set_intern_size(1000), 0)
+	try:
+	    first  = libbind.parse_message(self.packetData)[2]
+	    second = libbind.parse_message(self.packetData)[2]
+	    assert first[libbind.ns_s_an][0][0] is second[libbind.ns_s_an][0][0]
+	    assert first[libbind.ns_s_an][0][5] is second[libbind.ns_s_an][0][5]
+	    assert first[libbind.ns_s_an][0][0] is first[libbind.ns_s_ns][0][0]
+
+	    rr = libbind.ns_rr(self.msg, libbind.ns_s_ar, 0)
+	    assert libbind.ns_rr_name(rr) is second[libbind.ns_s_ar][0][0]
+
+	    # With room for two names, older ones are forgotten.
+	    self.assertEquals(libbind.set_intern_size(2), 1000)
+	    name = libbind.ns_rr_name(rr)
+	    assert libbind.ns_rr_name(rr) is name
+	    libbind.parse_message(self.packetData)
+	    assert libbind.ns_rr_name(rr) is not name
+	    self.assertEquals(libbind.ns_rr_name(rr), name)
+
+	    self.assertRaises(ValueError, libbind.set_intern_size, -1)
+	finally:
+	    libbind.set_intern_size(0)
+
+	first  = libbind.parse_message(self.packetData)[2]
+	second = libbind.parse_message(self.packetData)[2]
+	assert first[libbind.ns_s_an][0][0] is not second[libbind.ns_s_an][0][0]
+
+    def testlibbind_decode_rdata(self):
+	"""Test decode_rdata on crafted rdata of each type"""
+	decode = libbind.decode_rdata
+	name = lambda text: ''.join([chr(len(label)) + label for label in text.split('.')]) + '\0'
+
+	self.assertEquals(decode(libbind.ns_t_a, '\xc0\x00\x02\x01'), '192.0.2.1')
+	self.assertEquals(decode(libbind.ns_t_aaaa, ' \x01\r\xb8' + '\0' * 11 + '\x01'), '2001:db8::1')
+	self.assertEquals(decode(libbind.ns_t_cname, name('www.example.com')), 'www.example.com')
+	self.assertEquals(decode(libbind.ns_t_ns, '\0'), '.')
+	self.assertEquals(decode(libbind.ns_t_mx, '\0\x0a' + name('mail.example.com')), (10, 'mail.example.com'))
+	self.assertEquals(decode(libbind.ns_t_txt, '\x05hello\x00\x03a b'), ('hello', '', 'a b'))
+	self.assertEquals(decode(libbind.ns_t_srv, struct.pack('!HHH', 1, 5, 5060) + name('sip.example.com')),
+			  (1, 5, 5060, 'sip.example.com'))
+	self.assertEquals(decode(libbind.ns_t_naptr, struct.pack('!HH', 100, 10) + '\x01U\x07E2U+sip\x00' + name('x.example')),
+			  (100, 10, 'U', 'E2U+sip', '', 'x.example'))
+	self.assertEquals(decode(libbind.ns_t_ds, struct.pack('!HBB', 60485, 5, 1) + 'digest'),
+			  (60485, 5, 1, 'digest'))
+	self.assertEquals(decode(libbind.ns_t_dnskey, struct.pack('!HBB', 257, 3, 8) + 'key'), (257, 3, 8, 'key'))
+	self.assertEquals(decode(libbind.ns_t_rrsig, struct.pack('!HBBIIIH', libbind.ns_t_a, 8, 2, 3600, 2000, 1000, 4242) +
+				 name('example.com') + 'sig'),
+			  (libbind.ns_t_a, 8, 2, 3600, 2000, 1000, 4242, 'example.com', 'sig'))
+	self.assertEquals(decode(libbind.ns_t_opt, struct.pack('!HH', 10, 2) + 'ab' + struct.pack('!HH', 12, 0)),
+			  ((10, 'ab'), (12, '')))
+	self.assertEquals(decode(libbind.ns_t_hinfo, 'anything'), None)
+
+	for type, rdata in ((libbind.ns_t_a, '\x01\x02\x03'),
+			    (libbind.ns_t_aaaa, '\0' * 4),
+			    (libbind.ns_t_mx, '\0\x0a\x03www'),
+			    (libbind.ns_t_txt, '\x05hell'),
+			    (libbind.ns_t_srv, struct.pack('!HH', 1, 5)),
+			    (libbind.ns_t_opt, struct.pack('!HH', 10, 3) + 'ab'),
+			    (libbind.ns_t_cname, name('example.com') + 'trailing'),
+			    (libbind.ns_t_cname, '\xc0\x0c')):
+	    self.assertRaises(ValueError, decode, type, rdata)
+
+    def testlibbind_decode_rdataCompression(self):
+	"""Test whether decode_rdata follows compression pointers into the packet"""
+	packet = testutils.responses[2]['data']
+	msg = libbind.ns_msg(packet)
+	rr = libbind.ns_rr(msg, libbind.ns_s_an, 0)
+	rdata = libbind.ns_rr_rdata(rr)
+	self.assertEquals(libbind.decode_rdata(libbind.ns_t_mx, rdata, packet), (20, 'smtp1.oreilly.com'))
+	self.assertEquals(libbind.decode_rdata(libbind.ns_t_mx, rdata, bytearray(packet)), (20, 'smtp1.oreilly.com'))
+
+	# A pointer to itself must not loop
+	soa = '\xc0\x00' + '\0' * 22
+	self.assertRaises(ValueError, libbind.decode_rdata, libbind.ns_t_soa, soa, '\xc0\x00')
+
+    def testlibbind_decode_edns(self):
+	"""Test decode_edns on the fields and options of an OPT record"""
+	options = (struct.pack('!HHHBB', 8, 7, 1, 24, 0) + '\xc0\x00\x02' +
+		   struct.pack('!HH', 10, 8) + 'clientck' +
+		   struct.pack('!HH', 12, 3) + '\0\0\0' +
+		   struct.pack('!HH', 65001, 1) + 'x')
+	edns = libbind.decode_edns(4096, 0x01008000, options)
+	self.assertEquals(edns[:5], (4096, 1, 0, 1, 0x8000))
+	self.assertEquals(edns[5], ((8, (1, 24, 0, '192.0.2.0')), (10, ('clientck', '')), (12, 3), (65001, 'x')))
+
+	ecs6 = struct.pack('!HHHBB', 8, 6, 2, 16, 0) + ' \x01'
+	self.assertEquals(libbind.decode_edns(512, 0, ecs6)[5], ((8, (2, 16, 0, '2001::')),))
+	self.assertEquals(libbind.decode_edns(512, 0, None), (512, 0, 0, 0, 0, ()))
+
+	# A malformed option is left as it is; an option which does not fit is an error
+	bad = struct.pack('!HHHBB', 8, 5, 1, 24, 0) + '\xc0'
+	self.assertEquals(libbind.decode_edns(512, 0, bad)[5], ((8, bad[4:]),))
+	self.assertRaises(ValueError, libbind.decode_edns, 512, 0, struct.pack('!HH', 10, 8) + 'short')
+
+    def testlibbind_parse_question(self):
+	"""Test whether parse_question gives the header and question of parse_message"""
+	for message in testutils.queries + testutils.responses:
+	    parsed = libbind.parse_message(message['data'])
+	    question = parsed[2][libbind.ns_s_qd][0]
+	    self.assertEquals(libbind.parse_question(message['data']), parsed[:2] + question[:3])
+
+	packet = testutils.queries[0]['data']
+	noQuestion = packet[:4] + '\0\0' + packet[6:12]
+	self.assertEquals(libbind.parse_question(noQuestion)[2:], (None, None, None))
+
+	for bad in (packet[:11], packet[:-1], packet[:12] + '\xc0\x0c'):
+	    self.assertRaises(TypeError, libbind.parse_question, bad)
+
+    def testlibbind_parse_messageInvalid(self):
+	"""Test whether parse_message rejects bad data"""
+	self.assertRaises(TypeError, libbind.parse_message)
+	self.assertRaises(TypeError, libbind.parse_message, 'too short')
+	self.assertRaises(TypeError, libbind.parse_flags, 'not an ns_msg')
+	self.assertRaises(TypeError, libbind.parse_section, 'not an ns_msg', libbind.ns_s_qd)
+	self.assertRaises(ValueError, libbind.parse_section, self.msg, 10)
+
+    def testlibbind_parse_many(self):
+	"""Test whether parse_many parses a batch and reports the bad packets"""
+	packets = [message['data'] for message in self.queries + self.responses]
+	results, errors = libbind.parse_many(packets + ['bad'])
+
+	self.assertEquals(len(results), len(packets) + 1)
+	for i in range(0, len(packets)):
+	    self.assertEquals(results[i], libbind.parse_message(packets[i]))
+	assert results[-1] is None
+	self.assertEquals(len(errors), 1)
+	self.assertEquals(errors[0][0], len(packets))
+
+	self.assertRaises(TypeError, libbind.parse_many, 23)
+
+    def testlibbind_parse_messageBuffer(self):
+	"""Test whether parse_message accepts packets which are not strings"""
+	expected = libbind.parse_message(self.packetData)
+	self.assertEquals(libbind.parse_message(bytearray(self.packetData)), expected)
+	self.assertEquals(libbind.parse_message(buffer(self.packetData)), expected)
+	self.assertRaises(TypeError, libbind.parse_message, 23)
+
+    def testlibbind_ns_msgMapped(self):
+	"""Test whether ns_msg and parse_message work in place on a memory-mapped file"""
+	import mmap, tempfile
+
+	expected = libbind.parse_message(self.packetData)
+	temp = tempfile.TemporaryFile()
+	try:
+	    temp.write('xx' + self.packetData)
+	    temp.flush()
+	    mapping = mmap.mmap(temp.fileno(), 0, access=mmap.ACCESS_READ)
+	finally:
+	    temp.close()
+
+	packet = buffer(mapping, 2, len(self.packetData))
+	self.assertEquals(libbind.parse_message(packet), expected)
+	self.assertEquals(libbind.parse_many([packet, packet]), ([expected, expected], []))
+
+	msg = libbind.ns_msg(packet)
+	del packet
+	self.assertEquals(libbind.ns_msg_id(msg), expected[0])
+	self.assertEquals(libbind.parse_section(msg, libbind.ns_s_an), expected[2][libbind.ns_s_an])
+
+    def testlibbind_parse_messageThreads(self):
+	"""Test whether parse_message and parse_many work from several threads at once"""
+	from multiprocessing.pool import ThreadPool
+
+	packets = [message['data'] for message in self.queries + self.responses] * 50
+	expected = map(libbind.parse_message, packets)
+
+	pool = ThreadPool(4)
+	try:
+	    self.assertEquals(pool.map(libbind.parse_message, packets), expected)
+	    batches = pool.map(libbind.parse_many, [packets[i:i+30] for i in range(0, len(packets), 30)])
+	finally:
+	    pool.close()
+	    pool.join()
+
+	results = []
+	for batch, errors in batches:
+	    self.assertEquals(errors, [])
+	    results.extend(batch)
+	self.assertEquals(results, expected)
+
 def suite():
     s = unittest.TestSuite()
     s.addTest( unittest.makeSuite(libbindTestCase, 'test') )
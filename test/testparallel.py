@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# testparallel.py - Unit tests for the parallel parsing engine
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+import pickle
+import struct
+
+import Strangle
+import Strangle.parallel
+
+class parallelTestCase(unittest.TestCase):
+    """Tests for the process pool parser"""
+    def setUp(self):
+	self.messages = testutils.queries + testutils.responses
+	self.packets  = [message['data'] for message in self.messages] * 5
+	self.packets.insert(7, 'bad')
+
+    def testParse(self):
+	"""Test whether parallel.parse matches parse_many, in input order"""
+	messages, errors = Strangle.parallel.parse(self.packets, workers=2, chunksize=4)
+	expected, expectedErrors = Strangle.parse_many(self.packets)
+
+	self.assertEquals(errors, expectedErrors)
+	self.assertEquals(len(messages), len(expected))
+	for i in range(0, len(messages)):
+	    self.assertEquals(str(messages[i]), str(expected[i]))
+
+	remaining = iter(self.packets)
+	self.assertRaises(ValueError, Strangle.parallel.parse, remaining, workers=2, on_error='bogus')
+	self.assertEquals(list(remaining), self.packets)
+
+    def testFilter(self):
+	"""Test whether a filtered parse matches parse_many, with the original indexes"""
+	packets = self.packets + [self.packets[3][:-4]]
+	qfilter = Strangle.Filter("qr=1 or qtype=MX")
+	messages, errors = Strangle.parallel.parse(packets, workers=2, chunksize=4, filter=qfilter)
+	expected, expectedErrors = Strangle.parse_many(packets, filter=qfilter)
+
+	self.assertEquals(errors, expectedErrors)
+	self.assertEquals([index for index, reason in errors], [len(packets) - 1])
+	self.assertEquals([str(msg) for msg in messages], [str(msg) for msg in expected])
+	self.assertEquals(len(messages), len(qfilter.select(packets)))
+
+    def testImap(self):
+	"""Test whether parallel.imap tags every result with its index"""
+	results = list(Strangle.parallel.imap(iter(self.packets), workers=2, chunksize=3))
+	self.assertEquals([index for index, parsed, reason in results], range(0, len(self.packets)))
+	self.assertEquals(results[7][1], None)
+	assert results[7][2]
+	self.assertEquals(results[0][1], Strangle.libbind.parse_message(self.packets[0]))
+
+    def testPickle(self):
+	"""Test whether a DNSMessage survives pickling"""
+	for packet in self.packets[:6]:
+	    for lazy in (False, True):
+		msg  = Strangle.DNSMessage(packet, lazy=lazy)
+		copy = pickle.loads(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL))
+		self.assertEquals(str(copy), str(msg))
+
+	# A lazy message with a bad record only fails when it is pickled
+	badOwner = (struct.pack('!HHHHHH', 1, 0x8000, 0, 1, 0, 0) + '\xc0\x7f' +
+		    struct.pack('!HHIH', 1, 1, 0, 4) + '\0' * 4)
+	msg = Strangle.DNSMessage(badOwner, lazy=True)
+	self.assertRaises(Strangle.StrangleError, pickle.dumps, msg, pickle.HIGHEST_PROTOCOL)
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(parallelTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
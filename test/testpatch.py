@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+
+import Strangle
+from Strangle import libbind, patch
+
+class patchTestCase(unittest.TestCase):
+    """Tests for rewriting messages in place"""
+    def setUp(self):
+	self.response = testutils.responses[2]['data']	# oreilly.com MX, smallest TTL 3600
+
+    def ttls(self, packet):
+	return [record[3] for section in libbind.parse_message(str(packet))[2][1:] for record in section]
+
+    def testHeader(self):
+	"""Test whether the ID and flags are rewritten, and the rest kept"""
+	buffer = bytearray(self.response)
+	self.assertEquals(patch.message(buffer, id=4242, authoritative=True, recursionAvailable=False), 3600)
+
+	msg = Strangle.DNSMessage(str(buffer))
+	original = Strangle.DNSMessage(self.response)
+	self.assertEquals(msg.id, 4242)
+	self.assertEquals(msg.flags.authoritative, True)
+	self.assertEquals(msg.flags.recursionAvailable, False)
+	self.assertEquals(msg.flags.recursionDesired, original.flags.recursionDesired)
+	self.assertEquals(str(buffer[4:]), self.response[4:])
+
+	self.assertEquals(patch.message(buffer, answer=False, authenticData=True, checkingDisabled=True), 3600)
+	flags = libbind.parse_message(str(buffer))[1]
+	self.assertEquals((flags[libbind.ns_f_qr], flags[libbind.ns_f_ad], flags[libbind.ns_f_cd]), (0, 1, 1))
+	self.assertEquals(flags[libbind.ns_f_aa], 1)
+
+    def testTTLs(self):
+	"""Test whether every TTL is decreased, stopping at 0"""
+	before = self.ttls(self.response)
+	buffer = bytearray('xx' + self.response)
+	self.assertEquals(patch.message(buffer, ttlDecrement=100, offset=2), 3500)
+	self.assertEquals(self.ttls(buffer[2:]), [ttl - 100 for ttl in before])
+
+	self.assertEquals(patch.message(buffer, ttlDecrement=2 ** 32 - 1, offset=2), 0)
+	self.assertEquals(self.ttls(buffer[2:]), [0] * len(before))
+
+	query = bytearray(testutils.queries[0]['data'])
+	self.assertEquals(patch.message(query, ttlDecrement=10), None)
+	self.assertEquals(str(query), testutils.queries[0]['data'])
+
+    def testMalformed(self):
+	"""Test whether a malformed message is refused and left alone"""
+	truncated = bytearray(self.response[:-3])
+	self.assertRaises(ValueError, patch.message, truncated, id=1, ttlDecrement=1)
+	self.assertEquals(str(truncated), self.response[:-3])
+
+	self.assertRaises(ValueError, patch.message, bytearray(self.response), length=len(self.response) + 1)
+	self.assertRaises(ValueError, patch.message, bytearray(self.response), id=0x10000)
+	self.assertRaises(BufferError, patch.message, self.response, id=1)
+
+	buffer = bytearray(self.response)
+	self.assertRaises(ValueError, patch.message, buffer, ttlDecrement=-1)
+	self.assertEquals(str(buffer), self.response)
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(patchTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()
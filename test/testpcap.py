@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+#
+# testpcap.py - Unit tests for the capture file reader
+#
+# This file is part of Strangle.
+#
+# Strangle is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Strangle is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Strangle; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+
+import sys, testutils
+import unittest
+import socket, struct
+from StringIO import StringIO
+
+import Strangle
+from Strangle import pcap
+
+def udp4(src, dst, sport, dport, payload, vlan=False):
+    """An Ethernet frame (optionally VLAN tagged) with an IPv4 UDP datagram"""
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    ip  = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0,
+		      socket.inet_aton(src), socket.inet_aton(dst)) + udp
+    ether = '\x00' * 12
+    if vlan:
+	ether += struct.pack('!HH', 0x8100, 42)
+    return ether + struct.pack('!H', 0x0800) + ip
+
+def udp6(src, dst, sport, dport, payload):
+    """An Ethernet frame with an IPv6 UDP datagram"""
+    udp = struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+    ip  = struct.pack('!IHBB16s16s', 6 << 28, len(udp), 17, 64,
+		      socket.inet_pton(socket.AF_INET6, src),
+		      socket.inet_pton(socket.AF_INET6, dst)) + udp
+    return '\x00' * 12 + struct.pack('!H', 0x86dd) + ip
+
+def tcp4(src, dst, sport, dport, sequence, flags, payload):
+    """An Ethernet frame with an IPv4 TCP segment"""
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, sequence, 0, 5 << 4, flags, 8192, 0, 0) + payload
+    ip  = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp), 0, 0, 64, 6, 0,
+		      socket.inet_aton(src), socket.inet_aton(dst)) + tcp
+    return '\x00' * 12 + struct.pack('!H', 0x0800) + ip
+
+def pcapFile(frames):
+    """A classic little-endian pcap file of Ethernet frames"""
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+    for seconds, frame in frames:
+	data += struct.pack('<IIII', seconds, 500000, len(frame), len(frame)) + frame
+    return data
+
+def pcapngFile(frames, interface=0):
+    """A pcapng file of Ethernet frames, with nanosecond timestamps, on the given interface"""
+    def block(blockType, body):
+	body += '\x00' * (-len(body) % 4)
+	return struct.pack('<II', blockType, len(body) + 12) + body + struct.pack('<I', len(body) + 12)
+
+    data  = block(0x0a0d0d0a, struct.pack('<IHHq', 0x1a2b3c4d, 1, 0, -1))
+    data += block(1, struct.pack('<HHI', 1, 0, 65535) + struct.pack('<HHB3xHH', 9, 1, 9, 0, 0))
+    for seconds, frame in frames:
+	stamp = seconds * 1000000000
+	data += block(6, struct.pack('<IIIII', interface, stamp >> 32, stamp & 0xffffffff,
+				     len(frame), len(frame)) + frame)
+    return data
+
+class pcapTestCase(unittest.TestCase):
+    """Tests for reading DNS messages out of captures"""
+    def setUp(self):
+	self.query    = testutils.queries[0]
+	self.response = testutils.responses[2]
+
+	self.frames = [
+	    (1, udp4('10.0.0.1', '10.0.0.2', 3333, 53, self.query['data'])),
+	    (2, udp4('10.0.0.2', '10.0.0.1', 53, 3333, self.response['data'], vlan=True)),
+	    (3, udp4('10.0.0.1', '10.0.0.2', 3333, 80, 'not DNS')),
+	    (4, udp6('2001:db8::1', '2001:db8::2', 4444, 53, self.query['data'])),
+	    (5, udp4('10.0.0.1', '10.0.0.2', 3333, 53, 'garbage')),
+	]
+
+    def testPcap(self):
+	"""Test whether a classic pcap file gives the DNS messages in it"""
+	results = list(pcap.messages(StringIO(pcapFile(self.frames))))
+	self.assertEquals(len(results), 3)
+
+	timestamp, src, dst, msg = results[0]
+	self.assertEquals(timestamp, 1.5)
+	self.assertEquals(src, ('10.0.0.1', 3333))
+	self.assertEquals(dst, ('10.0.0.2', 53))
+	self.assertEquals(msg.id, self.query['id'])
+
+	timestamp, src, dst, msg = results[1]
+	self.assertEquals(src, ('10.0.0.2', 53))
+	self.assertEquals(msg.id, self.response['id'])
+	self.assertEquals(msg.sections['answer'].records[0].data, '20 smtp1.oreilly.com')
+
+	timestamp, src, dst, msg = results[2]
+	self.assertEquals(src, ('2001:db8::1', 4444))
+
+    def testFilter(self):
+	"""Test whether only the messages matching the filter are parsed"""
+	results = list(pcap.messages(StringIO(pcapFile(self.frames)), filter=Strangle.Filter("qr=0")))
+	self.assertEquals([(src, msg.id) for timestamp, src, dst, msg in results],
+			  [(('10.0.0.1', 3333), self.query['id']), (('2001:db8::1', 4444), self.query['id'])])
+
+    def testPcapng(self):
+	"""Test whether a pcapng file gives the same messages as a pcap file"""
+	expected = list(pcap.payloads(StringIO(pcapFile(self.frames))))
+	results  = list(pcap.payloads(StringIO(pcapngFile(self.frames))))
+	self.assertEquals([result[1:] for result in results], [result[1:] for result in expected])
+	self.assertEquals([result[0] for result in results], [1, 2, 4, 5])
+
+    def testPorts(self):
+	"""Test whether the port filter can be turned off"""
+	results = list(pcap.payloads(StringIO(pcapFile(self.frames)), ports=None))
+	self.assertEquals(len(results), 5)
+
+    def testTCP(self):
+	"""Test whether DNS over TCP is reassembled and split on the length prefix"""
+	stream = (struct.pack('!H', len(self.query['data'])) + self.query['data'] +
+		  struct.pack('!H', len(self.response['data'])) + self.response['data'])
+	cut = len(self.query['data']) + 10
+	flow = ('10.0.0.1', '10.0.0.2', 5555, 53)
+
+	frames = [
+	    (1, tcp4(*(flow + (999, 0x02, '')))),
+	    (2, tcp4(*(flow + (1000, 0x18, stream[:cut])))),
+	    (3, tcp4(*(flow + (1000, 0x18, stream[:cut])))),             # retransmission
+	    (4, tcp4(*(flow + (1000 + cut, 0x18, stream[cut:])))),
+	    (5, tcp4(*(flow + (1000 + len(stream), 0x11, '')))),
+	]
+	results = list(pcap.messages(StringIO(pcapFile(frames))))
+	self.assertEquals([msg.id for timestamp, src, dst, msg in results],
+			  [self.query['id'], self.response['id']])
+	self.assertEquals([timestamp for timestamp, src, dst, msg in results], [2.5, 4.5])
+
+	# The last message may come in the segment which closes the connection.
+	frames[3] = (4, tcp4(*(flow + (1000 + cut, 0x19, stream[cut:]))))
+	del frames[4]
+	results = list(pcap.messages(StringIO(pcapFile(frames))))
+	self.assertEquals([msg.id for timestamp, src, dst, msg in results],
+			  [self.query['id'], self.response['id']])
+
+	streams = pcap.TCPStreams()
+	streams.add(flow, tcp4(*(flow + (999, 0x02, '')))[34:])
+	self.assertEquals(streams.add(flow, tcp4(*(flow + (1000, 0x19, stream)))[34:]),
+			  [self.query['data'], self.response['data']])
+	self.assertEquals(len(streams.streams), 0)
+
+	results = list(pcap.messages(StringIO(pcapFile(frames)), tcp=False))
+	self.assertEquals(results, [])
+
+    def testMapped(self):
+	"""Test whether a memory-mapped capture gives the same messages as a read one"""
+	import os, tempfile
+
+	for data in (pcapFile(self.frames), pcapngFile(self.frames)):
+	    fd, name = tempfile.mkstemp()
+	    try:
+		os.write(fd, data)
+		os.close(fd)
+
+		expected = list(pcap.payloads(StringIO(data)))
+		results  = list(pcap.payloads(name, mapped=True))
+		self.assertEquals(len(results), len(expected))
+		for result, wanted in zip(results, expected):
+		    self.assertEquals(result[:3], wanted[:3])
+		    self.assertEquals(type(result[3]), buffer)
+		    self.assertEquals(str(result[3]), wanted[3])
+
+		results = list(pcap.messages(name, mapped=True))
+		self.assertEquals([msg.parsed for timestamp, src, dst, msg in results],
+				  [msg.parsed for timestamp, src, dst, msg in pcap.messages(StringIO(data))])
+	    finally:
+		os.remove(name)
+
+	self.assertEquals(list(pcap.frames(StringIO(''), mapped=False)), [])
+
+    def testMappedLengths(self):
+	"""Test whether a mapped pcapng packet stops at the end of its block"""
+	import mmap
+
+	# Claim 40 more bytes than the first frame has, which the next block holds
+	data   = pcapngFile(self.frames)
+	length = struct.unpack_from('<I', data, 80)[0]
+	data   = data[:80] + struct.pack('<I', length + 40) + data[84:]
+
+	mapping = mmap.mmap(-1, len(data))
+	mapping.write(data)
+	expected = list(pcap.frames(StringIO(data)))
+	results  = list(pcap.frames(mapping, mapped=True))
+	self.assertEquals([str(result[2]) for result in results], [result[2] for result in expected])
+	assert len(results[0][2]) < length + 4
+
+    def testBadFile(self):
+	"""Test whether a file which is not a capture is rejected"""
+	self.assertRaises(pcap.PcapError, list, pcap.frames(StringIO('not a capture file')))
+	self.assertEquals(list(pcap.frames(StringIO(''))), [])
+
+	# A packet on an interface which was never described
+	self.assertBad(pcapngFile(self.frames, interface=1))
+
+	# Packet blocks too short for their fixed fields
+	header = pcapngFile([])
+	for blockType in (6, 2, 3):
+	    self.assertBad(header + struct.pack('<II', blockType, 14) + 'xx' + struct.pack('<I', 14))
+
+	# A record longer than any capture would have
+	data = pcapFile(self.frames[:1])
+	self.assertBad(data[:32] + struct.pack('<I', pcap.MAXIMUM_SNAPLEN + 1) + data[36:])
+
+    def assertBad(self, data):
+	"""Check that a capture is rejected whether it is read or mapped"""
+	import mmap
+
+	self.assertRaises(pcap.PcapError, list, pcap.frames(StringIO(data)))
+	mapping = mmap.mmap(-1, len(data))
+	mapping.write(data)
+	self.assertRaises(pcap.PcapError, list, pcap.frames(mapping, mapped=True))
+
+def suite():
+    s = unittest.TestSuite()
+    s.addTest( unittest.makeSuite(pcapTestCase, 'test') )
+    return s
+
+if __name__ == "__main__":
+    unittest.main()